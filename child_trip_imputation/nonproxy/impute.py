@@ -1,14 +1,18 @@
-from tqdm import tqdm
+import os
 import pandas as pd
+import numpy as np
 from datetime import timedelta
 
 # Internal imports
 import settings
 from utils.io import DBIO
-from utils.misc import cat_joint_trip_id
-from utils.trip_counter import TripCounter, TRIP_COUNTER
+from utils.misc import cat_ids
+from utils.participation import MemberParticipation
+from utils.trip_counter import TRIP_COUNTER
+from utils.travel_dates import TRAVEL_DATES
+from utils.id_registry import ID_REGISTRY
 from nonproxy.populator import NonProxyTripPopulator
-from nonproxy.timespace_buffer import fix_existing_joint_trips
+from nonproxy.timespace_buffer import fix_existing_joint_trips, sweep_joint_trip_buffer, household_fingerprints
 
 # Constants
 # Extract column names for origin and destination lat/lon
@@ -17,27 +21,42 @@ COLNAMES = settings.COLUMN_NAMES
 
 JOINT_TRIP_ID_NAME = COLNAMES['JOINT_TRIP_ID']
 JOINT_TRIPNUM_COL = COLNAMES['JOINT_TRIPNUM']
+HH_ID_NAME = COLNAMES['HH_ID']
+HHMEMBER_PREFIX = COLNAMES['HHMEMBER']
+FINGERPRINT_FILE = 'joint_trip_fingerprints.parquet'
 
 class ImputeNonProxyTrips:
     
     def impute_proxy_trips(self) -> None:
+        assert isinstance(settings.JOINT_TRIP_BUFFER, dict)
+        
         # Flag all unreported joint trips and update DB object.
-        try:
-            # Try to get trips for the current step
-            trip_df = DBIO.get_table('trip', step = 'flag_unreported_joint_trips')
-        except AssertionError:
-            # Otherwise, get latest trips table and run the step            
-            assert isinstance(settings.JOINT_TRIP_BUFFER, dict)
-            
-            kwargs = {'trips_df': DBIO.get_table('trip'), **settings.JOINT_TRIP_BUFFER}        
-            flagged_trips_df = self.flag_unreported_joint_trips(**kwargs)
+        refreshed = False
+        if settings.JOINT_TRIP_BUFFER.get('INCREMENTAL', False):
+            # Re-flag only the households that changed since the cached run
+            kwargs = {'trips_df': DBIO.get_table('trip'), **settings.JOINT_TRIP_BUFFER}
+            flagged_trips_df, fingerprints, refreshed = self.flag_unreported_joint_trips_incremental(**kwargs)
             
-            # Update the class DBIO object data.
+            # Update the class DBIO object data, then store the fingerprints of the cached result. 
+            # If the run stops in between, the old fingerprints still mark the changed households for re-flagging.
             DBIO.update_table('trip', flagged_trips_df, step_name = 'flag_unreported_joint_trips')
+            self.save_fingerprints(fingerprints)
+        else:
+            try:
+                # Try to get trips for the current step
+                trip_df = DBIO.get_table('trip', step = 'flag_unreported_joint_trips')
+            except AssertionError:
+                # Otherwise, get latest trips table and run the step            
+                kwargs = {'trips_df': DBIO.get_table('trip'), **settings.JOINT_TRIP_BUFFER}        
+                flagged_trips_df = self.flag_unreported_joint_trips(**kwargs)
+                
+                # Update the class DBIO object data.
+                DBIO.update_table('trip', flagged_trips_df, step_name = 'flag_unreported_joint_trips')
         
         # Impute all missing reported joint trips and update DB object.        
         try:
-            # Try to get trips for the current step
+            # Try to get trips for the current step, unless the flagged trips changed
+            assert not refreshed, 'Flagged trips changed, re-run the step'
             trip_df = DBIO.get_table('trip', step = 'impute_reported_joint_trips')
             
         except AssertionError:
@@ -50,6 +69,25 @@ class ImputeNonProxyTrips:
         
         return
     
+    def joint_trip_buffer_sweep(self) -> None:
+        """
+        Runs the joint trip flagging for every buffer setting in JOINT_TRIP_BUFFER_SWEEP in one pass and saves the counts.
+        This must run before impute_proxy_trips, otherwise the household members will already be corrected.
+        """
+        assert isinstance(settings.JOINT_TRIP_BUFFER, dict)
+        assert isinstance(settings.JOINT_TRIP_BUFFER_SWEEP, list), 'JOINT_TRIP_BUFFER_SWEEP not a list'
+        
+        trips_df = DBIO.get_table('trip')
+        assert isinstance(trips_df, pd.DataFrame), 'Trips table is not a DataFrame'
+        
+        index = settings.JOINT_TRIP_BUFFER.get('INDEX', 'dense')
+        sweep_df = sweep_joint_trip_buffer(trips_df, settings.JOINT_TRIP_BUFFER_SWEEP, index)
+        
+        print(sweep_df)
+        DBIO.to_csv(sweep_df, 'joint_trip_buffer_sweep')
+        
+        return
+    
     def joint_trip_member_table(self, persons_df: pd.DataFrame, trips_df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
         """
         TODO: This is a static method and could be moved to utils?
@@ -69,44 +107,29 @@ class ImputeNonProxyTrips:
                 and a similar dataframe but for non-joint trip trips.
         """    
             
-        # Create member-trip table, replace any values > 1 with 0 (i.e., 995 missing values)    
+        # Create member-trip participation, any value other than 1 is not a member (e.g., 0 or 995 missing values)
         idx_cols = [settings.get_index_name(x) for x in ['person', 'household', 'day', 'trip']]
         idx_cols += [JOINT_TRIPNUM_COL, COLNAMES['DAYNUM']]
         
-        trips = trips_df.reset_index().set_index(idx_cols)
-        trips = trips.filter(regex=COLNAMES['HHMEMBER']).clip(0, 2).replace(2, 0)
+        participation = MemberParticipation(trips_df)
+        member_count = participation.member_counts()
         
         # Trip count checks
         n_trips = trips_df.shape[0]
-        expected_n_trips = trips.sum().sum()
+        expected_n_trips = member_count.sum()
         deficit_n_trips = expected_n_trips - n_trips    
         
         print(f"Trips in trip table: {n_trips}")
         print(f"Expected trips as reported for household members (i.e., including joint trips): {expected_n_trips}")
         print(f"Joint trips to impute: {deficit_n_trips}")  
-            
-        # Drop non-joint trips
-        assert isinstance(COLNAMES['TRIP_ID'], str), 'TRIP_ID name not a string'
-
-        member_count = trips.sum(axis=1)
-        nonjoint_trip_ids = trips.loc[member_count == 1].index.get_level_values(COLNAMES['TRIP_ID'])    
-        joint_trip_ids = trips.loc[member_count > 1].index.get_level_values(COLNAMES['TRIP_ID'])   
-            
-        # Flatten the table
-        trips = pd.melt(
-            trips.reset_index(),
-            id_vars=trips.index.names,
-            var_name=COLNAMES['PNUM'],
-            )
-        
-        # Drop empty member slots    
-        trips = trips[trips.value == 1].drop(columns='value')
         
-        # Get person number
+        assert isinstance(COLNAMES['TRIP_ID'], str), 'TRIP_ID name not a string'
         assert isinstance(COLNAMES['PNUM'], str), 'PNUM_COL not a string'
-        assert isinstance(COLNAMES['HHMEMBER'], str), 'HHMEMBER_PREFIX not a string'
-        
-        trips.person_num = trips.person_num.str.replace(COLNAMES['HHMEMBER'], '').astype(int)
+            
+        # Flatten the table, one row per participating member-trip
+        trip_rows, member_nums = participation.edges()
+        trips = trips_df.reset_index()[idx_cols].iloc[trip_rows].reset_index(drop=True)
+        trips[COLNAMES['PNUM']] = member_nums
             
         # Create member ID table
         member_id = persons_df[[COLNAMES['HH_ID'], COLNAMES['PNUM']]].reset_index().rename(columns={COLNAMES['PER_ID']: 'hh_member_id'})
@@ -116,8 +139,9 @@ class ImputeNonProxyTrips:
         trips = trips.rename(columns={COLNAMES['PNUM']: 'hh_member_num'})
 
         # Separate joint and non-joint trips    
-        nonjoint_trips = trips[trips.trip_id.isin(nonjoint_trip_ids)]
-        joint_trips = trips[trips.trip_id.isin(joint_trip_ids)]
+        is_joint = member_count[trip_rows] > 1
+        nonjoint_trips = trips[~is_joint]
+        joint_trips = trips[is_joint]
         
         return joint_trips, nonjoint_trips
     
@@ -125,26 +149,108 @@ class ImputeNonProxyTrips:
         # Default parameters
         distance_threshold = kwargs.get('DISTANCE', 0.5)
         time_threshold = timedelta(minutes=kwargs.get('TIME', 30))
+        batched = kwargs.get('BATCHED', False)
+        index = kwargs.get('INDEX', 'dense')
+        workers = kwargs.get('WORKERS')
+        diagnostics = kwargs.get('DIAGNOSTICS')
+        
+        # Diagnostics directory is relative to the output directory
+        if diagnostics and settings.OUTPUT_DIR:
+            diagnostics = os.path.join(settings.OUTPUT_DIR, diagnostics)
 
         # Initialize empty joint_trip_num column
         trips_df[JOINT_TRIPNUM_COL] = pd.Series(995, dtype=int, index=trips_df.index, name=JOINT_TRIPNUM_COL)
         trips_df[JOINT_TRIP_ID_NAME] = pd.Series(995, dtype=int, index=trips_df.index, name=JOINT_TRIP_ID_NAME)
         
         # 1. For each member-trip check if that person already has a trip but just wasn't reported as a joint trip member
-        fixed_trips_df = fix_existing_joint_trips(trips_df, distance_threshold, time_threshold)
+        fixed_trips_df = fix_existing_joint_trips(trips_df, distance_threshold, time_threshold, batched, index, workers, diagnostics)
         
         # Update the joint trip id
         assert isinstance(JOINT_TRIP_ID_NAME, str), 'JOINT_TRIP_ID_NAME not a string'
         assert isinstance(JOINT_TRIPNUM_COL, str), 'JOINT_TRIPNUM_COL not a string'
         is_joint = fixed_trips_df[JOINT_TRIPNUM_COL] != 995        
-        fixed_trips_df.loc[is_joint, JOINT_TRIP_ID_NAME] = fixed_trips_df.loc[is_joint].apply(cat_joint_trip_id, axis=1)  
+        if is_joint.any():
+            joint_trips = fixed_trips_df.loc[is_joint, [HH_ID_NAME, JOINT_TRIPNUM_COL]].to_numpy()
+            fixed_trips_df.loc[is_joint, JOINT_TRIP_ID_NAME] = cat_ids(joint_trips[:, 0], joint_trips[:, 1], 2)
         
         return fixed_trips_df
     
+    def flag_unreported_joint_trips_incremental(self, trips_df, **kwargs) -> tuple[pd.DataFrame, pd.Series, bool]:
+        """
+        Incremental version of flag_unreported_joint_trips. 
+        A fingerprint of the inputs of each household is stored in the cache, and on the next run only households 
+        whose fingerprint changed are re-flagged. The flagged columns of the unchanged households are spliced in 
+        from the cached flag_unreported_joint_trips result, which is valid because households are flagged independently.
+        The new fingerprints are returned rather than stored, see save_fingerprints, so they are only stored once the 
+        flagged trips they describe are cached.
+
+        Args:
+            trips_df (pd.DataFrame): Trips dataframe, before the joint trips are flagged
+
+        Returns:
+            tuple[pd.DataFrame, pd.Series, bool]: The flagged trips, the fingerprint of each household and whether any household was re-flagged
+        """
+        assert isinstance(HH_ID_NAME, str), 'HH_ID_NAME not a string'
+        
+        distance_threshold = kwargs.get('DISTANCE', 0.5)
+        time_threshold = timedelta(minutes=kwargs.get('TIME', 30))
+        fingerprints = household_fingerprints(trips_df, distance_threshold, time_threshold)
+        
+        # Find the cached fingerprints and flagged trips from the previous run, if any
+        step = 'flag_unreported_joint_trips'
+        fingerprint_path = os.path.join(settings.CACHE_DIR, FINGERPRINT_FILE) if settings.CACHE_DIR else None
+        cached_path = DBIO.cache_log.loc[step, 'cached_table'] if step in DBIO.cache_log.index else None
+        
+        changed_hh_ids = fingerprints.index
+        if fingerprint_path and cached_path and os.path.isfile(fingerprint_path) and os.path.isfile(cached_path):
+            cached_fingerprints = pd.read_parquet(fingerprint_path)['fingerprint'].astype(np.uint64)
+            
+            # Reindex with a fill value so the fingerprints stay uint64, a float cast would lose precision
+            is_cached = fingerprints.index.isin(cached_fingerprints.index)
+            is_same = is_cached & (fingerprints == cached_fingerprints.reindex(fingerprints.index, fill_value=0)).to_numpy()
+            changed_hh_ids = fingerprints.index[~is_same]
+        
+        print(f'Re-flagging joint trips for {len(changed_hh_ids)} of {len(fingerprints)} changed households')
+        is_changed = trips_df[HH_ID_NAME].isin(changed_hh_ids)
+        
+        if is_changed.all():
+            flagged_trips_df = self.flag_unreported_joint_trips(trips_df, **kwargs)
+        else:
+            # Splice the flagged columns of the unchanged households in from the cache
+            cached_df = pd.read_parquet(cached_path)
+            flag_cols = cached_df.filter(regex=HHMEMBER_PREFIX).columns.tolist()
+            flag_cols += [JOINT_TRIPNUM_COL, JOINT_TRIP_ID_NAME, 'corrected_hh_members']
+            
+            flagged_ls = [trips_df[~is_changed].copy()]
+            flagged_ls[0][flag_cols] = cached_df.loc[flagged_ls[0].index, flag_cols]
+            
+            if is_changed.any():
+                flagged_ls.append(self.flag_unreported_joint_trips(trips_df[is_changed].copy(), **kwargs))
+            
+            flagged_trips_df = pd.concat(flagged_ls).loc[trips_df.index]
+        
+        return flagged_trips_df, fingerprints, len(changed_hh_ids) > 0
+    
+    def save_fingerprints(self, fingerprints: pd.Series) -> None:
+        """
+        Stores the household fingerprints in the cache, if cache dir is set. 
+        Must only be called after the flagged trips they describe are cached with DBIO.update_table.
+
+        Args:
+            fingerprints (pd.Series): The fingerprint of each household, see flag_unreported_joint_trips_incremental
+        """
+        
+        if settings.CACHE_DIR:
+            fingerprints.to_frame().to_parquet(os.path.join(settings.CACHE_DIR, FINGERPRINT_FILE))
+        
+        return
+    
     def impute_reported_joint_trips(self, persons_df, trips_df):
         
-        # Initialize trip counter to this point
+        # Initialize trip counter, travel date index and id registry to this point
         TRIP_COUNTER.initialize(trips_df)       
+        TRAVEL_DATES.initialize(trips_df)
+        ID_REGISTRY.initialize(trips_df)
             
         # 2. Flatten and separate trip table into joint and non-joint trips
         joint_trips, nonjoint_trips = self.joint_trip_member_table(persons_df, trips_df)    
@@ -162,33 +268,23 @@ class ImputeNonProxyTrips:
 
         # Trim and sort index for performance
         assert isinstance(COLNAMES['TRIP_ID'], str), 'TRIP_ID name not a string'
-        unlabeled_joint_trips = unlabeled_joint_trips.drop(columns=[JOINT_TRIPNUM_COL, COLNAMES['DAY_ID']]).sort_values(COLNAMES['TRIP_ID'])
+        unlabeled_joint_trips = unlabeled_joint_trips.drop(columns=[JOINT_TRIPNUM_COL, COLNAMES['DAY_ID']]).sort_values(COLNAMES['TRIP_ID'], kind='stable')
         
         # Initialize trip populator class to hold the data and manage trip counts
         Populator = NonProxyTripPopulator(persons_df, trips_df)
         
-        new_trips_ls = []
-        # idx_names = [TRIP_ID_NAME, HH_ID_NAME, DAYNUM_COL]
-        idx_names = [COLNAMES[x] for x in ['TRIP_ID', 'HH_ID', 'DAYNUM']]
-
-        # For each household member trip that is not self reported, create a new joint trip
         print("Imputing missing proxy reported joint trips...")
-        for host_idx, members in tqdm(unlabeled_joint_trips.groupby(idx_names)):
-            host_trip_id, host_hh_id, host_daynum = host_idx
-            
-            # Get host trip and update the joint trip number
-            host_trip = trips_df.loc[host_trip_id].copy()        
-            host_trip[JOINT_TRIPNUM_COL] = TRIP_COUNTER.iterate_counter('joint_trip', host_hh_id)
-            
-            for i, hh_member_id, hh_member_num in members[['hh_member_id', 'hh_member_num']].itertuples():
-                # Populate new trip            
-                new_trip = Populator.populate(host_trip, hh_member_id, hh_member_num)
-                new_trips_ls.append(new_trip)
+        # Each host trip is a new joint trip, shared by all the member trips imputed from it
+        host_trips = trips_df.loc[unlabeled_joint_trips[COLNAMES['TRIP_ID']].unique()].copy()
+        
+        joint_trip_nums, joint_trip_ids = TRIP_COUNTER.allocate('joint_trip', host_trips[HH_ID_NAME].to_numpy())
         
-        new_trips_df = pd.concat(new_trips_ls, axis=1, ignore_index=False).T
-        new_trips_df.index.name = COLNAMES['TRIP_ID']
+        host_trips[JOINT_TRIPNUM_COL] = joint_trip_nums
+        host_trips[JOINT_TRIP_ID_NAME] = joint_trip_ids
         
-        assert len(set(new_trips_df.index).intersection(trips_df.index)) == 0, "New trips should not have the same index as existing trips"
+        # For each household member trip that is not self reported, create a new joint trip
+        new_trips_df = Populator.populate(host_trips, unlabeled_joint_trips)
+        TRAVEL_DATES.update(new_trips_df[COLNAMES['PER_ID']], new_trips_df[COLNAMES['TRAVELDATE']])
         
         combined_trips_df = pd.concat([trips_df, new_trips_df])
         combined_trips_df['imputed_joint_trip'] = 0
@@ -0,0 +1,118 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Internal imports
+import settings
+
+# Constants
+assert isinstance(settings.COLUMN_NAMES, dict), 'COLUMN_NAMES not a dict'
+COLNAMES = settings.COLUMN_NAMES
+
+TRIP_ID_NAME = COLNAMES['TRIP_ID']
+HH_ID_NAME = COLNAMES['HH_ID']
+DAYNUM_COL = COLNAMES['DAYNUM']
+
+assert isinstance(TRIP_ID_NAME, str), 'TRIP_ID_NAME not a string'
+assert isinstance(HH_ID_NAME, str), 'HH_ID_NAME not a string'
+assert isinstance(DAYNUM_COL, str), 'DAYNUM_COL not a string'
+
+
+class PairDiagnostics:
+    """
+    Diagnostics sink for the joint trip time-space buffer.
+    Every candidate trip pair inside the time window is written with its measured distance and time deltas,
+    so near-miss joint trips can be inspected after the run.
+
+    Pairs are buffered as Arrow record batches and flushed to a Parquet dataset partitioned by day number
+    whenever the buffer reaches batch_size rows, so memory stays bounded no matter how many pairs are found.
+    The sink holds no open file handles, so it can be pickled and sent to worker processes,
+    each with its own prefix so the part files do not collide.
+    """
+
+    def __init__(self, path: str, batch_size: int = 100000, prefix: str = 'part') -> None:
+        """
+        Args:
+            path (str): Root directory of the Parquet dataset
+            batch_size (int, optional): Maximum number of pairs held in memory before flushing. Defaults to 100000.
+            prefix (str, optional): Part file name prefix. Defaults to 'part'.
+        """
+        assert batch_size > 0, 'Diagnostics batch size must be positive'
+
+        self.path = path
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.batches = []
+        self.n_buffered = 0
+        self.n_flushed = 0
+        self.n_written = 0
+
+    def clear(self) -> None:
+        """
+        Removes any existing dataset at the path, so pairs from a previous run are not mixed in.
+        """
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+
+    def write(self, hh_trips: pd.DataFrame, a_rows: np.ndarray, b_rows: np.ndarray, deltas: dict, is_within: np.ndarray) -> None:
+        """
+        Buffers the candidate pairs, flushing every time batch_size rows are reached.
+
+        Args:
+            hh_trips (pd.DataFrame): The trips dataframe the pair rows refer to, indexed by household id and day number
+            a_rows (np.ndarray): The row positions of the A side of each pair
+            b_rows (np.ndarray): The row positions of the B side of each pair
+            deltas (dict): The distance and time deltas of each pair, see measure_pairs
+            is_within (np.ndarray): Whether each pair is inside the distance buffer
+        """
+
+        trip_ids = hh_trips[TRIP_ID_NAME].to_numpy()
+        hh_ids = hh_trips.index.get_level_values(HH_ID_NAME).to_numpy()
+        day_nums = hh_trips.index.get_level_values(DAYNUM_COL).to_numpy()
+
+        columns = {
+            HH_ID_NAME: hh_ids[a_rows],
+            DAYNUM_COL: day_nums[a_rows],
+            'trip_id_a': trip_ids[a_rows],
+            'trip_id_b': trip_ids[b_rows],
+            'odist': deltas['odist'],
+            'ddist': deltas['ddist'],
+            'otimedelta': deltas['otimedelta'] / np.timedelta64(1, 's'),
+            'dtimedelta': deltas['dtimedelta'] / np.timedelta64(1, 's'),
+            'is_within': is_within
+        }
+
+        # Slice into chunks so a single large write cannot exceed the buffer
+        for start in range(0, a_rows.size, self.batch_size):
+            chunk = {name: values[start:start + self.batch_size] for name, values in columns.items()}
+            self.batches.append(pa.RecordBatch.from_pydict(chunk))
+            self.n_buffered += chunk['trip_id_a'].size
+
+            if self.n_buffered >= self.batch_size:
+                self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes the buffered record batches to the dataset as new part files.
+        """
+        if self.n_buffered == 0:
+            return
+
+        table = pa.Table.from_batches(self.batches)
+        basename = f'{self.prefix}-{self.n_flushed}-{{i}}.parquet'
+        pq.write_to_dataset(table, self.path, partition_cols=[DAYNUM_COL], basename_template=basename)
+
+        self.n_written += self.n_buffered
+        self.n_flushed += 1
+        self.batches = []
+        self.n_buffered = 0
+
+    def close(self) -> None:
+        """
+        Flushes any remaining pairs.
+        """
+        self.flush()
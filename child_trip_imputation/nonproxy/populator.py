@@ -1,14 +1,16 @@
-import re
 import pandas as pd
+import pandas.api.types as ptypes
 import numpy as np
 
 # Local imports
 import settings
 from utils.trip_counter import TRIP_COUNTER
+from utils.travel_dates import TRAVEL_DATES
+from utils.id_registry import ID_REGISTRY
+from utils.column_actions import ColumnAction, compile_plan, plan_fields
 
 # Extract column names for origin and destination lat/lon
 assert isinstance(settings.COLUMN_NAMES, dict), 'COLUMN_NAMES not a dict'
-assert isinstance(settings.IMPUTATION_CONFIGS, dict), 'IMPUTATION_CONFIGS not a dict'
 
 COLNAMES = settings.COLUMN_NAMES
 
@@ -21,20 +23,17 @@ TRAVELDATE_COL = COLNAMES['TRAVELDATE']
 DRIVER_COL = COLNAMES['DRIVER']
 JOINT_TRIP_ID_NAME = COLNAMES['JOINT_TRIP_ID']
 JOINT_TRIPNUM_COL = COLNAMES['JOINT_TRIPNUM']
-COL_ACTIONS_PATH = settings.IMPUTATION_CONFIGS.get('impute_reported_joint_trips')
-
-assert isinstance(COL_ACTIONS_PATH, str), 'impute_reported_joint_trips not a string'
 
 class NonProxyTripPopulator:
     """
-    Create a new trip from a host trip and a non-proxy household member, 
-    the attributes are populated using the defined class methods listed in the trip_column_actions.csv file
+    Create new trips from host trips and non-proxy household members, 
+    the attributes are populated using the defined class methods listed in the trip_column_actions.csv file.
+    
+    The new trips are populated in bulk, each action is applied as a column operation over all new trips at once.
     """
     
     def __init__(self, person_df: pd.DataFrame, trips_df: pd.DataFrame) -> None:
-        assert isinstance(COL_ACTIONS_PATH, str), f'COL_ACTIONS_PATH {COL_ACTIONS_PATH} not a string'
-        
-        self.actions = pd.read_csv(COL_ACTIONS_PATH)
+        self.plan = JOINT_TRIP_PLAN
         self.trips_df = trips_df
         self.person_df = person_df
         
@@ -44,152 +43,163 @@ class NonProxyTripPopulator:
         # TRIP_COUNTER.initialize(trips_df, person_df)
         
         
-    def populate(self, host_trip: pd.DataFrame, member_id: int|str, member_num: int|str) -> pd.DataFrame:         
-        
-        # Copy host trip and update column value
-        new_trip = host_trip.copy()
+    def populate(self, host_trips: pd.DataFrame, members: pd.DataFrame) -> pd.DataFrame:
+        """
+        Populates a new trip for each member row from its host trip.
+        The host trip columns are gathered once for all new trips, then each action replaces a whole column.
+
+        Args:
+            host_trips (pd.DataFrame): The host trips indexed by trip id, with the new joint trip number and id already set
+            members (pd.DataFrame): Flattened member table, one row per new trip with the host trip_id, hh_member_id and hh_member_num
+
+        Returns:
+            pd.DataFrame: The new trips indexed by the new trip id, with the same columns and dtypes as the host trips
+        """
         
         # Reserved columns - meaning they are not checked for in the trip_column_actions.csv file
         reserved_cols = [JOINT_TRIPNUM_COL, JOINT_TRIP_ID_NAME, 'tour_id', 'tour_num', 'tour_type']
         
-        missing = set(new_trip.index).difference(set(self.actions.colname.to_list() + reserved_cols))
-        assert len(missing) == 0, f'Columns {missing} not in trip_column_actions.csv'        
-
-        locals_dict = {'host_trip': host_trip, 'member_id': member_id, 'member_num': member_num}            
+        missing = set(host_trips.columns).difference(set(plan_fields(self.plan) + reserved_cols))
+        assert len(missing) == 0, f'Columns {missing} not in trip_column_actions.csv'
         
-        # Loops through each column and applies the method to the host trip
-        # Using dict comprehension because it is byte compiled and almost twice as fast as standard for loop
-        values = {colname: self.populate_column(colname, method, **locals_dict) for i, colname, method in self.actions.itertuples()}        
-        values = pd.Series(values)
+        # Gather the host trip of each new trip
+        member_host_trips = host_trips.loc[members[TRIP_ID_NAME]]
+        member_ids = members['hh_member_id'].to_numpy()
         
-        # Update the new trip with the values
-        new_trip.update(values)
-                    
-        # Update the trip id        
+        # Pull the new trip numbers and trip ids from the trip_counter
         # Simply concatenating the ID is problematic because the trip number is inconsistent with trip_num
-        # Need to pull the new trip_id from the trip_counter and joint_trip_counter
-        assert isinstance(TRIP_ID_NAME, str), f'TRIP_ID name {TRIP_ID_NAME} not a string'
+        trip_nums, new_trip_ids = self.iterate_trip_counter(member_ids)
         
-        new_trip_id = TRIP_COUNTER.trip.loc[member_id, TRIP_ID_NAME]
-        new_joint_trip_id = TRIP_COUNTER.joint_trip.loc[new_trip[HH_ID_NAME], JOINT_TRIP_ID_NAME]
+        locals_dict = {
+            'host_trips': member_host_trips, 
+            'member_ids': member_ids, 
+            'member_nums': members['hh_member_num'].to_numpy(),
+            'trip_nums': trip_nums
+            }
         
-        # new_trip_id = self.trip_counter.loc[member_id, TRIP_ID_NAME]
-        # new_joint_trip_id = self.joint_trip_counter.loc[new_trip[HH_ID_NAME], JOINT_TRIP_ID_NAME]
+        # Host columns are the default, the arrays keep the host dtypes
+        columns = {colname: member_host_trips[colname].array for colname in member_host_trips.columns}
         
-        assert new_trip_id not in self.trips_df.index, f'Trip id {new_trip_id} already exists'
-        assert new_joint_trip_id not in self.trips_df[JOINT_TRIP_ID_NAME], f'Joint trip id {new_joint_trip_id} already exists'
+        # Apply each action to the whole column, actions for columns not in the trips table are skipped
+        for action in self.plan:
+            for colname in action.fields:
+                if colname in columns:
+                    value = self.populate_column(colname, action, **locals_dict)
+                    if value is not None:
+                        columns[colname] = value
         
-        new_trip[JOINT_TRIP_ID_NAME] = new_joint_trip_id
-        new_trip.name = new_trip_id
+        new_trips = pd.DataFrame(columns, index=pd.Index(new_trip_ids, name=TRIP_ID_NAME))
         
-        return new_trip
-    
-    def populate_column(self, colname, method: str, **kwargs) -> str|int|float|None:
-        # Update locals dict
-        kwargs['colname'] = colname            
+        # Validate the new ids against the existing ids, the joint trip id is shared by the members so is checked per host
+        ID_REGISTRY.register('trip', new_trips.index)
+        ID_REGISTRY.register('joint_trip', host_trips[JOINT_TRIP_ID_NAME])
         
-        # Check if the method has a direct set value argument
-        value = self.set_value(method)
+        return new_trips
+    
+    def populate_column(self, colname, action: ColumnAction, **kwargs) -> str|int|float|np.ndarray|pd.api.extensions.ExtensionArray|None:
+        # Constants are already evaluated in the compiled plan
+        if action.is_constant:
+            return action.value
         
         # otherwise call the method
-        if value is None:
-            assert hasattr(self, method), f'No method {method} found'
-            value = getattr(self, method)(**kwargs)
-            
-        return value
+        kwargs['colname'] = colname
+        
+        return getattr(self, action.method)(**kwargs)
     
-    def set_value(self, method: str) -> str|int|float|None:
+    def iterate_trip_counter(self, member_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
         """
-        Check if the method has a direct set value argument.
-        If so, return the value, otherwise return None
+        Allocates the next trip number and trip id from the trip counter for each new trip, in member table order.
 
         Args:
-            method (str): string name of the method
+            member_ids (np.ndarray): The person id of each new trip
 
         Returns:
-            str|int|float|None: The value to set the column to or None
+            tuple[np.ndarray, np.ndarray]: The new trip numbers and trip ids
         """
         
-        match = re.search(r'(str\(|int\(|float\(|np.)', method)        
-        
-        if match is not None:
-            return eval(method)
-        else: 
-            return None
+        return TRIP_COUNTER.allocate('trip', member_ids)
          
-    def copy_from_host(self, **kwargs):
+    def copy_from_host(self, **kwargs) -> pd.api.extensions.ExtensionArray:
         """
-        Although host_trip has already been copied, this method ensures that every column is explicitly defined in the trip_column_actions.csv file.        
+        Although the host columns are already the default, this method ensures that every column is explicitly defined in the trip_column_actions.csv file.        
         """
-        assert kwargs['colname'] in kwargs['host_trip'].index, f'Column {kwargs["colname"]} does not exist in host trip'
+        assert kwargs['colname'] in kwargs['host_trips'].columns, f'Column {kwargs["colname"]} does not exist in host trip'
         
-        return kwargs['host_trip'][kwargs['colname']]
+        return kwargs['host_trips'][kwargs['colname']].array
 
-    def copy_from_member(self, **kwargs) -> int | str | np.integer:
+    def copy_from_member(self, **kwargs) -> np.ndarray | pd.api.extensions.ExtensionArray:
         """
-        Copy the value from the member's trip to the new trip.
+        Copy the value from the member's person record to the new trips.
 
         Returns:
-            int|str: returned value from the member's trip
+            np.ndarray|ExtensionArray: values from the members' person records
         """
         
         if self.person_df.index.name == kwargs['colname']:
-            return kwargs['member_id']
+            return kwargs['member_ids']
         
-        data = self.person_df.loc[kwargs['member_id'], kwargs['colname']]
-
-        err_msg = f'Column {kwargs["colname"]} has more than one value for person {kwargs["member_id"]}'
-        assert data.size == 1, err_msg        
-        assert isinstance(data, int | str | np.integer), f'Column {kwargs["colname"]} is not a string or integer'
+        assert self.person_df.index.is_unique, 'Person table index is not unique'
+        
+        is_person = pd.Index(kwargs['member_ids']).isin(self.person_df.index)
+        assert is_person.all(), f'Persons {kwargs["member_ids"][~is_person].tolist()} not in person table'
+        
+        data = self.person_df.loc[kwargs['member_ids'], kwargs['colname']]
+        
+        err_msg = f'Column {kwargs["colname"]} is not a string or integer'
+        assert ptypes.is_integer_dtype(data) or ptypes.is_string_dtype(data), err_msg
 
-        return data
+        return data.array
     
-    def update_trip_num(self, **kwargs) -> int|str: 
+    def update_trip_num(self, **kwargs) -> np.ndarray: 
         """
-        Update the trip number for the new trip.
+        Update the trip number for the new trips, already pulled from the trip counter in populate.
 
         Returns:
-            int|str: returns the new trip number
+            np.ndarray: returns the new trip numbers
         """
         
-        member_id = kwargs['member_id']
-        # day_num = kwargs['host_trip'][DAYNUM_COL]
+        return kwargs['trip_nums']
+    
+    def update_first_date(self, **kwargs) -> pd.api.extensions.ExtensionArray:
+        """
+        Update the first date for the new trips. Takes the minimum date from the member's trips and the host trip.
+
+        Returns:
+            ExtensionArray: The first trip dates
+        """
         
-        return TRIP_COUNTER.iterate_counter('trip', member_id)
+        return self.member_date_extreme('min', **kwargs)
     
-    def update_first_date(self, **kwargs):
+    def update_last_date(self, **kwargs) -> pd.api.extensions.ExtensionArray:
         """
-        Update the first date for the new trip. Takes the minimum date from the member's trips and the host trip.
+        Update the last date for the new trips. Takes the maximum date from the member's trips and the host trip.
 
         Returns:
-            datetime object: The first trip date
+            ExtensionArray: The last trip dates
         """
-        is_person = self.trips_df[PER_ID_NAME] == kwargs['member_id']
-        dates = np.array(self.trips_df.loc[is_person, 'travel_date'])
         
-        # Get minimum date against persons trips and the new host trip
-        first_date = np.append(dates, kwargs['host_trip'][TRAVELDATE_COL]).min()
-            
-        return first_date
+        return self.member_date_extreme('max', **kwargs)
     
-    def update_last_date(self, **kwargs):
+    def member_date_extreme(self, how: str, **kwargs) -> pd.api.extensions.ExtensionArray:
         """
-        Update the last date for the new trip. Takes the maximum date from the member's trips and the host trip.
+        Takes the minimum or maximum travel date over each member's trips and the host trip.
+        The member's dates are looked up in the travel date index instead of scanning the trips table.
+
+        Args:
+            how (str): Either 'min' or 'max'
 
         Returns:
-            datetime object: The last trip date
+            ExtensionArray: The dates for each new trip
         """
-        is_person = self.trips_df[PER_ID_NAME] == kwargs['member_id']
-        dates = np.array(self.trips_df.loc[is_person, TRAVELDATE_COL])
         
-        # Get minimum date against persons trips and the new host trip
-        first_date = np.append(dates, kwargs['host_trip'][TRAVELDATE_COL]).max()
-            
-        return first_date
+        host_dates = kwargs['host_trips'][TRAVELDATE_COL]
+        dates = TRAVEL_DATES.lookup(how, kwargs['member_ids'], host_dates.to_list())
+        
+        return pd.array(dates, dtype=host_dates.dtype)
     
-    def update_driver(self, **kwargs):
+    def update_driver(self, **kwargs) -> pd.api.extensions.ExtensionArray:
         """
-        Update the driver for the new trip.
+        Update the driver for the new trips.
         If the host trip is a driver, then the new trip is a passenger, else then the new trip driver value is unchanged.
         
         1 = driver
@@ -198,21 +208,19 @@ class NonProxyTripPopulator:
         995 = na
 
         Returns:
-            int/str: driver value
+            ExtensionArray: driver values
         """
         
-        host_driver = kwargs['host_trip'][DRIVER_COL]
+        host_driver = kwargs['host_trips'][DRIVER_COL]
         
-        if host_driver == 1:
-            return 2
-        else:
-            return host_driver             
+        return host_driver.mask(host_driver == 1, 2).array
             
     def is_days_last(self, **kwargs):
         pass
     
     def is_days_first(self, **kwargs):
         pass
-    
 
-    
\ No newline at end of file
+
+# Compile the column actions once, a malformed config fails here on import
+JOINT_TRIP_PLAN = compile_plan('impute_reported_joint_trips', 'method', NonProxyTripPopulator)
@@ -1,14 +1,16 @@
 from tqdm import tqdm
 import numpy as np
 import pandas as pd
-import pandas.api.types as ptypes
 
-from sklearn.metrics.pairwise import haversine_distances
 from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
 
 # Internal imports
 import settings
-from utils.misc import disjoint_set
+from utils.misc import connected_components, compact_labels, group_offsets, group_pairs, time_window_pairs
+from utils.distance import within_distance, haversine
+from utils.participation import member_columns, member_positions
+from nonproxy.pair_diagnostics import PairDiagnostics
 
 # Constants
 # Extract column names for origin and destination lat/lon
@@ -41,7 +43,7 @@ assert isinstance(DLAT, str), 'DLAT not a string'
 assert isinstance(DLON, str), 'DLON not a string'
 assert isinstance(MODE, str), 'MODE not a string'
 
-def fix_existing_joint_trips(trips_df: pd.DataFrame, distance_threshold: float, time_threshold: timedelta) -> pd.DataFrame:
+def fix_existing_joint_trips(trips_df: pd.DataFrame, distance_threshold: float, time_threshold: timedelta, batched: bool = False, index: str = 'dense', workers: int|None = None, diagnostics: str|None = None) -> pd.DataFrame:
     """
     This function finds and fixes unreported joint trips. 
     This is done by checking each trip against all trips within the household using a time/distance threshold buffer
@@ -52,34 +54,40 @@ def fix_existing_joint_trips(trips_df: pd.DataFrame, distance_threshold: float,
         trips_df (pd.DataFrame): Trips dataframe
         distance_threshold (float): Maximum buffer distance in feet
         time_threshold (timedelta): Maximum time buffer in minutes
+        batched (bool, optional): Process all household-days at once instead of per group. Defaults to False.
+        index (str, optional): Candidate pair strategy, either 'dense' or 'sweep'. See find_threshold_pairs. Defaults to 'dense'.
+        workers (int|None, optional): Number of worker processes to shard households across. Defaults to None, which runs serially.
+        diagnostics (str|None, optional): Directory to stream the candidate pairs to as a Parquet dataset. Defaults to None, which disables it.
 
     Returns:
         pd.DataFrame: fixed trips dataframe
     """
         
     # Setup the dataframe for faster processing    
-    trim_cols = [PER_ID_NAME, HH_ID_NAME]
-    trim_cols += [OLAT, OLON, DLAT, DLON] 
-    trim_cols += [OTIME_COL, DTIME_COL, PNUM_COL, DAYNUM_COL, MODE, JOINT_TRIPNUM_COL]    
-    # Get non-empty household member columns    
-    # trim_cols += trips_df.filter(regex=HHMEMBER_PREFIX).columns.tolist()
-    trim_cols += (trips_df.filter(regex=HHMEMBER_PREFIX).clip(0, 2).replace(2, 0).sum(axis=0) > 0).index.tolist()
-    trim_cols += ['corrected_hh_members']
+    trim_cols = get_trim_cols(trips_df)
+    trim_cols += [JOINT_TRIPNUM_COL, 'corrected_hh_members']
     
     # Pre-index on household_id and day_num for faster lookup
     trips_df['corrected_hh_members'] = 0    
     
     hh_trips_df = trips_df[trim_cols].reset_index().set_index([HH_ID_NAME, DAYNUM_COL]).sort_index()
     
-    print('Finding unreported joint trips...')
-    # Run loop in list comprehension for faster processing
-    fixed_ls = [find_joint_hh_trips(hh_trips, distance_threshold, time_threshold) for hh_id, hh_trips in tqdm(hh_trips_df.groupby(level=(0, 1)))]
+    assert index in ['dense', 'sweep'], 'Joint trip index must be either "dense" or "sweep"'
     
-    # Drop empty frames
-    fixed_ls = [df for df in fixed_ls if not df.empty]
+    sink = None
+    if diagnostics:
+        print(f'Streaming joint trip candidate pairs to {diagnostics}')
+        sink = PairDiagnostics(diagnostics)
+        sink.clear()
+    
+    print('Finding unreported joint trips...')
+    if workers and workers > 1:
+        fixed_joint_trips = find_joint_trips_parallel(hh_trips_df, distance_threshold, time_threshold, batched, index, workers, sink)
+    else:
+        fixed_joint_trips = find_joint_trips(hh_trips_df, distance_threshold, time_threshold, batched, index, diagnostics=sink)
     
     # Concatenate all the fixed joint trips into dataframe    
-    fixed_joint_trips = pd.concat(fixed_ls).set_index(TRIP_ID_NAME).filter(regex=f'{HHMEMBER_PREFIX}|{JOINT_TRIPNUM_COL}|corrected_hh_members')
+    fixed_joint_trips = fixed_joint_trips.set_index(TRIP_ID_NAME).filter(regex=f'{HHMEMBER_PREFIX}|{JOINT_TRIPNUM_COL}|corrected_hh_members')
     
     # Store for debugging
     # trips_df_old = trips_df.copy()
@@ -92,22 +100,427 @@ def fix_existing_joint_trips(trips_df: pd.DataFrame, distance_threshold: float,
     
     return trips_df
 
-def find_joint_hh_trips(hh_trips: pd.DataFrame, distance_threshold: float, time_threshold: timedelta) -> pd.DataFrame:
+def get_trim_cols(trips_df: pd.DataFrame) -> list:
     """
-    This function finds and fixes unreported household members on joint trips
-    and also assigns a joint trip number label to the joint trip.
-    It returns a corrected dataframe, or an empty dataframe.
+    Returns the trip columns used by the time-space buffer, so only these need to be processed.
+
+    Args:
+        trips_df (pd.DataFrame): Trips dataframe
+
+    Returns:
+        list: The trimmed column names
+    """
+    
+    trim_cols = [PER_ID_NAME, HH_ID_NAME]
+    trim_cols += [OLAT, OLON, DLAT, DLON] 
+    trim_cols += [OTIME_COL, DTIME_COL, PNUM_COL, DAYNUM_COL, MODE]    
+    # Household member columns, all are kept so every person number has a column
+    trim_cols += member_columns(trips_df).tolist()
+    
+    return trim_cols
+
+def household_fingerprints(trips_df: pd.DataFrame, distance_threshold: float, time_threshold: timedelta) -> pd.Series:
+    """
+    Fingerprints the time-space buffer inputs of each household, so only changed households need to be re-flagged.
+    The fingerprint covers the trip ids, coordinates, times, mode and hh_member_# flags of every trip in the household,
+    and the buffer settings, so changing the settings changes every fingerprint.
+
+    Args:
+        trips_df (pd.DataFrame): Trips dataframe, before the joint trips are flagged
+        distance_threshold (float): Maximum buffer distance in meters
+        time_threshold (timedelta): Maximum time buffer
+
+    Returns:
+        pd.Series: The uint64 fingerprint for each household id
+    """
+    
+    trim_cols = get_trim_cols(trips_df)
+    row_hashes = pd.util.hash_pandas_object(trips_df[trim_cols], index=True).to_numpy()
+    
+    # Sum the row hashes per household, uint64 addition wraps around so this is order independent
+    hh_ids = trips_df[HH_ID_NAME].to_numpy()
+    order = np.argsort(hh_ids, kind='stable')
+    starts, sizes = group_offsets(hh_ids[order])
+    fingerprints = np.add.reduceat(row_hashes[order], starts) if starts.size > 0 else row_hashes[:0]
+    
+    # Mix in the buffer settings
+    settings_hash = pd.util.hash_array(np.array([f'{distance_threshold}|{time_threshold}'], dtype=object))[0]
+    fingerprints = fingerprints ^ settings_hash
+    
+    return pd.Series(fingerprints, index=pd.Index(hh_ids[order][starts], name=HH_ID_NAME), name='fingerprint')
+
+def sweep_joint_trip_buffer(trips_df: pd.DataFrame, buffers: list, index: str = 'dense') -> pd.DataFrame:
+    """
+    Sensitivity sweep over multiple time-space buffer settings in a single pass.
+    The candidate pairs and their distance/time deltas are calculated once using the largest distance and time,
+    then each setting is just a threshold on those deltas. The trips dataframe is not modified.
+    
+    The counts match the summaries step for a full run with that buffer setting:
+        total_joint_trips: the number of trips that are part of a joint trip
+        joint_trips: the number of unique joint trips
+        unreported_joint_trips: the number of corrected unreported household members on the joint trips
+
+    Args:
+        trips_df (pd.DataFrame): Trips dataframe, before the joint trips are flagged
+        buffers (list): List of [distance, time] buffer settings in meters and minutes
+        index (str, optional): Candidate pair strategy, either 'dense' or 'sweep'. Defaults to 'dense'.
+
+    Returns:
+        pd.DataFrame: Joint trip counts for each buffer setting, indexed by distance and time
+    """
+    
+    assert len(buffers) > 0, 'At least one buffer setting is required'
+    assert all(len(buffer) == 2 for buffer in buffers), 'Buffer settings must be [distance, time] pairs'
+    
+    hh_trips = trips_df[get_trim_cols(trips_df)].reset_index().set_index([HH_ID_NAME, DAYNUM_COL]).sort_index()
+    hh_ids = hh_trips.index.get_level_values(HH_ID_NAME).to_numpy()
+    day_nums = hh_trips.index.get_level_values(DAYNUM_COL).to_numpy()
+    starts, sizes = group_offsets(hh_ids, day_nums)
+    
+    # Find and measure the candidate pairs once with the widest buffer
+    max_distance = max(distance for distance, time in buffers)
+    max_time = timedelta(minutes=max(time for distance, time in buffers))
+    
+    print(f'Sweeping {len(buffers)} joint trip buffer settings...')
+    a_rows, b_rows = find_threshold_pairs(hh_trips, starts, sizes, max_distance, max_time, index)
+    deltas = measure_pairs(hh_trips, a_rows, b_rows)
+    
+    # Shared mode and unreported member flags do not depend on the buffer
+    modes = hh_trips[MODE].to_numpy()
+    is_shared_mode = modes[a_rows] == modes[b_rows]
+    
+    member_cols, b_cols = lookup_member_cols(hh_trips, b_rows)
+    is_unreported = hh_trips[member_cols].to_numpy()[a_rows, b_cols] == 0
+    member_cells = a_rows * member_cols.size + b_cols
+    
+    results = []
+    for distance, time in buffers:
+        time_threshold = np.timedelta64(timedelta(minutes=time))
+        
+        is_joint = is_shared_mode.copy()
+        is_joint &= (deltas['odist'] < distance) & (deltas['ddist'] < distance)
+        is_joint &= (deltas['otimedelta'] < time_threshold) & (deltas['dtimedelta'] < time_threshold)
+        
+        labels = connected_components(a_rows[is_joint], b_rows[is_joint], hh_trips.shape[0])
+        
+        results.append({
+            'distance': distance,
+            'time': time,
+            'total_joint_trips': (labels >= 0).sum(),
+            'joint_trips': np.unique(labels[labels >= 0]).size,
+            'unreported_joint_trips': np.unique(member_cells[is_joint & is_unreported]).size
+        })
+    
+    return pd.DataFrame(results).set_index(['distance', 'time'])
+
+def find_joint_trips(hh_trips_df: pd.DataFrame, distance_threshold: float, time_threshold: timedelta, batched: bool = False, index: str = 'dense', progress: bool = True, diagnostics: PairDiagnostics|None = None) -> pd.DataFrame:
+    """
+    Runs the joint trip search over the household trips, either batched or per household-day group.
+
+    Args:
+        hh_trips_df (pd.DataFrame): The trimmed trips dataframe, indexed and sorted by household id and day number
+        distance_threshold (float): Maximum buffer distance in meters
+        time_threshold (timedelta): Maximum time buffer
+        batched (bool, optional): Process all household-days at once instead of per group. Defaults to False.
+        index (str, optional): Candidate pair strategy, either 'dense' or 'sweep'. Defaults to 'dense'.
+        progress (bool, optional): Show the progress bar for the per group loop. Defaults to True.
+        diagnostics (PairDiagnostics|None, optional): Sink for the candidate pairs, closed when done. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The corrected joint trips
+    """
+    
+    if batched:
+        # Process every household-day in one pass
+        fixed_joint_trips = find_joint_trips_batched(hh_trips_df, distance_threshold, time_threshold, index, diagnostics)
+        if diagnostics is not None:
+            diagnostics.close()
+        return fixed_joint_trips
+    
+    # Run loop in list comprehension for faster processing
+    groups = hh_trips_df.groupby(level=(0, 1))
+    fixed_ls = [find_joint_hh_trips(hh_trips, distance_threshold, time_threshold, index, diagnostics) for hh_id, hh_trips in tqdm(groups, disable=not progress)]
+    
+    if diagnostics is not None:
+        diagnostics.close()
+    
+    # Drop empty frames
+    fixed_ls = [df for df in fixed_ls if not df.empty]
+    
+    if len(fixed_ls) == 0:
+        return hh_trips_df.iloc[0:0].copy()
+    
+    fixed_joint_trips = pd.concat(fixed_ls)
+    
+    # Joint trip numbers are per household-day, renumber them so they are unique within the household
+    hh_ids = fixed_joint_trips.index.get_level_values(HH_ID_NAME).to_numpy()
+    day_nums = fixed_joint_trips.index.get_level_values(DAYNUM_COL).to_numpy()
+    day_starts, day_sizes = group_offsets(hh_ids, day_nums)
+    hh_starts, hh_sizes = group_offsets(hh_ids)
+    
+    day_group_ids = np.repeat(np.arange(day_starts.size), day_sizes)
+    hh_group_ids = np.repeat(np.arange(hh_starts.size), hh_sizes)
+    
+    local_nums = fixed_joint_trips[JOINT_TRIPNUM_COL].to_numpy()
+    labels = day_group_ids * (local_nums.max() + 1) + local_nums
+    fixed_joint_trips[JOINT_TRIPNUM_COL] = compact_labels(labels, hh_group_ids)
+    
+    return fixed_joint_trips
+
+def find_joint_trips_parallel(hh_trips_df: pd.DataFrame, distance_threshold: float, time_threshold: timedelta, batched: bool, index: str, workers: int, diagnostics: PairDiagnostics|None = None) -> pd.DataFrame:
+    """
+    Runs find_joint_trips in a process pool over household shards.
+    Households are hash-partitioned by household id so a household-day is never split across shards,
+    and the results are put back in household-day order so the output is identical to the serial run.
+
+    Args:
+        hh_trips_df (pd.DataFrame): The trimmed trips dataframe, indexed and sorted by household id and day number
+        distance_threshold (float): Maximum buffer distance in meters
+        time_threshold (timedelta): Maximum time buffer
+        batched (bool): Process all household-days in a shard at once instead of per group.
+        index (str): Candidate pair strategy, either 'dense' or 'sweep'.
+        workers (int): Number of worker processes
+        diagnostics (PairDiagnostics|None, optional): Sink for the candidate pairs, each shard writes its own part files. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The corrected joint trips
+    """
+    
+    # Hash-partition on household id, hash_pandas_object is stable across processes and runs
+    hh_ids = hh_trips_df.index.get_level_values(HH_ID_NAME).to_series()
+    shard_ids = (pd.util.hash_pandas_object(hh_ids, index=False) % workers).to_numpy()
+    shards = [hh_trips_df[shard_ids == i] for i in range(workers)]
+    shards = [shard for shard in shards if not shard.empty]
+    
+    n = len(shards)
+    sinks = [None]*n
+    if diagnostics is not None:
+        sinks = [PairDiagnostics(diagnostics.path, diagnostics.batch_size, f'shard{i}') for i in range(n)]
+    
+    args = [shards, [distance_threshold]*n, [time_threshold]*n, [batched]*n, [index]*n, [False]*n, sinks]
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        fixed_ls = list(tqdm(executor.map(find_joint_trips, *args), total=n))
+    
+    # Restore household-day order, shards preserve the row order within each group
+    fixed_joint_trips = pd.concat(fixed_ls).sort_index(kind='stable')
+    
+    return fixed_joint_trips
+
+def find_threshold_pairs(hh_trips: pd.DataFrame, starts: np.ndarray, sizes: np.ndarray, distance_threshold: float, time_threshold: timedelta, index: str = 'dense', diagnostics: PairDiagnostics|None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the trip pairs within each group that are inside both the time and distance buffer.
+    
+    The 'dense' strategy builds every pair within each group then filters on time, which is quadratic in the group size.
+    The 'sweep' strategy sorts by departure time and only builds the pairs already inside the time window.
+    Haversine distances are only calculated for pairs inside the time window in both cases, and both return the same pairs.
+
+    Args:
+        hh_trips (pd.DataFrame): The trips dataframe, sorted by group
+        starts (np.ndarray): The start offset of each group
+        sizes (np.ndarray): The size of each group
+        distance_threshold (float): Maximum buffer distance in meters
+        time_threshold (timedelta): Maximum time buffer
+        index (str, optional): Either 'dense' or 'sweep'. Defaults to 'dense'.
+        diagnostics (PairDiagnostics|None, optional): Sink for the pairs inside the time window. Defaults to None.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The row positions of the A and B side of each pair, in row-major order
+    """
+    
+    otimes = hh_trips[OTIME_COL].values
+    dtimes = hh_trips[DTIME_COL].values
+    time_threshold = np.timedelta64(time_threshold)
+    
+    # Time differences between origins and destinations
+    if index == 'sweep':
+        a_rows, b_rows = time_window_pairs(starts, sizes, otimes, time_threshold)
+    else:
+        a_rows, b_rows = group_pairs(starts, sizes)
+        is_pair = np.abs(otimes[a_rows] - otimes[b_rows]) < time_threshold
+        a_rows, b_rows = a_rows[is_pair], b_rows[is_pair]
+    
+    is_pair = np.abs(dtimes[a_rows] - dtimes[b_rows]) < time_threshold
+    a_rows, b_rows = a_rows[is_pair], b_rows[is_pair]
+    
+    if diagnostics is not None:
+        write_diagnostics(diagnostics, hh_trips, a_rows, b_rows, distance_threshold)
+    
+    # Find distance between origin to origin and destination to destination for the remaining pairs
+    olatlons = np.radians(hh_trips[[OLAT, OLON]].to_numpy(dtype=float))
+    dlatlons = np.radians(hh_trips[[DLAT, DLON]].to_numpy(dtype=float))
+    is_pair = within_distance(olatlons[a_rows], olatlons[b_rows], distance_threshold)
+    a_rows, b_rows = a_rows[is_pair], b_rows[is_pair]
+    
+    is_pair = within_distance(dlatlons[a_rows], dlatlons[b_rows], distance_threshold)
+    
+    return a_rows[is_pair], b_rows[is_pair]
+
+def measure_pairs(hh_trips: pd.DataFrame, a_rows: np.ndarray, b_rows: np.ndarray) -> dict:
+    """
+    Measures the exact distance and time deltas between the origins and destinations of each trip pair.
+
+    Args:
+        hh_trips (pd.DataFrame): The trips dataframe the pair rows refer to
+        a_rows (np.ndarray): The row positions of the A side of each pair
+        b_rows (np.ndarray): The row positions of the B side of each pair
+
+    Returns:
+        dict: Arrays of the origin and destination distances in meters and time deltas
+    """
+    
+    olatlons = np.radians(hh_trips[[OLAT, OLON]].to_numpy(dtype=float))
+    dlatlons = np.radians(hh_trips[[DLAT, DLON]].to_numpy(dtype=float))
+    otimes = hh_trips[OTIME_COL].values
+    dtimes = hh_trips[DTIME_COL].values
+    
+    deltas = {
+        'odist': haversine(olatlons[a_rows], olatlons[b_rows])*settings.R,
+        'ddist': haversine(dlatlons[a_rows], dlatlons[b_rows])*settings.R,
+        'otimedelta': np.abs(otimes[a_rows] - otimes[b_rows]),
+        'dtimedelta': np.abs(dtimes[a_rows] - dtimes[b_rows])
+        }
+    
+    return deltas
+
+def write_diagnostics(diagnostics: PairDiagnostics, hh_trips: pd.DataFrame, a_rows: np.ndarray, b_rows: np.ndarray, distance_threshold: float) -> None:
+    """
+    Measures the candidate pairs and writes them to the diagnostics sink, flagging the pairs inside the distance buffer.
+    This is only called when diagnostics are enabled, so the exact distances are not calculated otherwise.
+
+    Args:
+        diagnostics (PairDiagnostics): The diagnostics sink
+        hh_trips (pd.DataFrame): The trips dataframe the pair rows refer to
+        a_rows (np.ndarray): The row positions of the A side of each pair
+        b_rows (np.ndarray): The row positions of the B side of each pair
+        distance_threshold (float): Maximum buffer distance in meters
+    """
+    
+    deltas = measure_pairs(hh_trips, a_rows, b_rows)
+    is_within = (deltas['odist'] < distance_threshold) & (deltas['ddist'] < distance_threshold)
+    diagnostics.write(hh_trips, a_rows, b_rows, deltas, is_within)
+
+def find_joint_trips_batched(hh_trips_df: pd.DataFrame, distance_threshold: float, time_threshold: timedelta, index: str = 'dense', diagnostics: PairDiagnostics|None = None) -> pd.DataFrame:
+    """
+    Batched version of find_joint_hh_trips that processes every household-day at once.
+    Candidate trip pairs are built for all groups in one vectorized pass keyed by the group offsets,
+    so there are no per-group Python calls. The result matches running find_joint_hh_trips over each group.
+
+    Args:
+        hh_trips_df (pd.DataFrame): The trimmed trips dataframe, indexed and sorted by household id and day number
+        distance_threshold (float): Maximum buffer distance in meters
+        time_threshold (timedelta): Maximum time buffer
+        index (str, optional): Candidate pair strategy, either 'dense' or 'sweep'. Defaults to 'dense'.
+        diagnostics (PairDiagnostics|None, optional): Sink for the candidate pairs. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The corrected joint trips, or an empty dataframe.
+    """
+    
+    hh_trips = hh_trips_df.copy()
+    
+    # Find the household-day group offsets, requires the table to be sorted by group
+    assert hh_trips.index.is_monotonic_increasing, 'Household trips must be sorted by household id and day number'
+    hh_ids = hh_trips.index.get_level_values(HH_ID_NAME).to_numpy()
+    day_nums = hh_trips.index.get_level_values(DAYNUM_COL).to_numpy()
+    starts, sizes = group_offsets(hh_ids, day_nums)
+    
+    # Trip pairs within each household-day inside the time/distance buffer
+    a_rows, b_rows = find_threshold_pairs(hh_trips, starts, sizes, distance_threshold, time_threshold, index, diagnostics)
+    
+    # Check shared mode and correct unreported members for all pairs at once
+    joint_idx = evaluate_joint_pairs(hh_trips, a_rows, b_rows)
+    
+    # Label the connected person-trips over all households at once, then number them within each household
+    hh_starts, hh_sizes = group_offsets(hh_ids)
+    hh_group_ids = np.repeat(np.arange(hh_starts.size), hh_sizes)
+    
+    labels = connected_components(joint_idx[:, 0], joint_idx[:, 1], hh_trips.shape[0])
+    joint_trip_nums = compact_labels(labels, hh_group_ids)
+    is_joint = joint_trip_nums > 0
+    
+    hh_trips.loc[is_joint, JOINT_TRIPNUM_COL] = joint_trip_nums[is_joint]
+    
+    return hh_trips[is_joint]
+
+def lookup_member_cols(hh_trips: pd.DataFrame, rows: np.ndarray) -> tuple[pd.Index, np.ndarray]:
+    """
+    Looks up the hh_member_# column position for the person of each trip row.
+
+    Args:
+        hh_trips (pd.DataFrame): The trips dataframe the rows refer to
+        rows (np.ndarray): The row positions of the trips
+
+    Returns:
+        tuple[pd.Index, np.ndarray]: The hh_member_# columns and the column position for each row
+    """
+    
+    member_cols = member_columns(hh_trips)
+    member_col_idx = member_positions(member_cols, hh_trips[PNUM_COL].to_numpy()[rows])
+    
+    return member_cols, member_col_idx
+
+def evaluate_joint_pairs(hh_trips: pd.DataFrame, a_rows: np.ndarray, b_rows: np.ndarray) -> np.ndarray:
+    """
+    Vectorized kernel that evaluates the trip pairs inside the time/distance buffer as joint trips.
+    A pair is a joint trip if both trips share the same mode. If person B is not reported as a 
+    hh_member_# on trip A, the member is corrected and counted in corrected_hh_members.
+    Purposes are not compared, the members of a joint trip often have different purposes, e.g., a parent escorting 
+    a child to school is an escort trip for the parent and a school trip for the child.
+    
+    The pairs are evaluated with fancy indexing into the member matrix, and all corrections are applied at once.
+    hh_trips is updated in place.
+
+    Args:
+        hh_trips (pd.DataFrame): The trips dataframe the pair rows refer to
+        a_rows (np.ndarray): The row positions of the A side of each pair
+        b_rows (np.ndarray): The row positions of the B side of each pair
+
+    Returns:
+        np.ndarray: The joint trip pairs, one pair per row
+    """
+    
+    # Check if same mode was used
+    modes = hh_trips[MODE].to_numpy()
+    is_shared_mode = modes[a_rows] == modes[b_rows]
+    a_rows, b_rows = a_rows[is_shared_mode], b_rows[is_shared_mode]
+    
+    # Look up the hh_member_# column position of person B
+    member_cols, b_cols = lookup_member_cols(hh_trips, b_rows)
+    members = hh_trips[member_cols].to_numpy()
+    
+    # Check if person B is unreported in the corresponding trip A, each member is only corrected once per trip
+    is_unreported = members[a_rows, b_cols] == 0
+    fix_cells = np.unique(a_rows[is_unreported] * member_cols.size + b_cols[is_unreported])
+    
+    # Correct the unreported joint trip hh members
+    if fix_cells.size > 0:
+        fix_rows, fix_cols = np.divmod(fix_cells, member_cols.size)
+        members[fix_rows, fix_cols] = 1
+        corrected = hh_trips['corrected_hh_members'].to_numpy() + np.bincount(fix_rows, minlength=hh_trips.shape[0])
+        
+        hh_trips[member_cols] = members
+        hh_trips['corrected_hh_members'] = corrected
+    
+    return np.column_stack((a_rows, b_rows))
+
+def find_dense_threshold_idx(hh_trips: pd.DataFrame, distance_threshold: float, time_threshold: timedelta, diagnostics: PairDiagnostics|None = None) -> np.ndarray:
+    """
+    Finds the trip pairs inside the time/distance buffer using dense N x N matrices for a single household-day.
 
     Args:
         hh_trips (pd.DataFrame): The household trips dataframe
+        distance_threshold (float): Maximum buffer distance in meters
+        time_threshold (timedelta): Maximum time buffer
+        diagnostics (PairDiagnostics|None, optional): Sink for the pairs inside the time window. Defaults to None.
 
     Returns:
-        dict: Dict with trip ids as keys and a dict with their respective distance/time distance as values.
+        np.ndarray: The paired row indices, one pair per row
     """
     
     # Convert lat/lon to radians for pairwise haversine distance calculation
-    olatlons = np.radians(hh_trips[[OLAT, OLON]].to_numpy())
-    dlatlons = np.radians(hh_trips[[DLAT, DLON]].to_numpy())
+    olatlons = np.radians(hh_trips[[OLAT, OLON]].to_numpy(dtype=float))
+    dlatlons = np.radians(hh_trips[[DLAT, DLON]].to_numpy(dtype=float))
     otimes = hh_trips.depart_time.to_numpy()
     dtimes = hh_trips.arrive_time.to_numpy()
     
@@ -115,14 +528,17 @@ def find_joint_hh_trips(hh_trips: pd.DataFrame, distance_threshold: float, time_
     otimedelta = np.abs(otimes[np.newaxis,:] - otimes[:,np.newaxis])
     dtimedelta = np.abs(dtimes[np.newaxis,:] - dtimes[:,np.newaxis])
     
-    # Find distance between origin to origin and destination to destination
-    odist = haversine_distances(olatlons, olatlons)*settings.R
-    ddist = haversine_distances(dlatlons, dlatlons)*settings.R
-    
-    # Find where distances are below the threshold
-    distmat = (odist < distance_threshold) * (ddist < distance_threshold)
+    # Find where distances between origin to origin and destination to destination are below the threshold
+    odistmat = within_distance(olatlons[:,np.newaxis], olatlons[np.newaxis,:], distance_threshold)
+    ddistmat = within_distance(dlatlons[:,np.newaxis], dlatlons[np.newaxis,:], distance_threshold)
+    distmat = odistmat * ddistmat
     timemat = (otimedelta < time_threshold) * (dtimedelta < time_threshold)
     
+    if diagnostics is not None:
+        np.fill_diagonal(timemat, False)
+        a_rows, b_rows = np.where(timemat)
+        write_diagnostics(diagnostics, hh_trips, a_rows, b_rows, distance_threshold)
+    
     # Combined distance and time matrices
     threshold_matrix = distmat * timemat
     np.fill_diagonal(threshold_matrix, False)
@@ -131,63 +547,49 @@ def find_joint_hh_trips(hh_trips: pd.DataFrame, distance_threshold: float, time_
     threshold_idx = np.where(threshold_matrix)
     threshold_idx = np.array(threshold_idx).transpose()
     
-    # Initialize empty arrays        
-    joint_idx = np.ndarray((0,2), dtype=int)    
-    joint_trip_nums, idx = {}, []
+    return threshold_idx
+
+def find_joint_hh_trips(hh_trips: pd.DataFrame, distance_threshold: float, time_threshold: timedelta, index: str = 'dense', diagnostics: PairDiagnostics|None = None) -> pd.DataFrame:
+    """
+    This function finds and fixes unreported household members on joint trips
+    and also assigns a joint trip number label to the joint trip.
+    The joint trip number is only unique within the household-day, find_joint_trips renumbers it per household.
+    It returns a corrected dataframe, or an empty dataframe.
+
+    Args:
+        hh_trips (pd.DataFrame): The household trips dataframe
+        distance_threshold (float): Maximum buffer distance in meters
+        time_threshold (timedelta): Maximum time buffer
+        index (str, optional): Candidate pair strategy, either 'dense' or 'sweep'. Defaults to 'dense'.
+        diagnostics (PairDiagnostics|None, optional): Sink for the candidate pairs. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The joint trips of the household-day with their corrected hh_member_# columns and joint trip number, 
+        or an empty dataframe.
+    """
     
-    # Iterate through the paired indices and check if they are unreported joint trips
+    if index == 'sweep':
+        # Only build the pairs inside the time window, no N x N matrices
+        starts, sizes = np.array([0]), np.array([hh_trips.shape[0]])
+        threshold_idx = np.array(find_threshold_pairs(hh_trips, starts, sizes, distance_threshold, time_threshold, index, diagnostics)).transpose()
+    else:
+        threshold_idx = find_dense_threshold_idx(hh_trips, distance_threshold, time_threshold, diagnostics)
+    
+    # Check if they are unreported joint trips
     # We check both pairs A->B and B->A to ensure we get unreported joint trips for both parties
-    for a_row, b_row in threshold_idx:
-        # Check if same mode was used
-        is_shared_mode = hh_trips.iloc[a_row][MODE] == hh_trips.iloc[b_row][MODE]        
-        
-        # Check if person B is unreported in the corresponding trip A
-        member_b = f"{HHMEMBER_PREFIX}{hh_trips.iloc[b_row].person_num}"
-        is_unreported = hh_trips.iloc[a_row][member_b] == 0
-        
-        # If it is a joint trip, add to the new arrays so it create joint trip label later
-        if is_shared_mode:
-            joint_idx = np.append(joint_idx, [[a_row, b_row]], axis=0)
-            
-        # TODO match or correct purpose (e.g., escort to school?)
-        
-        # Correct the unreported joint trip hh member
-        if is_shared_mode and is_unreported:            
-            a_col = hh_trips.columns.get_loc(member_b)            
-            c_col = hh_trips.columns.get_loc('corrected_hh_members')
-            
-            hh_trips.iloc[a_row, a_col] = 1                              
-            
-            # Doing this weird pass off to avoid type errors
-            val = hh_trips.iloc[a_row, c_col]
-            assert isinstance(val, int) or type(val) == np.int64, f'Expected int, got {type(val)}'                      
-            val += 1            
-            hh_trips.iloc[a_row, c_col] = val
-            
-
+    joint_idx = evaluate_joint_pairs(hh_trips, threshold_idx[:, 0], threshold_idx[:, 1])
+    idx = []
+    
     if joint_idx.size > 0:
         # Assign a unique joint trip number using some graph theory to find the connected person-trips
-        joint_trip_nums = disjoint_set(joint_idx)
+        labels = connected_components(joint_idx[:, 0], joint_idx[:, 1], hh_trips.shape[0])
+        joint_trip_nums = compact_labels(labels, np.zeros(hh_trips.shape[0], dtype=int))
         
         # Retrieve the column and row indices for the joint trip    
         jt_col = hh_trips.columns.get_loc(JOINT_TRIPNUM_COL)
-        idx = list(joint_trip_nums.keys())
+        idx = np.flatnonzero(joint_trip_nums > 0)
         
         # Set the joint trip number    
-        hh_trips.iloc[idx, jt_col] = pd.Series(joint_trip_nums.values())
+        hh_trips.iloc[idx, jt_col] = joint_trip_nums[idx]
     
     return hh_trips.iloc[idx]
-
-    # Construct result dictionary   
-    # result_id = dict(zip(hh_trips.index.names, hh_trips.index.values[0]))
-    # idx = (idx_a, idx_b)        
-    # # Return the trip IDs pairs        
-    # calculations = {
-    #     'trip_id_a': hh_trips.iloc[idx_a].trip_id.values,
-    #     'trip_id_b': hh_trips.iloc[idx_b].trip_id.values,
-    #     'odist': odist[idx],
-    #     'ddist': ddist[idx], 
-    #     'otimedelta': otimedelta[idx], 
-    #     'dtimedelta': dtimedelta[idx]
-    #     }
-    # result = pd.DataFrame({**result_id, **calculations})  
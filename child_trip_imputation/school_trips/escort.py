@@ -0,0 +1,170 @@
+"""
+Matches household escort trips to the children missing a school trip on that day.
+
+An escort trip of another household member matches a child's school-day if it arrives within ESCORT_MATCH TIME minutes
+of the child's expected school arrival time, at a destination within ESCORT_MATCH DISTANCE meters of the child's school.
+The escort trip must also be a drop-off, arriving closer to the expected school arrival than to the expected school
+departure (the arrival plus the median time spent at school), so an afternoon pick-up is never copied as the trip to school.
+All candidates are matched at once, as an equi-join of escort trips and school-days on household and day, filtered
+by the time window and distance. The join reads each school-day's household-day trips by position from the DBIO group
+index of the trips table, instead of merging the escort trips with the school-days.
+"""
+
+import numpy as np
+import pandas as pd
+
+import settings
+from utils.misc import school_level
+from utils.distance import within_distance
+from utils.io import DBIO
+from school_trips.school_locations import SCHOOL_LOCATIONS
+from school_trips.reference_trips import REFERENCE_SCHOOL_TRIPS
+from school_trips.time_sampler import TIME_SAMPLERS
+
+# CONSTANTS
+assert isinstance(settings.COLUMN_NAMES, dict), 'COLUMN_NAMES not a dict'
+
+COLNAMES = settings.COLUMN_NAMES
+HH_ID_NAME = COLNAMES['HH_ID']
+PER_ID_NAME = COLNAMES['PER_ID']
+DAY_ID_NAME = COLNAMES['DAY_ID']
+TRIP_ID_NAME = COLNAMES['TRIP_ID']
+DAYNUM_COL = COLNAMES['DAYNUM']
+AGE_COL = COLNAMES['AGE']
+DTIME = COLNAMES['DTIME']
+DLAT, DLON = COLNAMES['DLAT'], COLNAMES['DLON']
+HOMELAT, HOMELON = COLNAMES['HOMELAT'], COLNAMES['HOMELON']
+SCHOOL_PURPOSES_COL, SCHOOL_PURPOSES_CODES = settings.get_codes(('SCHOOL_PURPOSES', 'PURPOSE'))
+SCHOOL_TYPE_COL, _ = settings.get_codes('PRESCHOOL_TYPES')
+ESCORT_PURPOSE_COL, ESCORT_PURPOSE_CODES = settings.get_codes('ESCORT_PURPOSES')
+LOCAL_TZ = settings.LOCAL_TIMEZONE
+
+
+def local_seconds(times: pd.Series) -> np.ndarray:
+    """
+    Converts timestamps to seconds after local midnight.
+
+    Args:
+        times (pd.Series): Time zone aware timestamps
+
+    Returns:
+        np.ndarray: The local time of day in seconds, NaN if missing
+    """
+
+    local = times.dt.tz_convert(LOCAL_TZ)
+
+    return (local - local.dt.normalize()).dt.total_seconds().to_numpy()
+
+def expected_arrivals(person_ids: np.ndarray, trips_df: pd.DataFrame, persons_df: pd.DataFrame) -> np.ndarray:
+    """
+    The expected school arrival time of each student, the local arrival time of their reference school trip if any,
+    otherwise the median arrival time of school trips at the same school level, or of all school trips.
+
+    Args:
+        person_ids (np.ndarray): The person id of each student
+        trips_df (pd.DataFrame): The trips table
+        persons_df (pd.DataFrame): The persons table
+
+    Returns:
+        np.ndarray: The expected arrival time in seconds after local midnight
+    """
+
+    school_trips = trips_df[trips_df[SCHOOL_PURPOSES_COL].isin(SCHOOL_PURPOSES_CODES)]
+    arrivals = pd.Series(local_seconds(school_trips[DTIME]), index=school_trips[PER_ID_NAME].to_numpy())
+
+    # Median arrival by school level, levels without school trips fall back to all school trips
+    levels = school_level(persons_df[AGE_COL].reindex(arrivals.index).to_numpy())
+    level_medians = arrivals.groupby(levels).median()
+
+    student_levels = school_level(persons_df.loc[person_ids, AGE_COL].to_numpy())
+    typical = level_medians.reindex(student_levels).fillna(arrivals.median()).to_numpy()
+
+    reference = REFERENCE_SCHOOL_TRIPS.trips
+    own = pd.Series(local_seconds(reference[DTIME]), index=REFERENCE_SCHOOL_TRIPS.person_ids).reindex(person_ids).to_numpy()
+
+    return np.where(np.isnan(own), typical, own)
+
+def match_escort_trips(missing_days_df: pd.DataFrame, trips_df: pd.DataFrame, persons_df: pd.DataFrame, households_df: pd.DataFrame) -> pd.Series:
+    """
+    Matches each person-day missing a school trip to the closest in time escort trip of another household member
+    on that day, within the ESCORT_MATCH time tolerance of the expected school arrival and distance of the school.
+    Pick-ups, escort trips closer in time to the expected school departure than to the arrival, are not matched.
+    Days without a known school location (see SchoolLocationIndex.locate) are not matched.
+
+    Args:
+        missing_days_df (pd.DataFrame): The day table rows missing school trips, see find_missing_school_days
+        trips_df (pd.DataFrame): The trips table
+        persons_df (pd.DataFrame): The persons table
+        households_df (pd.DataFrame): The households table
+
+    Returns:
+        pd.Series: The matched escort trip id, indexed by day id, in missing days order
+    """
+
+    assert isinstance(settings.ESCORT_MATCH, dict), 'ESCORT_MATCH must be a dictionary'
+    assert isinstance(settings.ESCORT_MATCH.get('TIME'), (int, float)), 'ESCORT_MATCH TIME must be a number'
+    assert isinstance(settings.ESCORT_MATCH.get('DISTANCE'), (int, float)), 'ESCORT_MATCH DISTANCE must be a number'
+
+    tolerance = settings.ESCORT_MATCH['TIME'] * 60
+    max_dist = settings.ESCORT_MATCH['DISTANCE']
+
+    # The trips of each household-day, with a running count of escort trips in group order
+    trip_groups = DBIO.get_group_index('trip', [HH_ID_NAME, DAYNUM_COL], trips_df)
+    is_escort = trips_df[ESCORT_PURPOSE_COL].isin(ESCORT_PURPOSE_CODES).to_numpy()
+    escort_counts = np.append(0, np.cumsum(trip_groups.sorted(is_escort)))
+
+    # Only school-days with escort trips on their household-day are candidates
+    starts, stops = trip_groups.bounds(missing_days_df[HH_ID_NAME], missing_days_df[DAYNUM_COL])
+    has_escort = escort_counts[stops] > escort_counts[starts]
+    candidates = missing_days_df[has_escort]
+    person_ids = candidates[PER_ID_NAME].to_numpy()
+    arrivals = expected_arrivals(person_ids, trips_df, persons_df)
+    departures = arrivals + TIME_SAMPLERS.dwell(school_level(persons_df.loc[person_ids, AGE_COL].to_numpy()))
+    latlons = SCHOOL_LOCATIONS.locate(
+        person_ids,
+        persons_df.loc[person_ids, SCHOOL_TYPE_COL].to_numpy(),
+        households_df.loc[candidates[HH_ID_NAME], [HOMELAT, HOMELON]].to_numpy(dtype=float)
+        )[[DLAT, DLON]].to_numpy(dtype=float)
+
+    students = pd.DataFrame({
+        DAY_ID_NAME: candidates.index.to_numpy(),
+        'student_id': person_ids,
+        'school_seconds': arrivals,
+        'leave_seconds': departures,
+        'school_lat': latlons[:, 0],
+        'school_lon': latlons[:, 1]
+        })
+    is_located = ~np.isnan(latlons).any(axis=1)
+    students = students[is_located]
+
+    # Candidate pairs of each school-day and the escort trips on its household-day, in trips table order
+    student_rows, trip_rows = trip_groups.positions(starts[has_escort][is_located], stops[has_escort][is_located])
+    trip_rows, student_rows = trip_rows[is_escort[trip_rows]], student_rows[is_escort[trip_rows]]
+
+    escorts = trips_df.iloc[trip_rows]
+    pairs = students.iloc[student_rows].reset_index(drop=True).assign(**{
+        TRIP_ID_NAME: escorts.index.to_numpy(),
+        PER_ID_NAME: escorts[PER_ID_NAME].to_numpy(),
+        DLAT: escorts[DLAT].to_numpy(),
+        DLON: escorts[DLON].to_numpy(),
+        'escort_seconds': local_seconds(escorts[DTIME]),
+        })
+
+    # Filtered to the time window and distance
+    time_diff = (pairs['escort_seconds'] - pairs['school_seconds']).abs().to_numpy()
+    is_near = within_distance(
+        np.radians(pairs[[DLAT, DLON]].to_numpy(dtype=float)),
+        np.radians(pairs[['school_lat', 'school_lon']].to_numpy(dtype=float)),
+        max_dist
+        )
+    is_match = (pairs['student_id'] != pairs[PER_ID_NAME]).to_numpy() & (time_diff <= tolerance) & is_near
+    
+    # Drop-offs only, a pick-up arrives closer to the school departure. Without a known dwell the direction is not checked
+    leave_diff = (pairs['escort_seconds'] - pairs['leave_seconds']).abs().to_numpy()
+    is_match &= ~(leave_diff <= time_diff)
+
+    # The closest escort trip in time for each day
+    matches = pairs[is_match].assign(time_diff=time_diff[is_match]).sort_values('time_diff', kind='stable')
+    matches = matches.drop_duplicates(DAY_ID_NAME).set_index(DAY_ID_NAME)[TRIP_ID_NAME]
+
+    return matches.reindex(missing_days_df.index[missing_days_df.index.isin(matches.index)])
@@ -1,27 +1,40 @@
-from tqdm import tqdm
+import numpy as np
 import pandas as pd
 
 # Internal imports
 import settings
 from utils.io import DBIO
 from utils.trip_counter import TRIP_COUNTER
-from school_trips.household import HouseholdManagerClass
-from school_trips.day import DayManagerClass
-from school_trips.person import PersonManagerClass
-from school_trips.trip import TripManagerClass
+from utils.travel_dates import TRAVEL_DATES
+from utils.id_registry import ID_REGISTRY
+from school_trips.school_locations import SCHOOL_LOCATIONS
+from school_trips.time_sampler import TIME_SAMPLERS
+from school_trips.reference_trips import REFERENCE_SCHOOL_TRIPS
+from school_trips.escort import match_escort_trips
+from school_trips.populator import SchoolTripPopulator
 
 # CONSTANTS
 assert isinstance(settings.CODES, dict) 
 CHILD_AGE_COL, CHILD_AGE_CODES = settings.get_codes('CHILD_AGE')
 PRESCHOOL_AGE_COL, PRESCHOOL_AGE_CODES = settings.get_codes('PRESCHOOL_AGE')
+ALTDAY_AGE_COL, ALTDAY_AGE_CODES = settings.get_codes('ALTDAY_AGE')
 PRESCHOOL_TYPE_COL, PRESCHOOL_TYPE_CODES = settings.get_codes('PRESCHOOL_TYPES')
 SCHOOL_PURPOSES_COL, SCHOOL_PURPOSES_CODES = settings.get_codes(('SCHOOL_PURPOSES', 'PURPOSE'))
 SCHOOL_PURPCAT_COL, SCHOOL_PURPCAT_CODES = settings.get_codes(('SCHOOL_PURPOSES', 'PURPOSE_CATEGORY'))
-ESCORT_PURPOSE_COL, ESCORT_PURPOSE_CODES = settings.get_codes('ESCORT_PURPOSES')
+
+assert isinstance(settings.COLUMN_NAMES, dict), 'COLUMN_NAMES not a dict'
+COLNAMES = settings.COLUMN_NAMES
+HH_ID_NAME = COLNAMES['HH_ID']
+PER_ID_NAME = COLNAMES['PER_ID']
+DAYNUM_COL = COLNAMES['DAYNUM']
+DAY_ID_NAME = COLNAMES['DAY_ID']
+TRIP_ID_NAME = COLNAMES['TRIP_ID']
+TRAVELDATE_COL = COLNAMES['TRAVELDATE']
+HOMELAT, HOMELON = COLNAMES['HOMELAT'], COLNAMES['HOMELON']
+DLAT, DLON = COLNAMES['DLAT'], COLNAMES['DLON']
 
 
 class ImputeSchoolTrips:
-    new_trips = []
     
     # def __init__(self, trips_df: pd.DataFrame) -> None:
         # Initialize TripCounter at this outer class level to avoid initializing within-loops
@@ -40,105 +53,187 @@ class ImputeSchoolTrips:
         assert isinstance(persons_df, pd.DataFrame), 'person table is not a DataFrame'        
         assert isinstance(day_df, pd.DataFrame), 'day table is not a DataFrame'
         
-        # Initialize trip counter with latest trips table
+        # Initialize trip counter, travel date index, id registry, reference school trips and school locations with latest trips table
         TRIP_COUNTER.initialize(trips_df)
+        TRAVEL_DATES.initialize(trips_df)
+        ID_REGISTRY.initialize(trips_df)
+        REFERENCE_SCHOOL_TRIPS.initialize(trips_df)
+        SCHOOL_LOCATIONS.initialize(trips_df, persons_df)
+        TIME_SAMPLERS.reset()
+        
+        # Find all person-days missing a school trip at once, each step below imputes all of its days in bulk
+        missing_days_df = self.find_missing_school_days(persons_df, day_df, trips_df)
+        print(f'{missing_days_df.shape[0]} of {day_df.shape[0]} person-days missing school trips')
+        
+        # 1) Does any other household member report an escorting trip with the student? All days are matched at once
+        escorted_trips_df = self.impute_from_escort(missing_days_df, trips_df, persons_df, households_df)
+        missing_days_df = missing_days_df[~missing_days_df.index.isin(escorted_trips_df[DAY_ID_NAME])]
         
-        new_trips = []
-        # Level 1 outer loop on households, initialize Household manager
-        for hh_id, hh in tqdm(households_df.groupby(level=0)):
-            Household = HouseholdManagerClass(hh)            
-            # Level 2 loop over persons in household, adding Household to Person manager
-            for person_id, person in Household.get_related('person').groupby(level=0):
-                Person = PersonManagerClass(person, Household)                            
-                # Level 3 loop over days for persons, adding Person to Day manager
-                for day_id, day in Person.get_related('day').groupby(level=0):
-                    Day = DayManagerClass(day, Person)                    
-                    # Skip if imputation is not required for this person-day
-                    if self.is_missing_school_trip(Day, person):
-                        # Impute missing school trips
-                        new_trips.append(self.school_trip_imputation(Day))
-                    # # Level 4 loop over tours to populate tours
-                    # for tour_id, tour in Day.get_related('tour').groupby(level=0):
-                    #     # There is no tour table yet, create an empty dummy to be populated
-                    #     Tour = TourManagerClass(tour, Day)
-                    #     person_day_tour_trips = Tour.get_related('trip', on=['hh_id', 'day_num', 'tour_num'])
-                    #     Tour.populate_tour(person_day_tour_trips)
-                    
+        # 2) Else is there a school trip on another day for that person? All days are merged with the reference school trips at once
+        altday_trips_df = self.impute_from_altday(missing_days_df, persons_df, households_df)
+        missing_days_df = missing_days_df[~missing_days_df.index.isin(altday_trips_df[DAY_ID_NAME])]
+        
+        # 3) Otherwise, create a completely new school trip and return trip home for the person
+        school_trips_df = self.impute_new_school_trips(missing_days_df, trips_df, persons_df, households_df)
+        
+        new_trips_df = pd.concat([escorted_trips_df, altday_trips_df, school_trips_df])
         print('Done')
         
-        imputed_school_trips_df = pd.concat(new_trips) # This probably needs fixing.
+        imputed_school_trips_df = pd.concat([trips_df, new_trips_df])
+        imputed_school_trips_df['imputed_school_trip'] = 0
+        imputed_school_trips_df.loc[new_trips_df.index, 'imputed_school_trip'] = 1
+        
         DBIO.update_table('trip', imputed_school_trips_df, step_name = 'impute_school_trips')
         
                         
-    def school_trip_imputation(self, Day: DayManagerClass) -> None:
-        # Initialize a new trip manager for the child
-        Trip = TripManagerClass(trip=None, Day=Day, Tour=None)
-        
-        # 1) Does any other household member report escorting trip with student?
-        # Includes trips from all other hh members on that day
-        hh_day_trips = Day.get_related('trip', on=['hh_id', 'day_num'])        
-        escort_trips = hh_day_trips[ESCORT_PURPOSE_COL].isin(ESCORT_PURPOSE_CODES)
-        if escort_trips.any():
-            # Loop over escort trips, if any, and create a new trip for the child
-            # This might have already been taken care of in the "nonproxy" step above                        
-            for escort_trip in hh_day_trips[escort_trips].itertuples():                
-                self.new_trips.append(
-                    Trip.impute_from_escort(escort_trip)
-                    )
+    def impute_from_escort(self, missing_days_df: pd.DataFrame, trips_df: pd.DataFrame, persons_df: pd.DataFrame, households_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Imputes the school trips of all escorted person-days at once.
+        Each person-day matched to an escort trip of another household member (see match_escort_trips) gets a copy of 
+        the escort trip, populated with the impute_from_escort column actions.
+
+        Args:
+            missing_days_df (pd.DataFrame): the days table rows missing school trips
+            trips_df (pd.DataFrame): trips table
+            persons_df (pd.DataFrame): persons table
+            households_df (pd.DataFrame): households table
 
-            return
+        Returns:
+            pd.DataFrame: the escorted school trips, indexed by the new trip id
+        """
+        
+        escort_trip_ids = match_escort_trips(missing_days_df, trips_df, persons_df, households_df)
+        print(f'{escort_trip_ids.shape[0]} person-days escorted to school by a household member')
         
-        # 2) Else if there a school trip on another day for that child?
-        # Includes trips from all other days for that person
-        person_trips = Day.Person.get_related('trip', on = ['hh_id', 'person_num'])        
-        altday_trips = person_trips[SCHOOL_PURPOSES_COL].isin(SCHOOL_PURPOSES_CODES)
+        Populator = SchoolTripPopulator(persons_df, households_df)
+        escorted_days = missing_days_df.loc[escort_trip_ids.index]
+        escorted_trips_df = Populator.populate(trips_df.loc[escort_trip_ids.to_numpy()], escorted_days, 'impute_from_escort')
         
-        assert isinstance(Day.Person.data, pd.Series), f'Class data not a DataFrame, expecting DataFrame here'        
-        is_18plus = Day.Person.data[CHILD_AGE_COL] not in CHILD_AGE_CODES
+        # Extend the persons' travel dates with the new trip days
+        TRAVEL_DATES.update(escorted_days[PER_ID_NAME], escorted_days[TRAVELDATE_COL])
         
-        if altday_trips.any() and is_18plus:            
-            self.new_trips.append(
-                Trip.impute_from_altday(person_trips[altday_trips].iloc[0])
+        return escorted_trips_df
+    
+    def impute_from_altday(self, missing_days_df: pd.DataFrame, persons_df: pd.DataFrame, households_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Imputes the school trips of all person-days with a school trip on another day at once.
+        The person-days are merged with the reference school trips (the first school trip of each person), and each gets
+        a copy of its reference trip, with the times shifted onto the travel date, populated with the impute_from_altday column actions.
+        Only applies to children who report their own trips, as in the ALTDAY_AGE codes, e.g., 16-17 year olds in rMove.
+
+        Args:
+            missing_days_df (pd.DataFrame): the days table rows missing school trips
+            persons_df (pd.DataFrame): persons table
+            households_df (pd.DataFrame): households table
+
+        Returns:
+            pd.DataFrame: the alternate day school trips, indexed by the new trip id
+        """
+        
+        is_self_reporting = persons_df.loc[missing_days_df[PER_ID_NAME], ALTDAY_AGE_COL].isin(ALTDAY_AGE_CODES).to_numpy()
+        
+        reference_trips = REFERENCE_SCHOOL_TRIPS.trips
+        altdays = missing_days_df[is_self_reporting].reset_index()[[DAY_ID_NAME, PER_ID_NAME]].merge(
+            reference_trips[[PER_ID_NAME]].reset_index(), on=PER_ID_NAME
             )
-            
-            return
-        
-        # 3) Otherwise, Create a completely new school trip for that person
-        self.new_trips.append(
-            Trip.impute_new_school_trip()
-        )
-      
-        return
-               
-    def is_missing_school_trip(self, Day: DayManagerClass, person: pd.DataFrame) -> bool:
+        print(f'{altdays.shape[0]} person-days with a school trip on another day')
+        
+        Populator = SchoolTripPopulator(persons_df, households_df)
+        altday_days = missing_days_df.loc[altdays[DAY_ID_NAME]]
+        altday_trips_df = Populator.populate(reference_trips.loc[altdays[TRIP_ID_NAME]], altday_days, 'impute_from_altday')
+        
+        # Extend the persons' travel dates with the new trip days
+        TRAVEL_DATES.update(altday_days[PER_ID_NAME], altday_days[TRAVELDATE_COL])
         
+        return altday_trips_df
+    
+    def impute_new_school_trips(self, missing_days_df: pd.DataFrame, trips_df: pd.DataFrame, persons_df: pd.DataFrame, households_df: pd.DataFrame) -> pd.DataFrame:
         """
-        Checks if the trips for the person on that day are missing any school trips.
+        Creates a new school trip and a return trip home for all the remaining person-days at once.
         
+        The school trips are populated from blank trips with the impute_new_school_trip column actions: times sampled for the
+        school level, the school location (see SchoolLocationIndex.locate), the school purpose by age and the typical school mode.
+        The return trips home are then populated from the school trips with the impute_return_home_trip column actions,
+        departing after the median time spent at school. Requires a valid school location to create the school trip.
+
         Args:
-            Day (DayManagerClass): the initialized Day class
-            person_day_trips: DataFrame trips table.
+            missing_days_df (pd.DataFrame): the days table rows missing school trips
+            trips_df (pd.DataFrame): trips table
+            persons_df (pd.DataFrame): persons table
+            households_df (pd.DataFrame): households table
 
-        Returns: boolean True/False
+        Returns:
+            pd.DataFrame: the school trips and return trips home, indexed by the new trip id, each return trip after its school trip
         """
         
-        # Skip if person not proxy (is adult)        
-        if not person[CHILD_AGE_COL].isin(CHILD_AGE_CODES).iloc[0]:
-            return False
-                
-        # Skip if person is pre-school age and school_type is not preschool (does not attend preschool)
-        is_preschool_age = person[PRESCHOOL_AGE_COL].isin(PRESCHOOL_AGE_CODES).iloc[0]
-        is_in_preschool = person[PRESCHOOL_TYPE_COL].isin(PRESCHOOL_TYPE_CODES).iloc[0]
-        if is_preschool_age and not is_in_preschool:
-            return False
+        person_ids = missing_days_df[PER_ID_NAME].to_numpy()
+        schools = SCHOOL_LOCATIONS.locate(
+            person_ids,
+            persons_df.loc[person_ids, PRESCHOOL_TYPE_COL].to_numpy(),
+            households_df.loc[missing_days_df[HH_ID_NAME], [HOMELAT, HOMELON]].to_numpy(dtype=float)
+            )
+        
+        has_school = schools[[DLAT, DLON]].notna().all(axis=1).to_numpy()
+        print(f'{has_school.sum()} person-days imputed with a new school trip, {(~has_school).sum()} without a known school location')
+        
+        days = missing_days_df[has_school]
+        Populator = SchoolTripPopulator(persons_df, households_df)
         
-        # Skip if person (child) already has school destination
-        person_day_trips = Day.get_related('trip', on=['hh_id', 'day_num'])
+        school_trips_df = Populator.populate(
+            Populator.blank_trips(trips_df, days.shape[0]), days, 'impute_new_school_trip', schools=schools[has_school].reset_index(drop=True)
+            )
+        return_trips_df = Populator.populate(school_trips_df, days, 'impute_return_home_trip')
+        
+        # Interleave each school trip with its return trip home, cast back to the trips table dtypes where possible
+        new_trips_df = pd.concat([school_trips_df, return_trips_df])
+        new_trips_df = new_trips_df.iloc[np.arange(new_trips_df.shape[0]).reshape(2, -1).T.ravel()]
+        new_trips_df = Populator.to_dtypes(new_trips_df, trips_df.dtypes)
         
-        if person_day_trips[SCHOOL_PURPCAT_COL].isin(SCHOOL_PURPCAT_CODES).any():        
-        # if person_day_trips[SCHOOL_PURPOSES_COL].isin(SCHOOL_PURPOSES_CODES).any():
-            return False
+        # Extend the persons' travel dates with the new trip days
+        TRAVEL_DATES.update(days[PER_ID_NAME], days[TRAVELDATE_COL])
         
-        return True
+        return new_trips_df
     
-    
\ No newline at end of file
+    def find_missing_school_days(self, persons_df: pd.DataFrame, days_df: pd.DataFrame, trips_df: pd.DataFrame) -> pd.DataFrame:
+        
+        """
+        Finds all the person-days missing any school trips in one pass over the person, day and trip tables.
+        
+        A person-day is missing a school trip if the person is a child, is not a pre-school age child who does 
+        not attend preschool, and none of the person's own trips on that day has a school purpose category.
+        A sibling's school trip does not cover the child. The trips of each person-day are read by position from the
+        DBIO group index of the trips table on person and day number.
+        
+        Args:
+            persons_df (pd.DataFrame): persons table
+            days_df (pd.DataFrame): days table
+            trips_df (pd.DataFrame): trips table
+
+        Returns: 
+            pd.DataFrame: the days table rows missing school trips, in household, person and day order
+        """
+        
+        # Children, skipping pre-school age children if school_type is not preschool (does not attend preschool)
+        is_child = persons_df[CHILD_AGE_COL].isin(CHILD_AGE_CODES)
+        is_preschool_age = persons_df[PRESCHOOL_AGE_COL].isin(PRESCHOOL_AGE_CODES)
+        is_in_preschool = persons_df[PRESCHOOL_TYPE_COL].isin(PRESCHOOL_TYPE_CODES)
+        student_ids = persons_df.index[is_child & ~(is_preschool_age & ~is_in_preschool)]
+        
+        # Person-days that already have a school destination, counted over each day's slice of the grouped trips
+        trip_groups = DBIO.get_group_index('trip', [PER_ID_NAME, DAYNUM_COL], trips_df)
+        starts, stops = trip_groups.bounds(days_df[PER_ID_NAME], days_df[DAYNUM_COL])
+        
+        is_school_trip = trip_groups.sorted(trips_df[SCHOOL_PURPCAT_COL].isin(SCHOOL_PURPCAT_CODES).to_numpy())
+        school_trip_counts = np.append(0, np.cumsum(is_school_trip))
+        has_school_trip = school_trip_counts[stops] > school_trip_counts[starts]
+        
+        missing_days_df = days_df[days_df[PER_ID_NAME].isin(student_ids).to_numpy() & ~has_school_trip]
+        
+        # Same order as looping over households by id, then their persons and days in table order
+        order = np.lexsort((
+            days_df.index.get_indexer(missing_days_df.index),
+            persons_df.index.get_indexer(missing_days_df[PER_ID_NAME]),
+            missing_days_df[HH_ID_NAME].to_numpy()
+            ))
+        
+        return missing_days_df.iloc[order]
@@ -0,0 +1,416 @@
+import pandas as pd
+import numpy as np
+
+# Local imports
+import settings
+from utils.misc import school_level
+from utils.trip_counter import TRIP_COUNTER
+from utils.travel_dates import TRAVEL_DATES
+from utils.id_registry import ID_REGISTRY
+from utils.column_actions import ColumnAction, compile_plan
+from school_trips.reference_trips import REFERENCE_SCHOOL_TRIPS
+from school_trips.time_sampler import TIME_SAMPLERS
+
+# Extract column names
+assert isinstance(settings.COLUMN_NAMES, dict), 'COLUMN_NAMES not a dict'
+
+COLNAMES = settings.COLUMN_NAMES
+
+PER_ID_NAME = COLNAMES['PER_ID']
+TRIP_ID_NAME = COLNAMES['TRIP_ID']
+HH_ID_NAME = COLNAMES['HH_ID']
+AGE_COL = COLNAMES['AGE']
+TRIPNUM_COL = COLNAMES['TRIPNUM']
+TRAVELDATE_COL = COLNAMES['TRAVELDATE']
+DRIVER_COL = COLNAMES['DRIVER']
+OTIME = COLNAMES['OTIME']
+DTIME = COLNAMES['DTIME']
+SCHOOL_PURPOSES_COL, _ = settings.get_codes(('SCHOOL_PURPOSES', 'PURPOSE'))
+SCHOOL_PURPCAT_COL, _ = settings.get_codes(('SCHOOL_PURPOSES', 'PURPOSE_CATEGORY'))
+HOME_OPURPOSE_COL, HOME_OPURPOSE_CODES = settings.get_codes(('HOME_PURPOSE', 'ORIGIN'))
+HOME_DPURPOSE_COL, HOME_DPURPOSE_CODES = settings.get_codes(('HOME_PURPOSE', 'DESTINATION'))
+_, HOME_PURPCAT_CODES = settings.get_codes(('HOME_PURPOSE', 'CATEGORY'))
+IMPUTED_SCHOOL_PURPOSE_CAT = settings.IMPUTED_SCHOOL_PURPOSE_CAT
+LOCAL_TZ = settings.LOCAL_TIMEZONE
+
+# The timestamp each shifted time field is taken from
+SHIFTED_TIMES = {OTIME: OTIME, DTIME: DTIME, 'depart_date': OTIME, 'arrive_date': DTIME}
+
+
+def utc_offset(times: pd.Series) -> pd.Series:
+    """
+    The UTC offset of each timezone aware timestamp, e.g., -7 hours for PDT and -8 hours for PST.
+
+    Args:
+        times (pd.Series): Timezone aware timestamps
+
+    Returns:
+        pd.Series: The UTC offset of each timestamp, as timedeltas
+    """
+
+    return times.dt.tz_localize(None) - times.dt.tz_convert('UTC').dt.tz_localize(None)
+
+
+class SchoolTripPopulator:
+    """
+    Create new school trips in bulk for person-days missing a school trip, one new trip per host trip and day.
+    The attributes are populated using the class methods listed in the strategy's column of the school trip column actions file.
+
+    Each action is applied as a column operation over all new trips at once, columns without an action keep the host trip value.
+    """
+
+    def __init__(self, persons_df: pd.DataFrame, households_df: pd.DataFrame) -> None:
+        self.persons_df = persons_df
+        self.households_df = households_df
+
+    def populate(self, host_trips: pd.DataFrame, days: pd.DataFrame, strategy: str, **kwargs) -> pd.DataFrame:
+        """
+        Populates a new trip for each day from its host trip.
+
+        Args:
+            host_trips (pd.DataFrame): The host trip of each new trip, indexed by trip id, row aligned with days
+            days (pd.DataFrame): The day table rows of each new trip, indexed by day id
+            strategy (str): The school trip imputation strategy, the action column in the column actions file
+            **kwargs: Other row aligned inputs of the strategy's methods, e.g., schools for get_school_location
+
+        Returns:
+            pd.DataFrame: The new trips indexed by the new trip id, with the same columns and dtypes as the host trips
+        """
+
+        assert strategy in SCHOOL_TRIP_BATCH_PLANS, f'No batch plan for {strategy}'
+        assert host_trips.shape[0] == days.shape[0], 'host_trips and days must be row aligned'
+
+        person_ids = days[PER_ID_NAME].to_numpy()
+
+        # Pull the new trip numbers and trip ids from the trip counter, in day order
+        trip_nums, new_trip_ids = TRIP_COUNTER.allocate('trip', person_ids)
+
+        locals_dict = {
+            'host_trips': host_trips,
+            'days': days,
+            'persons': self.persons_df.loc[person_ids],
+            'households': self.households_df.loc[days[HH_ID_NAME].to_numpy()],
+            'trip_nums': trip_nums,
+            'trip_ids': new_trip_ids,
+            'sampled': {},
+            **kwargs
+            }
+
+        # Host columns are the default, the arrays keep the host dtypes
+        columns = {colname: host_trips[colname].array for colname in host_trips.columns}
+
+        # Apply each action to the whole column, actions for columns not in the trips table are skipped
+        for action in SCHOOL_TRIP_BATCH_PLANS[strategy]:
+            for colname in action.fields:
+                if colname in columns:
+                    value = self.populate_column(colname, action, **locals_dict)
+                    if value is not None:
+                        columns[colname] = value
+
+        new_trips = pd.DataFrame(columns, index=pd.Index(new_trip_ids, name=TRIP_ID_NAME))
+
+        ID_REGISTRY.register('trip', new_trips.index)
+
+        return new_trips
+
+    def populate_column(self, colname, action: ColumnAction, **kwargs) -> str|int|float|np.ndarray|pd.api.extensions.ExtensionArray|None:
+        # Constants are already evaluated in the compiled plan
+        if action.is_constant:
+            return action.value
+
+        # otherwise call the method
+        kwargs['colname'] = colname
+        kwargs['from_field'] = action.from_field
+
+        return getattr(self, action.method)(**kwargs)
+
+    def copy_from(self, table: str, **kwargs) -> np.ndarray|pd.api.extensions.ExtensionArray:
+        """
+        Generic method to copy a field from the day, person or household of each new trip.
+
+        Args:
+            table (str): The table to copy from. Either days, persons or households.
+
+        Returns:
+            np.ndarray|ExtensionArray: The values to copy to the new trips
+        """
+
+        assert table in ['days', 'persons', 'households'], 'Table must be days, persons or households'
+
+        frame = kwargs[table]
+        field = kwargs['from_field'] or kwargs['colname']
+
+        if frame.index.name == field:
+            return frame.index.to_numpy()
+
+        assert field in frame.columns, f'Field {field} not in {table}'
+
+        return frame[field].array
+
+    def copy_from_host(self, **kwargs) -> pd.api.extensions.ExtensionArray:
+        field = kwargs['from_field'] or kwargs['colname']
+        assert field in kwargs['host_trips'].columns, f'Column {field} does not exist in host trip'
+
+        return kwargs['host_trips'][field].array
+
+    def copy_from_day(self, **kwargs) -> np.ndarray|pd.api.extensions.ExtensionArray:
+        return self.copy_from('days', **kwargs)
+
+    def copy_from_person(self, **kwargs) -> np.ndarray|pd.api.extensions.ExtensionArray:
+        return self.copy_from('persons', **kwargs)
+
+    def copy_from_household(self, **kwargs) -> np.ndarray|pd.api.extensions.ExtensionArray:
+        return self.copy_from('households', **kwargs)
+
+    def update_trip_num(self, **kwargs) -> np.ndarray:
+        """
+        Update the trip number or trip id for the new trips, already pulled from the trip counter in populate.
+
+        Returns:
+            np.ndarray: returns the new trip numbers or trip ids
+        """
+
+        return kwargs['trip_nums'] if kwargs['colname'] == TRIPNUM_COL else kwargs['trip_ids']
+
+    def update_first_date(self, **kwargs) -> pd.api.extensions.ExtensionArray:
+        return self.travel_date_extreme('min', **kwargs)
+
+    def update_last_date(self, **kwargs) -> pd.api.extensions.ExtensionArray:
+        return self.travel_date_extreme('max', **kwargs)
+
+    def travel_date_extreme(self, how: str, **kwargs) -> pd.api.extensions.ExtensionArray:
+        """
+        Looks up the minimum or maximum travel date of each person's trips in the travel date index, including the new trip day.
+
+        Args:
+            how (str): Either 'min' or 'max'
+
+        Returns:
+            ExtensionArray: The dates for each new trip
+        """
+
+        days = kwargs['days']
+        dates = TRAVEL_DATES.lookup(how, days[PER_ID_NAME].to_list(), days[TRAVELDATE_COL].to_list())
+
+        return pd.array(dates, dtype=kwargs['host_trips'][kwargs['colname']].dtype)
+
+    def shift_times(self, **kwargs) -> pd.api.extensions.ExtensionArray|np.ndarray:
+        """
+        Shifts the host trip times onto the travel date of each new trip, keeping the local time of day.
+        The local times are shifted by whole days and converted back to the time zone of the host trips.
+        A time shifted into the repeated hour when daylight saving time ends keeps the UTC offset of the host trip if it can,
+        otherwise it takes the daylight saving time occurrence.
+
+        Returns:
+            ExtensionArray|np.ndarray: The shifted timestamps, or the shifted local dates for depart_date and arrive_date
+        """
+
+        assert kwargs['colname'] in SHIFTED_TIMES, f'Cannot shift {kwargs["colname"]}'
+
+        host_times = kwargs['host_trips'][SHIFTED_TIMES[kwargs['colname']]]
+        days_shift = (
+            pd.to_datetime(kwargs['days'][TRAVELDATE_COL].to_numpy()) - pd.to_datetime(kwargs['host_trips'][TRAVELDATE_COL].to_numpy())
+            ).to_numpy()
+
+        host_local = host_times.dt.tz_convert(LOCAL_TZ)
+        shifted = host_local.dt.tz_localize(None) + days_shift
+        
+        # Ambiguous times take daylight saving time, unless the host trip has the smaller, standard time, UTC offset
+        dst_local = shifted.dt.tz_localize(LOCAL_TZ, ambiguous=np.ones(shifted.shape[0], dtype=bool), nonexistent='shift_forward')
+        is_dst = utc_offset(host_local).to_numpy() >= utc_offset(dst_local).to_numpy()
+        local = shifted.dt.tz_localize(LOCAL_TZ, ambiguous=is_dst, nonexistent='shift_forward')
+        assert not local.isna().any(), 'Shifted times could not be localized'
+
+        if kwargs['colname'] not in [OTIME, DTIME]:
+            return local.dt.date.to_numpy()
+
+        return local.dt.tz_convert(host_times.dt.tz).array
+
+    def sample_times(self, **kwargs) -> pd.api.extensions.ExtensionArray|np.ndarray:
+        """
+        Samples the depart and arrive times on the travel date of each new trip, from the school trips of the same school level.
+        All the time fields are sampled at once on the first call, one batch per school level.
+
+        Returns:
+            ExtensionArray|np.ndarray: The sampled values of the field, see TimeSampler.sample
+        """
+
+        sampled = kwargs['sampled']
+
+        if 'times' not in sampled:
+            travel_dates = kwargs['days'][TRAVELDATE_COL].to_numpy()
+            levels = pd.Series(school_level(kwargs['persons'][AGE_COL].to_numpy()))
+
+            batches = []
+            for level, rows in levels.groupby(levels, sort=False, dropna=False).indices.items():
+                sampler = TIME_SAMPLERS.get(level)
+                batches.append(sampler.sample(travel_dates[rows], LOCAL_TZ, TIME_SAMPLERS.data_tz).set_axis(rows))
+
+            sampled['times'] = pd.concat(batches).sort_index()
+
+        assert kwargs['colname'] in sampled['times'].columns, f'Cannot sample {kwargs["colname"]}'
+
+        return sampled['times'][kwargs['colname']].array
+
+    def return_times(self, **kwargs) -> pd.api.extensions.ExtensionArray|np.ndarray:
+        """
+        The times of the return trips home, departing the school after the median time spent at school for the school level
+        and taking as long as the host school trip. The hour, minute and second fields are in local time, as in the survey data.
+
+        Returns:
+            ExtensionArray|np.ndarray: The values of the time field
+        """
+
+        sampled = kwargs['sampled']
+
+        if 'times' not in sampled:
+            host = kwargs['host_trips']
+            levels = school_level(kwargs['persons'][AGE_COL].to_numpy())
+            duration = pd.to_timedelta(host['duration_seconds'].to_numpy(), unit='s')
+
+            depart = host[DTIME] + pd.to_timedelta(TIME_SAMPLERS.dwell(levels), unit='s')
+            arrive = depart + duration
+            depart_local = depart.dt.tz_convert(LOCAL_TZ)
+            arrive_local = arrive.dt.tz_convert(LOCAL_TZ)
+
+            sampled['times'] = pd.DataFrame({
+                'depart_time': depart,
+                'arrive_time': arrive,
+                'depart_date': depart_local.dt.date,
+                'arrive_date': arrive_local.dt.date,
+                'depart_hour': depart_local.dt.hour,
+                'depart_minute': depart_local.dt.minute,
+                'depart_seconds': depart_local.dt.second,
+                'arrive_hour': arrive_local.dt.hour,
+                'arrive_minute': arrive_local.dt.minute,
+                'arrive_second': arrive_local.dt.second,
+                'duration_minutes': host['duration_minutes'],
+                'duration_seconds': host['duration_seconds'],
+                })
+
+        assert kwargs['colname'] in sampled['times'].columns, f'No return time {kwargs["colname"]}'
+
+        return sampled['times'][kwargs['colname']].array
+
+    def get_school_location(self, **kwargs) -> pd.api.extensions.ExtensionArray:
+        """
+        Copy the field from the school of each new trip, see SchoolLocationIndex.locate.
+
+        Returns:
+            ExtensionArray: The school field values
+        """
+
+        field = kwargs['from_field'] or kwargs['colname']
+        assert field in kwargs['schools'].columns, f'Field {field} not in schools'
+
+        return kwargs['schools'][field].array
+
+    def update_driver(self, **kwargs) -> pd.api.extensions.ExtensionArray:
+        """
+        Update the driver for the new trips, a child escorted by a driver is a passenger.
+
+        1 = driver
+        2 = passenger
+        3 = both (switched drivers during trip)
+        995 = na
+
+        Returns:
+            ExtensionArray: driver values
+        """
+
+        host_driver = kwargs['host_trips'][DRIVER_COL]
+
+        return host_driver.mask(host_driver == 1, 2).array
+
+    def get_purpose(self, **kwargs) -> np.ndarray|int|None:
+        """
+        The school purpose of each new trip, the purpose of the person's first school trip if any, otherwise by age.
+        The purpose category is the imputed school purpose category. Other purpose fields keep the host value.
+
+        Returns:
+            np.ndarray|int|None: The purposes, the purpose category or None to keep the host value
+        """
+
+        if kwargs['colname'] == SCHOOL_PURPCAT_COL:
+            return IMPUTED_SCHOOL_PURPOSE_CAT
+
+        if kwargs['colname'] != SCHOOL_PURPOSES_COL:
+            return None
+
+        persons = kwargs['persons']
+        purposes = REFERENCE_SCHOOL_TRIPS.get(persons.index, SCHOOL_PURPOSES_COL).astype(float)
+        by_age = school_level(persons[AGE_COL].to_numpy())
+
+        purposes = np.where(np.isnan(purposes), by_age, purposes)
+
+        # Keep the host dtype unless a purpose is missing
+        if np.isnan(purposes).any():
+            return purposes
+
+        return purposes.astype(kwargs['host_trips'][SCHOOL_PURPOSES_COL].dtype)
+
+    def get_home_purpose(self, **kwargs) -> int:
+        """
+        The home purpose and purpose category, for the home end of the new trips.
+
+        Returns:
+            int: The home purpose or purpose category code
+        """
+
+        if kwargs['colname'] == HOME_OPURPOSE_COL:
+            return HOME_OPURPOSE_CODES[0]
+
+        if kwargs['colname'] == HOME_DPURPOSE_COL:
+            return HOME_DPURPOSE_CODES[0]
+
+        return HOME_PURPCAT_CODES[0]
+
+    @staticmethod
+    def blank_trips(trips_df: pd.DataFrame, n: int) -> pd.DataFrame:
+        """
+        A host of n blank trips with the trips table columns, for new trips without a host trip.
+
+        Args:
+            trips_df (pd.DataFrame): The trips table
+            n (int): The number of trips
+
+        Returns:
+            pd.DataFrame: The blank trips, all missing values
+        """
+
+        return trips_df.iloc[:0].reindex(pd.RangeIndex(n))
+
+    @staticmethod
+    def to_dtypes(new_trips: pd.DataFrame, dtypes: pd.Series) -> pd.DataFrame:
+        """
+        Casts the new trip columns back to the trips table dtypes, where the cast does not change any value.
+        Columns with missing values, e.g., from blank trips, keep their dtype.
+
+        Args:
+            new_trips (pd.DataFrame): The new trips
+            dtypes (pd.Series): The trips table dtypes
+
+        Returns:
+            pd.DataFrame: The new trips
+        """
+
+        for colname in new_trips.columns[new_trips.dtypes != dtypes.reindex(new_trips.columns)]:
+            if colname not in dtypes or new_trips[colname].isna().any():
+                continue
+
+            try:
+                values = new_trips[colname].astype(dtypes[colname])
+            except (TypeError, ValueError):
+                continue
+
+            if (values == new_trips[colname]).all():
+                new_trips[colname] = values
+
+        return new_trips
+
+
+# Compile the column actions of each batch school trip imputation strategy once, a malformed config fails here on import
+SCHOOL_TRIP_BATCH_PLANS = {
+    strategy: compile_plan('impute_school_trips', strategy, SchoolTripPopulator)
+    for strategy in ['impute_from_escort', 'impute_from_altday', 'impute_new_school_trip', 'impute_return_home_trip']
+    }
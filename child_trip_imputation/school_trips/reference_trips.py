@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+import settings
+
+# CONSTANTS
+assert isinstance(settings.COLUMN_NAMES, dict), 'COLUMN_NAMES not a dict'
+
+PER_ID_NAME = settings.COLUMN_NAMES['PER_ID']
+SCHOOL_PURPOSES_COL, SCHOOL_PURPOSES_CODES = settings.get_codes(('SCHOOL_PURPOSES', 'PURPOSE'))
+
+
+class ReferenceSchoolTrips:
+    """
+    This reference school trip class is intended to be a global helper class, similar to the trip counter,
+    holding the first school purpose trip of each person, with its times, mode and location.
+
+    It is built once per step from the trips table, so a person's own school trip is a lookup or a merge
+    instead of a scan of the person's trips.
+    """
+
+    def __init__(self, trips_df: pd.DataFrame|None = None) -> None:
+        self.trips = pd.DataFrame()
+        self.person_ids = pd.Index([])
+
+        if trips_df is not None:
+            self.initialize(trips_df)
+
+    def initialize(self, trips_df: pd.DataFrame) -> None:
+        """
+        Initialize the reference school trips from the trips table, the first school purpose trip of each person in table order.
+        Can be used to reset the reference trips if needed.
+
+        Args:
+            trips_df (pd.DataFrame): The trips table
+        """
+        assert isinstance(trips_df, pd.DataFrame), 'trips_df must be a DataFrame'
+
+        school_trips = trips_df[trips_df[SCHOOL_PURPOSES_COL].isin(SCHOOL_PURPOSES_CODES)]
+        self.trips = school_trips[~school_trips[PER_ID_NAME].duplicated()]
+        self.person_ids = pd.Index(self.trips[PER_ID_NAME])
+
+        return
+
+    def get(self, person_ids, field: str) -> np.ndarray:
+        """
+        Returns a field of each person's reference school trip.
+
+        Args:
+            person_ids (array-like): The person ids
+            field (str): The trip field, e.g., d_purpose
+
+        Returns:
+            np.ndarray: The field value of each person's reference school trip, NaN if none
+        """
+
+        return self.trips[field].set_axis(self.person_ids).reindex(np.asarray(person_ids)).to_numpy()
+
+# Initialize the global reference school trips object
+REFERENCE_SCHOOL_TRIPS = ReferenceSchoolTrips()
@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+import settings
+from utils.distance import within_distance
+from school_trips.reference_trips import REFERENCE_SCHOOL_TRIPS
+
+# CONSTANTS
+assert isinstance(settings.COLUMN_NAMES, dict), 'COLUMN_NAMES not a dict'
+
+COLNAMES = settings.COLUMN_NAMES
+PER_ID_NAME = COLNAMES['PER_ID']
+DLAT, DLON = COLNAMES['DLAT'], COLNAMES['DLON']
+SCHOOL_PURPOSES_COL, SCHOOL_PURPOSES_CODES = settings.get_codes(('SCHOOL_PURPOSES', 'PURPOSE'))
+SCHOOL_TYPE_COL, _ = settings.get_codes('PRESCHOOL_TYPES')
+
+# Marks no school within the maximum distance
+MISSING = -1
+
+
+class SchoolLocationIndex:
+    """
+    This school location index class is intended to be a global helper class, similar to the trip counter,
+    to find the nearest known school location of the same school type for a home location.
+
+    The known school locations are the destinations of school purpose trips, grouped by the school type of the person
+    who made them. A haversine BallTree is built once per school type at the start of the step,
+    so finding the nearest school for many homes is a batched tree query instead of a scan of the trips table.
+    """
+
+    def __init__(self, trips_df: pd.DataFrame|None = None, persons_df: pd.DataFrame|None = None) -> None:
+        self.school_trips = pd.DataFrame()
+        self.latlons = np.empty((0, 2))
+        self.trees = {}
+        self.rows = {}
+
+        if trips_df is not None and persons_df is not None:
+            self.initialize(trips_df, persons_df)
+
+    def initialize(self, trips_df: pd.DataFrame, persons_df: pd.DataFrame) -> None:
+        """
+        Initialize the school location trees from the school purpose trips and the school type of each person.
+        Can be used to reset the index if needed.
+
+        Args:
+            trips_df (pd.DataFrame): The trips table
+            persons_df (pd.DataFrame): The persons table, indexed by person id
+        """
+        assert isinstance(trips_df, pd.DataFrame), 'trips_df must be a DataFrame'
+        assert isinstance(persons_df, pd.DataFrame), 'persons_df must be a DataFrame'
+
+        # School purpose trips with a valid destination
+        is_school = trips_df[SCHOOL_PURPOSES_COL].isin(SCHOOL_PURPOSES_CODES)
+        is_located = trips_df[[DLAT, DLON]].notna().all(axis=1)
+        self.school_trips = trips_df[is_school & is_located]
+
+        school_types = persons_df[SCHOOL_TYPE_COL].reindex(self.school_trips[PER_ID_NAME]).to_numpy()
+        self.latlons = np.radians(self.school_trips[[DLAT, DLON]].to_numpy(dtype=float))
+
+        self.trees, self.rows = {}, {}
+        for school_type in pd.unique(school_types[pd.notna(school_types)]):
+            rows = np.flatnonzero(school_types == school_type)
+            self.trees[school_type] = BallTree(self.latlons[rows], metric='haversine')
+            self.rows[school_type] = rows
+
+        return
+
+    def query(self, school_types, home_latlons: np.ndarray, max_dist: float|None = None, k: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the k nearest known school locations of the same school type for a batch of homes,
+        if the haversine distance is less than the maximum distance.
+
+        Args:
+            school_types (array-like): The school type of each home's student
+            home_latlons (np.ndarray): N x 2 array of home lat/lon in degrees
+            max_dist (float|None, optional): Maximum distance in meters, exclusive. Defaults to None, which uses settings.MAX_SCHOOL_DIST.
+            k (int, optional): The number of nearest schools. Defaults to 1.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: N x k arrays of the school trip row positions (-1 if none) and distances in meters (NaN if none), nearest first
+        """
+
+        max_dist = settings.MAX_SCHOOL_DIST if max_dist is None else max_dist
+        assert isinstance(max_dist, (int, float)), 'MAX_SCHOOL_DIST must be a number'
+
+        school_types = np.asarray(school_types)
+        latlons = np.radians(np.asarray(home_latlons, dtype=float).reshape(-1, 2))
+        assert school_types.shape[0] == latlons.shape[0], 'school_types and home_latlons must be the same length'
+
+        rows = np.full((latlons.shape[0], k), MISSING, dtype=np.int64)
+        dists = np.full((latlons.shape[0], k), np.nan)
+
+        is_located = ~np.isnan(latlons).any(axis=1)
+        for school_type, tree in self.trees.items():
+            homes = np.flatnonzero((school_types == school_type) & is_located)
+            if homes.size == 0:
+                continue
+
+            k_type = min(k, self.rows[school_type].size)
+            type_dists, type_idx = tree.query(latlons[homes], k=k_type)
+
+            rows[homes, :k_type] = self.rows[school_type][type_idx]
+            dists[homes, :k_type] = type_dists * settings.R
+
+        # Drop schools beyond the maximum distance, with the same exclusive cutoff as the other distance buffers
+        is_far = rows == MISSING
+        homes, nth = np.nonzero(~is_far)
+        is_far[homes, nth] = ~within_distance(latlons[homes], self.latlons[rows[homes, nth]], max_dist)
+        rows[is_far] = MISSING
+        dists[is_far] = np.nan
+
+        return rows, dists
+
+    def locate(self, person_ids, school_types, home_latlons: np.ndarray) -> pd.DataFrame:
+        """
+        Finds the school of a batch of students, the destination of their reference school trip if located,
+        otherwise the nearest known school location of the same school type within MAX_SCHOOL_DIST of home.
+
+        Args:
+            person_ids (array-like): The person id of each student
+            school_types (array-like): The school type of each student
+            home_latlons (np.ndarray): N x 2 array of home lat/lon in degrees
+
+        Returns:
+            pd.DataFrame: The fields of each student's school trip, e.g., d_lat and d_lon, all NaN if no school is found
+        """
+
+        reference = REFERENCE_SCHOOL_TRIPS.trips
+        rows = REFERENCE_SCHOOL_TRIPS.person_ids.get_indexer(np.asarray(person_ids))
+
+        # Reference school trips without a destination are unknown
+        is_known = rows != MISSING
+        is_known[is_known] = reference[[DLAT, DLON]].notna().all(axis=1).to_numpy()[rows[is_known]]
+
+        # Nearest known schools are after the reference trips in the candidates
+        is_unknown = ~is_known
+        nearest, _ = self.query(np.asarray(school_types)[is_unknown], np.asarray(home_latlons, dtype=float).reshape(-1, 2)[is_unknown])
+        rows[is_unknown] = np.where(nearest[:, 0] != MISSING, nearest[:, 0] + reference.shape[0], MISSING)
+
+        candidates = pd.concat([reference, self.school_trips], ignore_index=True)
+
+        return candidates.reindex(rows).reset_index(drop=True)
+
+# Initialize the global school location index object
+SCHOOL_LOCATIONS = SchoolLocationIndex()
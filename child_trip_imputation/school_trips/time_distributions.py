@@ -0,0 +1,171 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+
+import settings
+from utils.misc import get_dep_arr_dist, school_level
+
+# CONSTANTS
+assert isinstance(settings.COLUMN_NAMES, dict), 'COLUMN_NAMES not a dict'
+
+COLNAMES = settings.COLUMN_NAMES
+PER_ID_NAME = COLNAMES['PER_ID']
+AGE_COL = COLNAMES['AGE']
+OTIME = COLNAMES['OTIME']
+DTIME = COLNAMES['DTIME']
+DAYNUM_COL = COLNAMES['DAYNUM']
+TRIPNUM_COL = COLNAMES['TRIPNUM']
+SCHOOL_PURPOSES_COL, SCHOOL_PURPOSES_CODES = settings.get_codes(('SCHOOL_PURPOSES', 'PURPOSE'))
+
+# The distributions of all school trips, used for levels with too few school trips of their own
+ALL_LEVELS = 'all'
+MIN_LEVEL_TRIPS = 30
+
+
+def distributions_key(trips_df: pd.DataFrame, persons_df: pd.DataFrame, method: str) -> str:
+    """
+    Hashes the inputs of the school trip time distributions: the school trip times, the age of the person making
+    each trip and the settings used to build them. Any change to these gives a new key.
+
+    Args:
+        trips_df (pd.DataFrame): The trips table
+        persons_df (pd.DataFrame): The persons table
+        method (str): The get_dep_arr_dist method
+
+    Returns:
+        str: The hex digest of the inputs
+    """
+
+    school_trips = trips_df.loc[trips_df[SCHOOL_PURPOSES_COL].isin(SCHOOL_PURPOSES_CODES), [PER_ID_NAME, OTIME, DTIME]]
+    inputs = school_trips.assign(**{AGE_COL: persons_df[AGE_COL].reindex(school_trips[PER_ID_NAME]).to_numpy()})
+
+    options = [method, settings.TIME_INCREMENT, settings.LOCAL_TIMEZONE, settings.SCHOOL_PURPOSE_AGE, MIN_LEVEL_TRIPS]
+
+    digest = hashlib.sha256(pd.util.hash_pandas_object(inputs, index=False).to_numpy().tobytes())
+    digest.update(repr(options).encode())
+
+    return digest.hexdigest()[:16]
+
+def build_time_distributions(trips_df: pd.DataFrame, persons_df: pd.DataFrame, method: str) -> dict:
+    """
+    Builds the depart time and duration distributions of all school trips, and of each school level
+    with at least MIN_LEVEL_TRIPS school trips.
+
+    Args:
+        trips_df (pd.DataFrame): The trips table
+        persons_df (pd.DataFrame): The persons table
+        method (str): The get_dep_arr_dist method
+
+    Returns:
+        dict: The (depart time, duration) distributions, keyed by school level or ALL_LEVELS
+    """
+
+    assert isinstance(settings.SCHOOL_PURPOSE_AGE, dict), 'SCHOOL_PURPOSE_AGE must be a dictionary'
+
+    distributions = {ALL_LEVELS: tuple(get_dep_arr_dist(trips_df, persons_df, method=method).values())}
+
+    school_trips = trips_df[trips_df[SCHOOL_PURPOSES_COL].isin(SCHOOL_PURPOSES_CODES)]
+    levels = school_level(persons_df[AGE_COL].reindex(school_trips[PER_ID_NAME]).to_numpy())
+
+    for level in settings.SCHOOL_PURPOSE_AGE:
+        if (levels == level).sum() >= MIN_LEVEL_TRIPS:
+            distributions[level] = tuple(get_dep_arr_dist(trips_df, persons_df, method=method, level=level).values())
+
+    return distributions
+
+def school_dwells(trips_df: pd.DataFrame, persons_df: pd.DataFrame) -> dict:
+    """
+    The median time spent at school, from the arrival of each school trip to the departure of the person's next trip that day,
+    for all school trips and for each school level with at least MIN_LEVEL_TRIPS school trips followed by another trip.
+
+    Args:
+        trips_df (pd.DataFrame): The trips table
+        persons_df (pd.DataFrame): The persons table
+
+    Returns:
+        dict: The median dwell in seconds, keyed by school level or ALL_LEVELS
+    """
+
+    trips = trips_df.sort_values([PER_ID_NAME, DAYNUM_COL, TRIPNUM_COL], kind='stable')
+    next_depart = trips.groupby([PER_ID_NAME, DAYNUM_COL])[OTIME].shift(-1)
+    dwells = (next_depart - trips[DTIME]).dt.total_seconds()
+
+    is_school = trips[SCHOOL_PURPOSES_COL].isin(SCHOOL_PURPOSES_CODES) & (dwells > 0)
+    dwells = dwells[is_school]
+    levels = school_level(persons_df[AGE_COL].reindex(trips.loc[is_school, PER_ID_NAME]).to_numpy())
+
+    # Whole seconds, as in the survey times
+    medians = {ALL_LEVELS: np.round(dwells.median())}
+    for level, level_dwells in dwells.groupby(levels):
+        if level_dwells.shape[0] >= MIN_LEVEL_TRIPS:
+            medians[level] = np.round(level_dwells.median())
+
+    return medians
+
+def to_frame(distributions: dict) -> pd.DataFrame:
+    """
+    Flattens the distributions to a long table of level, distribution, seconds and density for caching.
+    """
+
+    frames = []
+    for level, (dep_freq, dur_freq) in distributions.items():
+        for name, freq in [('depart_time', dep_freq), ('duration_seconds', dur_freq)]:
+            seconds = [t.hour * 3600 + t.minute * 60 + t.second for t in freq.index] if name == 'depart_time' else freq.index.total_seconds()
+            frames.append(pd.DataFrame({
+                'level': str(level), 'distribution': name, 'seconds': np.asarray(seconds, dtype=np.int64), 'density': freq.to_numpy()
+                }))
+
+    return pd.concat(frames, ignore_index=True)
+
+def from_frame(df: pd.DataFrame) -> dict:
+    """
+    Rebuilds the distributions from the long cache table, the inverse of to_frame.
+    """
+
+    distributions = {}
+    for level, level_df in df.groupby('level', sort=False):
+        dep = level_df[level_df.distribution == 'depart_time']
+        dur = level_df[level_df.distribution == 'duration_seconds']
+
+        dep_index = pd.to_datetime(dep.seconds.to_numpy(), unit='s').time
+        dur_index = pd.to_timedelta(dur.seconds.to_numpy(), unit='s')
+
+        key = level if level == ALL_LEVELS else int(level)
+        distributions[key] = (
+            pd.Series(dep.density.to_numpy(), index=dep_index, name='depart_time'),
+            pd.Series(dur.density.to_numpy(), index=dur_index, name='duration_seconds')
+            )
+
+    return distributions
+
+def load_time_distributions(trips_df: pd.DataFrame, persons_df: pd.DataFrame, method: str = 'KDE') -> dict:
+    """
+    Loads the school trip depart time and duration distributions from the cache directory, keyed by a hash of the inputs.
+    If not cached, builds them and saves them to the cache directory, if set, so they are only built once across runs.
+
+    Args:
+        trips_df (pd.DataFrame): The trips table
+        persons_df (pd.DataFrame): The persons table
+        method (str, optional): The get_dep_arr_dist method. Defaults to 'KDE'.
+
+    Returns:
+        dict: The (depart time, duration) distributions, keyed by school level or ALL_LEVELS
+    """
+
+    cache_path = None
+    if settings.CACHE_DIR:
+        key = distributions_key(trips_df, persons_df, method)
+        cache_path = os.path.join(settings.CACHE_DIR, f'school_time_distributions_{key}.parquet')
+
+    if cache_path and os.path.isfile(cache_path):
+        print(f'Load school trip time distributions from {cache_path}')
+        return from_frame(pd.read_parquet(cache_path))
+
+    print('Build school trip time distributions')
+    distributions = build_time_distributions(trips_df, persons_df, method)
+
+    if cache_path:
+        to_frame(distributions).to_parquet(cache_path)
+
+    return distributions
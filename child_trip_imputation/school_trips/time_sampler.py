@@ -0,0 +1,217 @@
+import numpy as np
+import pandas as pd
+
+import settings
+from utils.io import DBIO
+from school_trips.time_distributions import ALL_LEVELS, load_time_distributions, school_dwells
+
+# CONSTANTS
+assert isinstance(settings.COLUMN_NAMES, dict), 'COLUMN_NAMES not a dict'
+OTIME = settings.COLUMN_NAMES['OTIME']
+
+
+def to_seconds(index: pd.Index) -> np.ndarray:
+    """
+    Converts a distribution index of times of day or timedeltas to integer seconds.
+
+    Args:
+        index (pd.Index): Index of datetime.time or timedelta values
+
+    Returns:
+        np.ndarray: The seconds of each value
+    """
+
+    if isinstance(index, pd.TimedeltaIndex):
+        return (index / pd.Timedelta('1 second')).to_numpy().astype(np.int64)
+
+    return np.array([t.hour * 3600 + t.minute * 60 + t.second for t in index], dtype=np.int64)
+
+
+class TimeSampler:
+    """
+    Samples school trip depart times and durations from the depart time and duration frequency distributions.
+
+    The cumulative distributions are computed once, and depart/duration pairs for a whole batch of person-days
+    are drawn with a NumPy Generator. Seeding the generator, e.g., with settings.RANDOM_SEED, makes runs reproducible,
+    and drawing many batches from the same sampler is cheap, e.g., for Monte Carlo replicates.
+    """
+
+    def __init__(self, dep_freq: pd.Series, dur_freq: pd.Series, seed: int|np.random.Generator|None = None) -> None:
+        assert isinstance(dep_freq, pd.Series), 'dep_freq must be a Series'
+        assert isinstance(dur_freq, pd.Series), 'dur_freq must be a Series'
+
+        self.dep_seconds = to_seconds(dep_freq.index)
+        self.dur_seconds = to_seconds(dur_freq.index)
+        self.dep_cdf = self.to_cdf(dep_freq)
+        self.dur_cdf = self.to_cdf(dur_freq)
+
+        self.rng = np.random.default_rng(seed)
+
+    @staticmethod
+    def to_cdf(freq: pd.Series) -> np.ndarray:
+        """
+        Converts frequency weights to a cumulative distribution ending at 1.
+
+        Args:
+            freq (pd.Series): The frequency weights
+
+        Returns:
+            np.ndarray: The cumulative distribution
+        """
+        cdf = np.cumsum(freq.to_numpy(dtype=float))
+        assert cdf.size > 0 and cdf[-1] > 0, 'Frequency distribution must have positive weights'
+
+        return cdf / cdf[-1]
+
+    def draw(self, n: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Draws n depart times and durations by inverse transform sampling of the cumulative distributions.
+
+        Args:
+            n (int): The number of draws
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The depart time in seconds after midnight and the duration in seconds of each draw
+        """
+
+        dep_idx = np.searchsorted(self.dep_cdf, self.rng.random(n), side='right')
+        dur_idx = np.searchsorted(self.dur_cdf, self.rng.random(n), side='right')
+
+        # Guard against floating point rounding at the top of the distribution
+        dep_idx = np.minimum(dep_idx, self.dep_cdf.size - 1)
+        dur_idx = np.minimum(dur_idx, self.dur_cdf.size - 1)
+
+        return self.dep_seconds[dep_idx], self.dur_seconds[dur_idx]
+
+    def sample(self, travel_dates, local_tz: str, data_tz: str) -> pd.DataFrame:
+        """
+        Samples a depart and arrive time for each travel date.
+        The depart time is sampled as a local time on the travel date and converted to the data time zone.
+        The hour, minute and second fields are in local time, as in the survey data.
+        Depart times in the repeated hour when daylight saving time ends are taken as the first, daylight saving time, occurrence.
+
+        Args:
+            travel_dates (array-like): The travel date of each trip
+            local_tz (str): The local time zone, e.g., settings.LOCAL_TIMEZONE
+            data_tz (str): The time zone of the trips table timestamps
+
+        Returns:
+            pd.DataFrame: The sampled time fields of each trip, see sample_times
+        """
+
+        travel_dates = pd.to_datetime(pd.Series(travel_dates)).dt.normalize()
+        dep_seconds, dur_seconds = self.draw(travel_dates.shape[0])
+
+        duration = pd.to_timedelta(dur_seconds, unit='s')
+        depart_local = (travel_dates + pd.to_timedelta(dep_seconds, unit='s')).dt.tz_localize(
+            local_tz, ambiguous=np.ones(travel_dates.shape[0], dtype=bool), nonexistent='shift_forward'
+            )
+        assert not depart_local.isna().any(), 'Sampled depart times could not be localized'
+        arrive_local = depart_local + duration
+
+        return pd.DataFrame({
+            'depart_time': depart_local.dt.tz_convert(data_tz),
+            'arrive_time': arrive_local.dt.tz_convert(data_tz),
+            'depart_date': travel_dates.dt.date,
+            'arrive_date': travel_dates.dt.date,
+            'depart_hour': depart_local.dt.hour,
+            'depart_minute': depart_local.dt.minute,
+            'depart_seconds': depart_local.dt.second,
+            'arrive_hour': arrive_local.dt.hour,
+            'arrive_minute': arrive_local.dt.minute,
+            'arrive_second': arrive_local.dt.second,
+            'duration_minutes': dur_seconds / 60,
+            'duration_seconds': dur_seconds,
+            })
+
+
+class TimeSamplers:
+    """
+    This class is intended to be a global helper class, similar to the trip counter, holding a TimeSampler 
+    for each school level. The distributions are only loaded or built on first use, from the current trips 
+    and persons tables, so runs that never sample school trip times never build them.
+    All samplers share one generator seeded with settings.RANDOM_SEED.
+    
+    The time zone of the trips table timestamps and the median time spent at school by school level
+    are also taken on first use, as data_tz and dwells.
+    """
+
+    def __init__(self) -> None:
+        self.distributions = None
+        self.dwells = None
+        self.samplers = {}
+        self.rng = None
+        self.data_tz = None
+
+    def reset(self) -> None:
+        """
+        Resets the samplers, so the distributions are reloaded from the current tables on next use, e.g., at the start of a step.
+        """
+        self.distributions = None
+        self.dwells = None
+        self.samplers = {}
+        self.rng = None
+        self.data_tz = None
+
+        return
+
+    def load(self) -> None:
+        """
+        Loads the distributions and dwells from the current trips and persons tables, if not already loaded.
+        """
+
+        if self.distributions is not None:
+            return
+
+        trips_df = DBIO.get_table('trip')
+        persons_df = DBIO.get_table('person')
+        assert isinstance(trips_df, pd.DataFrame), 'trip table is not a DataFrame'
+        assert isinstance(persons_df, pd.DataFrame), 'person table is not a DataFrame'
+
+        self.distributions = load_time_distributions(trips_df, persons_df)
+        self.dwells = school_dwells(trips_df, persons_df)
+        self.rng = np.random.default_rng(settings.RANDOM_SEED)
+        self.data_tz = str(trips_df[OTIME].dt.tz)
+
+        return
+
+    def get(self, level) -> TimeSampler:
+        """
+        Returns the sampler of a school level, falling back to all school trips if the level has too few school trips.
+
+        Args:
+            level: The school level, see school_level
+
+        Returns:
+            TimeSampler: The sampler
+        """
+
+        self.load()
+        assert isinstance(self.distributions, dict), 'distributions not loaded'
+
+        level = level if level in self.distributions else ALL_LEVELS
+
+        if level not in self.samplers:
+            self.samplers[level] = TimeSampler(*self.distributions[level], seed=self.rng)
+
+        return self.samplers[level]
+
+    def dwell(self, levels) -> np.ndarray:
+        """
+        Returns the median time spent at school of each school level, falling back to all school trips
+        if the level has too few school trips.
+
+        Args:
+            levels (array-like): The school level of each trip, see school_level
+
+        Returns:
+            np.ndarray: The dwell in seconds of each trip
+        """
+
+        self.load()
+        assert isinstance(self.dwells, dict), 'dwells not loaded'
+
+        return np.array([self.dwells.get(level, self.dwells[ALL_LEVELS]) for level in levels], dtype=float)
+
+# Initialize the global time samplers object
+TIME_SAMPLERS = TimeSamplers()
@@ -90,6 +90,7 @@ STEPS = SETTINGS.get('STEPS')
 PG_HOST = SETTINGS.get('PG_HOST', 'pops.rsginc.com') # Set defaults like this
 DB_SYS = SETTINGS.get('DB_SYS', 'postgresql')
 JOINT_TRIP_BUFFER = SETTINGS.get('JOINT_TRIP_BUFFER')
+JOINT_TRIP_BUFFER_SWEEP = SETTINGS.get('JOINT_TRIP_BUFFER_SWEEP', [])
 STUDY_SCHEMA = SETTINGS.get('STUDY_SCHEMA')
 PG_DB = SETTINGS.get('PG_DB')
 PG_PORT = SETTINGS.get('PG_PORT')
@@ -106,6 +107,8 @@ LOCAL_TIMEZONE = SETTINGS.get('LOCAL_TIMEZONE')
 SCHOOL_PURPOSE_AGE = SETTINGS.get('SCHOOL_PURPOSE_AGE')
 IMPUTED_SCHOOL_PURPOSE_CAT = SETTINGS.get('IMPUTED_SCHOOL_PURPOSE_CAT')
 MAX_SCHOOL_DIST = SETTINGS.get('MAX_SCHOOL_DIST')
+ESCORT_MATCH = SETTINGS.get('ESCORT_MATCH')
+RANDOM_SEED = SETTINGS.get('RANDOM_SEED')
 
 
 # Radius of the Earth for Haversine distance calculation
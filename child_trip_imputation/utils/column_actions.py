@@ -0,0 +1,127 @@
+"""
+Compiles the column action config tables listed under IMPUTATION_CONFIGS into cached execution plans.
+
+Each config table has a colname column and one or more action columns. An action is either an expression that
+directly sets a value, e.g., int(995) or np.nan, or the name of a populator method, optionally with a from_field
+alias, e.g., copy_from_household:home_lat. The expressions are evaluated, the method names are checked against the
+populator class, and the aliases are split once when the plan is compiled, so populating a record is a plain dispatch.
+A malformed config fails when the plan is compiled at import, instead of mid-run.
+"""
+
+import os
+import re
+import numpy as np # Used by the evaluated expressions, e.g., np.nan
+import pandas as pd
+
+import settings
+
+# Expressions that directly set a value, e.g., int(995) or np.nan
+EXPRESSION_PATTERN = re.compile(r'(str\(|int\(|float\(|np\.)')
+
+# Compiled plans, keyed by config name, action column and populator class
+PLANS = {}
+
+
+class ColumnAction:
+    """
+    A single compiled action, the fields it populates and either a constant value or a populator method name.
+    """
+    __slots__ = ('fields', 'method', 'from_field', 'is_constant', 'value')
+
+    def __init__(self, fields: list, method: str|None = None, from_field: str|None = None, is_constant: bool = False, value=None) -> None:
+        self.fields = fields
+        self.method = method
+        self.from_field = from_field
+        self.is_constant = is_constant
+        self.value = value
+
+    def __repr__(self) -> str:
+        action = f'{self.value!r}' if self.is_constant else f'{self.method}:{self.from_field}' if self.from_field else self.method
+        return f'ColumnAction({action} -> {self.fields})'
+
+
+def load_config(config: str) -> pd.DataFrame:
+    """
+    Reads and checks the column action config table.
+
+    Args:
+        config (str): The IMPUTATION_CONFIGS key, e.g., impute_school_trips
+
+    Returns:
+        pd.DataFrame: The config table
+    """
+
+    assert isinstance(settings.IMPUTATION_CONFIGS, dict), 'IMPUTATION_CONFIGS not a dict'
+
+    path = settings.IMPUTATION_CONFIGS.get(config)
+    assert isinstance(path, str), f'{config} not in IMPUTATION_CONFIGS'
+    assert os.path.isfile(path), f'File {path} does not exist'
+
+    actions = pd.read_csv(path)
+
+    assert 'colname' in actions.columns, f'No colname column in {path}'
+    duplicated = actions.colname[actions.colname.duplicated()].tolist()
+    assert len(duplicated) == 0, f'Columns {duplicated} listed more than once in {path}'
+
+    return actions
+
+def compile_plan(config: str, action: str, populator: type) -> list[ColumnAction]:
+    """
+    Compiles an action column of a config table into a list of actions, one per distinct action in config order.
+    Fields with the same action are grouped, so multi-column methods (e.g., sample_times) are only called once.
+    Columns with an empty action are left out. The plan is cached, so each config is only compiled once.
+
+    Args:
+        config (str): The IMPUTATION_CONFIGS key, e.g., impute_school_trips
+        action (str): The action column to compile, e.g., impute_new_school_trip
+        populator (type): The class the methods are looked up on
+
+    Returns:
+        list[ColumnAction]: The compiled plan
+    """
+
+    key = (config, action, populator)
+    if key in PLANS:
+        return PLANS[key]
+
+    actions = load_config(config)
+    assert action in actions.columns, f'No {action} column in {config} config'
+
+    plan = []
+    for method, fields in actions.groupby(action, sort=False).colname:
+        assert isinstance(method, str), f'Invalid action {method} in {config} config'
+        fields = fields.to_list()
+
+        # Evaluate expressions that directly set the value once
+        if EXPRESSION_PATTERN.search(method) is not None:
+            try:
+                value = eval(method)
+            except Exception as error:
+                raise ValueError(f'Invalid expression {method} for {fields} in {config} config') from error
+
+            plan.append(ColumnAction(fields, is_constant=True, value=value))
+            continue
+
+        # Otherwise bind to a populator method, with an optional from_field alias
+        method, alias, from_field = method.partition(':')
+        assert callable(getattr(populator, method, None)), f'No method {method} found in {populator.__name__} for {fields} in {config} config'
+        assert not alias or from_field.isidentifier(), f'Invalid from_field {from_field!r} of {method} for {fields} in {config} config'
+
+        plan.append(ColumnAction(fields, method=method, from_field=from_field or None))
+
+    PLANS[key] = plan
+
+    return plan
+
+def plan_fields(plan: list[ColumnAction]) -> list:
+    """
+    Returns all the fields populated by a plan.
+
+    Args:
+        plan (list[ColumnAction]): The compiled plan
+
+    Returns:
+        list: The field names
+    """
+
+    return [field for action in plan for field in action.fields]
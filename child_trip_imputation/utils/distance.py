@@ -0,0 +1,93 @@
+"""
+Distance functions shared by the joint trip buffer and the school trip imputation, where they check the escort trip
+match distance and the MAX_SCHOOL_DIST cutoff of the nearest school.
+
+Exact haversine distances are expensive, and most pairs are either far inside or far outside the threshold.
+So a cheap float32 equirectangular (flat-earth) distance is used as a prefilter, and exact haversine is only
+calculated for the pairs that fall within a conservative margin of the threshold.
+The result is the same as thresholding the exact haversine distance as long as the equirectangular relative error
+stays below MARGIN. The error grows with the distance and towards the poles, it is below 1e-4 for distances up to
+50 km at latitudes up to 85 degrees, which covers the thresholds used here, but not long distances near the poles.
+
+All lat/lon inputs are in radians with lat/lon on the last axis, distances are in meters.
+"""
+
+import numpy as np
+import settings
+
+# Relative error margin of the equirectangular approximation, very conservative for distances up to 50 km below 85 degrees latitude
+MARGIN = 0.01
+
+
+def haversine(latlons_a: np.ndarray, latlons_b: np.ndarray) -> np.ndarray:
+    """
+    Element-wise haversine distance between paired lat/lon coordinates in radians.
+    Same formula as sklearn.metrics.pairwise.haversine_distances, but only evaluated on the given pairs.
+
+    Args:
+        latlons_a (np.ndarray): ... x 2 array of lat/lon in radians
+        latlons_b (np.ndarray): ... x 2 array of lat/lon in radians, broadcastable with latlons_a
+
+    Returns:
+        np.ndarray: The distances on the unit sphere, multiply by settings.R for meters
+    """
+
+    sin_0 = np.sin(0.5 * (latlons_a[..., 0] - latlons_b[..., 0]))
+    sin_1 = np.sin(0.5 * (latlons_a[..., 1] - latlons_b[..., 1]))
+    result = sin_0 * sin_0 + np.cos(latlons_a[..., 0]) * np.cos(latlons_b[..., 0]) * sin_1 * sin_1
+
+    return 2 * np.arcsin(np.sqrt(result))
+
+def equirectangular(latlons_a: np.ndarray, latlons_b: np.ndarray) -> np.ndarray:
+    """
+    Element-wise approximate flat-earth distance in meters, calculated in float32.
+    The coordinate differences are taken in float64 first so the float32 rounding is relative to the distance, not the coordinates.
+
+    Args:
+        latlons_a (np.ndarray): ... x 2 array of lat/lon in radians
+        latlons_b (np.ndarray): ... x 2 array of lat/lon in radians, broadcastable with latlons_a
+
+    Returns:
+        np.ndarray: The approximate distances in meters
+    """
+
+    dlat = (latlons_a[..., 0] - latlons_b[..., 0]).astype(np.float32)
+    dlon = (latlons_a[..., 1] - latlons_b[..., 1])
+
+    # Wrap longitude difference across the antimeridian
+    dlon = ((dlon + np.pi) % (2 * np.pi) - np.pi).astype(np.float32)
+
+    mean_lat = (0.5 * (latlons_a[..., 0] + latlons_b[..., 0])).astype(np.float32)
+    x = dlon * np.cos(mean_lat)
+
+    return np.float32(settings.R) * np.sqrt(x * x + dlat * dlat)
+
+def within_distance(latlons_a: np.ndarray, latlons_b: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Element-wise check if the haversine distance is less than the threshold.
+    Pairs clearly inside or outside the threshold are decided by the equirectangular prefilter,
+    only the pairs near the threshold are refined with exact haversine.
+    Supports broadcasting, e.g., latlons[:, np.newaxis] and latlons[np.newaxis, :] for a pairwise matrix.
+
+    Args:
+        latlons_a (np.ndarray): ... x 2 array of lat/lon in radians
+        latlons_b (np.ndarray): ... x 2 array of lat/lon in radians, broadcastable with latlons_a
+        threshold (float): Maximum distance in meters, exclusive
+
+    Returns:
+        np.ndarray: Boolean array, True where the distance is less than the threshold
+    """
+
+    approx = equirectangular(latlons_a, latlons_b)
+
+    is_within = approx < threshold * (1 - MARGIN)
+
+    # Refine the pairs near the threshold, or with missing coordinates, using exact haversine
+    is_near = ~is_within & ~(approx > threshold * (1 + MARGIN))
+
+    if is_near.any():
+        latlons_a, latlons_b = np.broadcast_arrays(latlons_a, latlons_b)
+        dist = haversine(latlons_a[is_near], latlons_b[is_near])*settings.R
+        is_within[is_near] = dist < threshold
+
+    return is_within
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+from utils.misc import group_offsets
+
+
+class GroupIndex:
+    """
+    Positional index of a table's rows grouped by one or more key columns (or the index), e.g., hh_id, person_id,
+    day_id or (hh_id, day_num).
+
+    The row positions are stably sorted by the keys once, and each key value maps to the (start, stop) offsets of its
+    group, so fetching the rows of a group is a lookup and a slice instead of a boolean scan of the whole table.
+    Whole batches of key values are looked up at once with bounds, and expanded to their rows with positions.
+    Rows within a group keep their table order.
+    """
+
+    def __init__(self, df: pd.DataFrame, keys: list) -> None:
+        assert isinstance(df, pd.DataFrame), 'df must be a DataFrame'
+        assert isinstance(keys, list) and len(keys) > 0, 'keys must be a non-empty list'
+
+        self.keys = keys
+        self.size = df.shape[0]
+
+        # Factorize each key, so mixed or object dtypes can be sorted. Missing keys get code -1.
+        codes, uniques = [], []
+        for key in keys:
+            values = df.index if key == df.index.name else df[key]
+            key_codes, key_uniques = pd.factorize(values, sort=True)
+            codes.append(key_codes)
+            uniques.append(key_uniques)
+
+        # Stable sort on the key codes, the last key given to lexsort is the primary one
+        order = np.lexsort(codes[::-1])
+        sorted_codes = [c[order] for c in codes]
+        starts, sizes = group_offsets(*sorted_codes)
+
+        # If the table is already sorted by the keys the groups are plain row slices
+        self.order = None if (order == np.arange(self.size)).all() else order
+
+        # The key value, or values for multiple keys, of each group and its offsets in the sorted rows
+        group_codes = [c[starts] for c in sorted_codes]
+        is_valid = np.logical_and.reduce([c >= 0 for c in group_codes])
+        group_values = [u.take(c[is_valid]) for u, c in zip(uniques, group_codes)]
+
+        self.groups = pd.Index(group_values[0]) if len(keys) == 1 else pd.MultiIndex.from_arrays(group_values)
+        self.starts = starts[is_valid]
+        self.stops = (starts + sizes)[is_valid]
+
+    def rows(self, value) -> slice|np.ndarray:
+        """
+        Returns the row positions of a group, a slice if the table is sorted by the keys.
+
+        Args:
+            value: The key value, or a tuple of values for multiple keys
+
+        Returns:
+            slice|np.ndarray: The row positions, empty if the key value is not found
+        """
+
+        group = self.groups.get_indexer([value])[0]
+        start, stop = (self.starts[group], self.stops[group]) if group >= 0 else (0, 0)
+
+        if self.order is None:
+            return slice(start, stop)
+
+        return self.order[start:stop]
+
+    def bounds(self, *values) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Looks up the group offsets of a batch of key values at once, e.g., the (hh_id, day_num) of each school-day.
+        The offsets are into the sorted rows, see positions and sorted.
+
+        Args:
+            *values (array-like): One array of key values per key column, in the order of the keys
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The start and stop offset of each key value's group, (0, 0) if not found
+        """
+
+        assert len(values) == len(self.keys), f'Expected one array of values for each of {self.keys}'
+
+        lookup = pd.Index(np.asarray(values[0])) if len(values) == 1 else pd.MultiIndex.from_arrays([np.asarray(v) for v in values])
+        groups = self.groups.get_indexer(lookup)
+
+        # Key values not found are -1, which picks the trailing empty (0, 0) group
+        return np.append(self.starts, 0)[groups], np.append(self.stops, 0)[groups]
+
+    def positions(self, starts: np.ndarray, stops: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Expands group offsets from bounds to the table rows of each group, without looping over the groups.
+
+        Args:
+            starts (np.ndarray): The start offset of each group
+            stops (np.ndarray): The stop offset of each group
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The number of the looked up key value and the table row position of each row,
+            rows of the same key value in table order
+        """
+
+        sizes = stops - starts
+        lookups = np.repeat(np.arange(sizes.size), sizes)
+        offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes) + np.repeat(starts, sizes)
+
+        return lookups, offsets if self.order is None else self.order[offsets]
+
+    def sorted(self, values: np.ndarray) -> np.ndarray:
+        """
+        Reorders a column of the table into the sorted group order, so group offsets from bounds slice it directly.
+
+        Args:
+            values (np.ndarray): A table column, in table row order
+
+        Returns:
+            np.ndarray: The column in group order
+        """
+
+        values = np.asarray(values)
+        assert values.shape[0] == self.size, 'values must be a column of the indexed table'
+
+        return values if self.order is None else values[self.order]
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import settings
+
+# Extract column names
+assert isinstance(settings.COLUMN_NAMES, dict), 'COLUMN_NAMES not a dict'
+
+COLNAMES = settings.COLUMN_NAMES
+TRIP_ID_NAME = COLNAMES['TRIP_ID']
+JOINT_TRIP_ID_NAME = COLNAMES['JOINT_TRIP_ID']
+
+
+class IdRegistry:
+    """
+    This id registry class is intended to be a global helper class, similar to the trip counter,
+    to keep track of every trip id and joint trip id in use.
+
+    The ids are held in sorted int64 arrays. New ids are validated in batches with a binary search
+    against the existing ids and a hash check against each other, and all collisions in a batch are reported together.
+    """
+
+    def __init__(self, trips_df: pd.DataFrame|None = None) -> None:
+        self.ids = {'trip': np.empty(0, dtype=np.int64), 'joint_trip': np.empty(0, dtype=np.int64)}
+
+        if trips_df is not None:
+            self.initialize(trips_df)
+
+    def initialize(self, trips_df: pd.DataFrame) -> None:
+        """
+        Initialize the registry with the trip ids and joint trip ids of the trips table.
+        Missing joint trip ids (995 or NaN) are not registered.
+
+        Args:
+            trips_df (pd.DataFrame): The trips table, indexed by trip id
+        """
+        assert isinstance(trips_df, pd.DataFrame), 'trips_df must be a DataFrame'
+        assert trips_df.index.name == TRIP_ID_NAME, f'trips_df must be indexed by {TRIP_ID_NAME}'
+
+        self.ids['trip'] = np.unique(trips_df.index.to_numpy(dtype=np.int64))
+
+        if JOINT_TRIP_ID_NAME in trips_df.columns:
+            joint_trip_ids = trips_df[JOINT_TRIP_ID_NAME]
+            joint_trip_ids = joint_trip_ids[joint_trip_ids.notna() & (joint_trip_ids != 995)]
+            self.ids['joint_trip'] = np.unique(joint_trip_ids.to_numpy(dtype=np.int64))
+        else:
+            self.ids['joint_trip'] = np.empty(0, dtype=np.int64)
+
+        return
+
+    def register(self, id_name: str, new_ids) -> None:
+        """
+        Validates and registers a batch of new ids.
+        Fails if any id already exists or appears more than once in the batch, listing all collisions.
+
+        Args:
+            id_name (str): ['joint_trip', 'trip'] The type of id
+            new_ids (array-like): The new ids
+        """
+
+        assert id_name in self.ids, f'id_name must be one of {list(self.ids)}'
+
+        registered = self.ids[id_name]
+        new_ids = np.asarray(new_ids, dtype=np.int64).ravel()
+
+        # Binary search of the sorted registered ids
+        positions = np.searchsorted(registered, new_ids)
+        is_existing = registered[np.minimum(positions, registered.size - 1)] == new_ids if registered.size > 0 else np.zeros(new_ids.size, dtype=bool)
+        is_repeated = pd.Index(new_ids).duplicated()
+
+        existing = pd.unique(new_ids[is_existing]).tolist()
+        repeated = pd.unique(new_ids[is_repeated & ~is_existing]).tolist()
+
+        msg = f'{len(existing) + len(repeated)} new {id_name} id collisions. '
+        msg += f'Already exist: {existing}. Repeated in batch: {repeated}'
+        assert len(existing) + len(repeated) == 0, msg
+
+        # Merge the new ids in, keeping the registered ids sorted
+        new_ids = np.sort(new_ids)
+        self.ids[id_name] = np.insert(registered, np.searchsorted(registered, new_ids), new_ids)
+
+        return
+
+# Initialize the global id registry object
+ID_REGISTRY = IdRegistry()
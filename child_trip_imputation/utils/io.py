@@ -6,6 +6,7 @@ import sqlalchemy
 from datetime import datetime
 
 import settings
+from utils.group_index import GroupIndex
 
 class IO:
     """
@@ -27,6 +28,9 @@ class IO:
         if settings.OUTPUT_DIR and not os.path.isdir(settings.OUTPUT_DIR):
             os.makedirs(settings.OUTPUT_DIR)
         
+        # Positional group indices, keyed by table and key columns, see get_group_index
+        self.group_indices = {}
+        
         # Initialize log either way. If cache dir is not set, log will not be saved.        
         dtypes = np.dtype([('index', str), ("table", str), ('timestamp', datetime), ("cached_table", str)])
         index = pd.Index([], name='step_name', dtype=str)
@@ -182,6 +186,34 @@ class IO:
         
         return df
     
+    def get_group_index(self, table: str, keys: list, df: pd.DataFrame|None = None) -> GroupIndex:
+        """
+        Returns the positional group index of a table on the key columns, e.g., ['hh_id'] or ['hh_id', 'day_num'].
+        The index is built once per table version and reused until the table is replaced, e.g., by update_table.
+
+        Args:
+            table (str): The canonical table name
+            keys (list): The key columns, or the index name
+            df (pd.DataFrame|None, optional): The table, if already fetched. Defaults to None, which fetches it.
+
+        Returns:
+            GroupIndex: The group index
+        """
+        df = self.get_table(table) if df is None else df
+        assert isinstance(df, pd.DataFrame), f'{table} must be a pandas DataFrame'
+        
+        # The cached index holds the table it was built on, a new table object is a new version
+        cache_key = (table, tuple(keys))
+        indexed_df, group_index = self.group_indices.get(cache_key, (None, None))
+        
+        if indexed_df is not df:
+            group_index = GroupIndex(df, list(keys))
+            self.group_indices[cache_key] = (df, group_index)
+        
+        assert isinstance(group_index, GroupIndex), f'Group index for {table} on {keys} not built'
+        
+        return group_index
+    
     def record_exists(self, table: str, id: str|int) -> bool:
         df = self.get_table(table)
         assert isinstance(df, pd.DataFrame), f'{table} must be a pandas DataFrame'
@@ -1,7 +1,8 @@
 import numpy as np
 import pandas as pd
 import settings
-from scipy.stats import gaussian_kde
+from scipy.signal import fftconvolve
+from scipy.sparse import coo_matrix, csgraph
 
 # Constants
 # Extract column names for origin and destination lat/lon
@@ -16,6 +17,7 @@ OTIME = COLNAMES['OTIME']
 DTIME = COLNAMES['DTIME']
 OHOUR = COLNAMES['OHOUR']
 DHOUR = COLNAMES['DHOUR']
+AGE_COL = COLNAMES['AGE']
 
 # Codes
 assert isinstance(settings.CODES, dict)
@@ -58,36 +60,256 @@ def cat_trip_id(row: pd.Series) -> int:
     
     return int(f'{person_id}{trip_num:03d}')
 
-# Generate a function that returns the disjoint set of a graph
-def disjoint_set(edges: np.ndarray) -> dict:
+def cat_ids(prefix_ids: np.ndarray, nums: np.ndarray, width: int) -> np.ndarray:
     """
-    This function returns the disjoint set of a graph of edges
+    Vectorized version of cat_trip_id and cat_joint_trip_id, concatenates each id and zero-padded number.
+    Same as int(f'{prefix_id}{num:0{width}d}'), numbers wider than the padding are concatenated in full.
 
     Args:
-        edges (np.ndarray): The trip pairs to be checked for disjointedness
+        prefix_ids (np.ndarray): The person or household ids
+        nums (np.ndarray): The positive trip or joint trip numbers
+        width (int): The zero-padded width of the number, 3 for trips and 2 for joint trips
 
     Returns:
-        dict: A dictionary of disjointed sets withere the key is the index ID of the trip and the value is the set ID (aka joint trip number)
+        np.ndarray: The concatenated ids
     """
     
-    parents = {}
-    for i, edge in enumerate(edges, start=1):
-        for x in edge:
-            if x not in parents:
-                parents[x] = i
+    nums = np.asarray(nums, dtype=np.int64)
+    digits = np.array([max(width, len(str(num))) for num in nums], dtype=np.int64) if nums.max(initial=0) >= 10**width else width
     
-    return parents
+    return np.asarray(prefix_ids, dtype=np.int64) * 10**digits + nums
 
-def get_dep_arr_dist(trips_df: pd.DataFrame, persons_df: pd.DataFrame, method: str) -> dict:
+def connected_components(a: np.ndarray, b: np.ndarray, n_nodes: int) -> np.ndarray:
+    """
+    Labels the connected components of a graph of edges, e.g., person-trips connected by joint trip pairs.
+    Uses a sparse graph so it scales linearly with the number of edges and can be run over all households at once.
+    Connected components are transitive, so chains A-B, B-C are labeled as one component.
+
+    Args:
+        a (np.ndarray): The node index of the A side of each edge
+        b (np.ndarray): The node index of the B side of each edge
+        n_nodes (int): The total number of nodes
+
+    Returns:
+        np.ndarray: The component label for each node, or -1 for nodes without any edges
+    """
+    
+    graph = coo_matrix((np.ones(a.size, dtype=bool), (a, b)), shape=(n_nodes, n_nodes))
+    _, labels = csgraph.connected_components(graph, directed=False)
+    
+    # Nodes without edges are their own component, but are not joined to anything
+    has_edge = np.zeros(n_nodes, dtype=bool)
+    has_edge[a] = True
+    has_edge[b] = True
+    labels[~has_edge] = -1
+    
+    return labels
+
+def compact_labels(labels: np.ndarray, group_ids: np.ndarray) -> np.ndarray:
+    """
+    Renumbers labels to 1, 2, ... k within each group, in order of first appearance. 
+    E.g., to give joint trips a compact joint trip number per household.
+
+    Args:
+        labels (np.ndarray): The label for each row, -1 for unlabeled rows. A label must not span groups.
+        group_ids (np.ndarray): The group id for each row
+
+    Returns:
+        np.ndarray: The compact label for each row, unlabeled rows remain -1
+    """
+    
+    compact = np.full(labels.size, -1, dtype=np.int64)
+    rows = np.flatnonzero(labels >= 0)
+    if rows.size == 0:
+        return compact
+    
+    # Find the first row of each label, then rank the labels within each group by that first row
+    unique_labels, first = np.unique(labels[rows], return_index=True)
+    first_rows = rows[first]
+    order = np.lexsort((first_rows, group_ids[first_rows]))
+    ordered_groups = group_ids[first_rows][order]
+    
+    ranks = np.empty(order.size, dtype=np.int64)
+    ranks[order] = np.arange(order.size) - np.searchsorted(ordered_groups, ordered_groups) + 1
+    compact[rows] = ranks[np.searchsorted(unique_labels, labels[rows])]
+    
+    return compact
+
+def group_offsets(*keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the start offset and size of each contiguous group in pre-sorted key arrays.
+    A new group starts wherever any of the key arrays changes value.
+
+    Args:
+        *keys (np.ndarray): One or more equal length key arrays, already sorted by group
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The start offsets and sizes of each group
+    """
+    
+    n = len(keys[0])
+    assert all(len(k) == n for k in keys), 'Key arrays must be the same length'
+    
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    
+    is_new = np.zeros(n, dtype=bool)
+    is_new[0] = True
+    for k in keys:
+        is_new[1:] |= k[1:] != k[:-1]
+    
+    starts = np.flatnonzero(is_new)
+    sizes = np.diff(np.append(starts, n))
+    
+    return starts, sizes
+
+def group_pairs(starts: np.ndarray, sizes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Builds every ordered pair of distinct rows within each group, without looping over groups.
+    Pairs are returned row-major within each group, the same order as np.where on a group's N x N matrix.
+
+    Args:
+        starts (np.ndarray): The start offset of each group
+        sizes (np.ndarray): The size of each group
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The row positions of the A and B side of each pair
+    """
+    
+    # Each row is paired with every row in its own group, so repeat each row by its group size
+    row_sizes = np.repeat(sizes, sizes)
+    row_starts = np.repeat(starts, sizes)
+    a = np.repeat(np.arange(row_sizes.size), row_sizes)
+    
+    # Position of B within the group is the running count within each block of A
+    block_starts = np.cumsum(row_sizes) - row_sizes
+    b = np.repeat(row_starts, row_sizes) + np.arange(a.size) - np.repeat(block_starts, row_sizes)
+    
+    # Drop self pairs
+    not_self = a != b
+    
+    return a[not_self], b[not_self]
+
+def time_window_pairs(starts: np.ndarray, sizes: np.ndarray, times: np.ndarray, time_threshold: np.timedelta64) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Sorted sweep that finds every ordered pair of distinct rows within each group whose times are within the threshold.
+    Rows are sorted by group then time, and each row is compared to its k-th neighbor for k = 1, 2, ...
+    until no row has a neighbor left inside the time window, so only pairs inside the window are ever built.
+    Pairs are returned in the same row-major order as group_pairs. Missing times (NaT) never pair.
+
+    Args:
+        starts (np.ndarray): The start offset of each group
+        sizes (np.ndarray): The size of each group
+        times (np.ndarray): datetime64 array of times for each row
+        time_threshold (np.timedelta64): Maximum absolute time difference, exclusive
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The row positions of the A and B side of each pair
+    """
+    
+    group_ids = np.repeat(np.arange(starts.size), sizes)
+    
+    # Sort valid rows by group then time
+    rows = np.flatnonzero(~np.isnat(times))
+    order = np.lexsort((times[rows], group_ids[rows]))
+    rows = rows[order]
+    sorted_groups, sorted_times = group_ids[rows], times[rows]
+    
+    # Sweep forward, dropping a row once its k-th neighbor is outside the window
+    a_ls, b_ls = [], []
+    active = np.arange(rows.size)
+    k = 1
+    while active.size > 0:
+        active = active[active + k < rows.size]
+        ahead = active + k
+        in_window = (sorted_groups[ahead] == sorted_groups[active]) & (sorted_times[ahead] - sorted_times[active] < time_threshold)
+        active = active[in_window]
+        a_ls.append(rows[active])
+        b_ls.append(rows[active + k])
+        k += 1
+    
+    # Add both directions and sort row-major
+    a = np.concatenate(a_ls + b_ls) if a_ls else np.zeros(0, dtype=np.int64)
+    b = np.concatenate(b_ls + a_ls) if b_ls else np.zeros(0, dtype=np.int64)
+    order = np.lexsort((b, a))
+    
+    return a[order], b[order]
+
+def school_level(ages) -> np.ndarray:
+    """
+    Looks up the school level of each age, the school purpose code in SCHOOL_PURPOSE_AGE listing that age.
+    Same as looping through SCHOOL_PURPOSE_AGE and taking the first purpose that lists the age.
+
+    Args:
+        ages (array-like): The age codes
+
+    Returns:
+        np.ndarray: The school purpose code of each age, or NaN if no purpose lists the age
+    """
+    
+    assert isinstance(settings.SCHOOL_PURPOSE_AGE, dict), 'SCHOOL_PURPOSE_AGE must be a dictionary'
+    
+    ages = pd.Series(np.asarray(ages))
+    levels = pd.Series(np.nan, index=ages.index)
+    
+    # Reverse order, so the first purpose listing an age wins
+    for purpose, purpose_ages in reversed(settings.SCHOOL_PURPOSE_AGE.items()):
+        assert isinstance(purpose_ages, list), 'Ages must be a list'
+        levels[ages.isin(purpose_ages)] = purpose
+    
+    return levels.to_numpy()
+
+def binned_kde(samples: np.ndarray, span: np.ndarray) -> np.ndarray:
+    """
+    Gaussian kernel density of integer samples (e.g., seconds) evaluated on an integer span, 
+    using Scott's rule bandwidth like scipy.stats.gaussian_kde.
+    
+    Integer samples are binned exactly on a unit grid, so the density is a single FFT convolution of the bin counts 
+    with the Gaussian kernel, O(grid log grid), instead of evaluating every sample at every point, O(samples x grid).
+    The kernel is truncated at 10 bandwidths, which is negligible.
+
+    Args:
+        samples (np.ndarray): The integer samples, at least 2 distinct values
+        span (np.ndarray): The integer points to evaluate the density at
+
+    Returns:
+        np.ndarray: The density at each point of the span
+    """
+    
+    samples = np.asarray(samples, dtype=np.int64)
+    span = np.asarray(span, dtype=np.int64)
+    
+    bandwidth = samples.std(ddof=1) * samples.size ** (-1 / 5)
+    assert np.isfinite(bandwidth) and bandwidth > 0, 'KDE requires at least 2 distinct samples'
+    
+    # Bin counts on a unit grid covering the samples and the span
+    lo = min(samples.min(), span.min(initial=samples.min()))
+    hi = max(samples.max(), span.max(initial=samples.max()))
+    counts = np.bincount(samples - lo, minlength=hi - lo + 1).astype(float)
+    
+    # Gaussian kernel on the unit grid, centered on the middle element
+    radius = int(min(np.ceil(10 * bandwidth), hi - lo))
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (bandwidth * np.sqrt(2 * np.pi))
+    
+    density = fftconvolve(counts, kernel, mode='same') / samples.size
+    
+    # Clip floating point noise of the FFT
+    return np.clip(density[span - lo], 0, None)
+
+def get_dep_arr_dist(trips_df: pd.DataFrame, persons_df: pd.DataFrame, method: str, level: int|None = None) -> dict:
         """
         Aggregates trip times to the specified time increment.
 
         Args:
             trips_df (pd.DataFrame): The trips table.
+            persons_df (pd.DataFrame): The persons table, to determine the school level of each trip by age.
             method (str): The method to use for aggregating times.
                 Either 'bin' or 'kde' where:
                     'bin' is a discrete binning of time on specified time increment, and
-                    'kde' is a Gaussian kernel density estimation of times in seconds.
+                    'kde' is a binned FFT Gaussian kernel density estimation of times in seconds.
+            level (int|None, optional): Only use the school trips of this school level, see school_level. 
+                Defaults to None, which uses all school trips.
 
         Returns:
             pd.DataFrame: The trips table with aggregated times.
@@ -102,8 +324,10 @@ def get_dep_arr_dist(trips_df: pd.DataFrame, persons_df: pd.DataFrame, method: s
         # Extract school trips
         school_trips = trips_df[trips_df[SCHOOL_PURPOSES_COL].isin(SCHOOL_PURPOSES_CODES)]
         
-        # Join the person type to determine school level
-        # TODO
+        # Join the person age to determine school level
+        if level is not None:
+            ages = persons_df[AGE_COL].reindex(school_trips[PER_ID_NAME]).to_numpy()
+            school_trips = school_trips[school_level(ages) == level]
                
         
         # Convert to datetime in correct time zone
@@ -143,8 +367,8 @@ def get_dep_arr_dist(trips_df: pd.DataFrame, persons_df: pd.DataFrame, method: s
             # 60 * 60 * 24 = 86400 seconds in a day
             time_span = np.arange(start=1, stop=60*60*24, step=1)
             dur_span = np.arange(start=1, stop=dur_seconds.max(), step=1)
-            dep_dens = gaussian_kde(dep_seconds).evaluate(time_span)
-            dur_dens = gaussian_kde(dur_seconds).evaluate(dur_span)
+            dep_dens = binned_kde(dep_seconds.to_numpy(), time_span)
+            dur_dens = binned_kde(dur_seconds.to_numpy(), dur_span)
         
             # import matplotlib.pyplot as plt
             # plt.plot(dep_dens)
@@ -0,0 +1,102 @@
+"""
+Household member participation in trips, derived from the hh_member_# columns of the trips table.
+
+A hh_member_# value of 1 means the household member took part in the trip, any other value (0, 995, missing) means
+they did not. The participation is held as a sparse CSR matrix of trips x members, so only the participating
+member-trips are materialized instead of every trip x member slot.
+
+The sparse matrix is used by the non-proxy joint trip member table. The time-space buffer only shares the column
+lookups (member_columns and member_positions) and reads the dense hh_member_# values, because it must tell a
+reported 0 (unreported, corrected to 1) apart from 995 (not asked), which the 1-only matrix does not keep,
+and it rewrites the columns in place.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+import settings
+
+# Constants
+assert isinstance(settings.COLUMN_NAMES, dict), 'COLUMN_NAMES not a dict'
+HHMEMBER_PREFIX = settings.COLUMN_NAMES['HHMEMBER']
+assert isinstance(HHMEMBER_PREFIX, str), 'HHMEMBER_PREFIX not a string'
+
+
+def member_columns(trips_df: pd.DataFrame) -> pd.Index:
+    """
+    Returns the hh_member_# columns of the trips table.
+
+    Args:
+        trips_df (pd.DataFrame): Trips dataframe
+
+    Returns:
+        pd.Index: The hh_member_# column names
+    """
+
+    return trips_df.filter(regex=HHMEMBER_PREFIX).columns
+
+def member_positions(member_cols: pd.Index, person_nums: np.ndarray) -> np.ndarray:
+    """
+    Looks up the hh_member_# column position of each person number.
+
+    Args:
+        member_cols (pd.Index): The hh_member_# column names
+        person_nums (np.ndarray): The person numbers
+
+    Returns:
+        np.ndarray: The column position for each person number
+    """
+
+    member_nums = member_cols.str.replace(HHMEMBER_PREFIX, '').astype(int).to_numpy()
+
+    col_lookup = np.full(member_nums.max(initial=0) + 1, -1)
+    col_lookup[member_nums] = np.arange(member_nums.size)
+
+    person_nums = np.asarray(person_nums)
+    assert person_nums.max(initial=0) < col_lookup.size, f'Person number missing from {HHMEMBER_PREFIX} columns'
+    positions = col_lookup[person_nums]
+    assert (positions >= 0).all(), f'Person number missing from {HHMEMBER_PREFIX} columns'
+
+    return positions
+
+
+class MemberParticipation:
+    """
+    Sparse trips x members participation matrix, built once from the hh_member_# columns.
+    Rows are in trips table order and columns in hh_member_# column order.
+    """
+
+    def __init__(self, trips_df: pd.DataFrame) -> None:
+        self.member_cols = member_columns(trips_df)
+        self.member_nums = self.member_cols.str.replace(HHMEMBER_PREFIX, '').astype(int).to_numpy()
+
+        # Build column by column, so only the participating cells are materialized
+        rows, cols = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for col_idx, col in enumerate(self.member_cols):
+            trip_rows = np.flatnonzero(trips_df[col].to_numpy() == 1)
+            rows.append(trip_rows)
+            cols.append(np.full(trip_rows.size, col_idx))
+
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        shape = (trips_df.shape[0], self.member_cols.size)
+        self.matrix = csr_matrix((np.ones(rows.size, dtype=bool), (rows, cols)), shape=shape)
+        self.matrix.sort_indices()
+
+    def member_counts(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The number of participating household members on each trip
+        """
+        return np.diff(self.matrix.indptr)
+
+    def edges(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the member-trip edge list, one entry per participating member on each trip, in trip then member order.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The trip row position and the member person number of each edge
+        """
+        trip_rows = np.repeat(np.arange(self.matrix.shape[0]), self.member_counts())
+
+        return trip_rows, self.member_nums[self.matrix.indices]
@@ -0,0 +1,103 @@
+import pandas as pd
+import settings
+
+# Extract column names
+assert isinstance(settings.COLUMN_NAMES, dict), 'COLUMN_NAMES not a dict'
+
+COLNAMES = settings.COLUMN_NAMES
+PER_ID_NAME = COLNAMES['PER_ID']
+TRAVELDATE_COL = COLNAMES['TRAVELDATE']
+
+
+def pick(how: str, a, b):
+    """
+    Returns the earlier or later of two dates, ignoring missing dates.
+
+    Args:
+        how (str): Either 'min' or 'max'
+        a: The first date, or None/NaN/NaT
+        b: The second date, or None/NaN/NaT
+
+    Returns:
+        The min or max date, or a missing value if both are missing
+    """
+    if a is None or pd.isna(a):
+        return b
+    if b is None or pd.isna(b):
+        return a
+
+    return min(a, b) if how == 'min' else max(a, b)
+
+
+class TravelDateIndex:
+    """
+    This travel date index class is intended to be a global helper class, similar to the trip counter,
+    to keep track of the first and last travel date of each person's trips.
+
+    It is built once per step from the trips table and updated as trips are imputed,
+    so the first/last date of a person is a dict lookup instead of a scan of the trips table.
+    """
+
+    def __init__(self, trips_df: pd.DataFrame|None = None) -> None:
+        self.first = {}
+        self.last = {}
+
+        if trips_df is not None:
+            self.initialize(trips_df)
+
+    def initialize(self, trips_df: pd.DataFrame) -> None:
+        """
+        Initialize the first and last travel date of each person from the trips table.
+        Can be used to reset the index if needed.
+
+        Args:
+            trips_df (pd.DataFrame): The trips table
+        """
+        assert isinstance(trips_df, pd.DataFrame), 'trips_df must be a DataFrame'
+
+        dates = trips_df.reset_index()[[PER_ID_NAME, TRAVELDATE_COL]].dropna()
+        extents = dates.groupby(PER_ID_NAME)[TRAVELDATE_COL].agg(['min', 'max'])
+
+        self.first = extents['min'].to_dict()
+        self.last = extents['max'].to_dict()
+
+        return
+
+    def update(self, person_ids, dates) -> None:
+        """
+        Extends the first and last travel date of each person with the dates of newly imputed trips.
+
+        Args:
+            person_ids (array-like): The person id of each new trip
+            dates (array-like): The travel date of each new trip
+        """
+
+        for person_id, date in zip(person_ids, dates):
+            self.first[person_id] = pick('min', self.first.get(person_id), date)
+            self.last[person_id] = pick('max', self.last.get(person_id), date)
+
+        return
+
+    def lookup(self, how: str, person_ids, dates=None) -> list:
+        """
+        Returns the first or last travel date of each person, also including the given date for each entry, if any.
+
+        Args:
+            how (str): Either 'min' for the first date or 'max' for the last date
+            person_ids (array-like): The person ids
+            dates (array-like, optional): An additional date for each entry, e.g., the host trip date. Defaults to None.
+
+        Returns:
+            list: The first or last date for each entry
+        """
+
+        assert how in ['min', 'max'], 'how must be either "min" or "max"'
+        extremes = self.first if how == 'min' else self.last
+
+        if dates is None:
+            return [extremes.get(person_id) for person_id in person_ids]
+
+        return [pick(how, extremes.get(person_id), date) for person_id, date in zip(person_ids, dates)]
+
+# Initialize the global travel date index object
+TRAVEL_DATES = TravelDateIndex()
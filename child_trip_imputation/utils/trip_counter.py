@@ -1,7 +1,7 @@
 import pandas as pd
 import numpy as np
 import settings
-from utils.misc import cat_joint_trip_id, cat_trip_id
+from utils.misc import cat_ids
 
 # Extract column names for origin and destination lat/lon
 assert isinstance(settings.COLUMN_NAMES, dict), 'COLUMN_NAMES not a dict'
@@ -14,110 +14,224 @@ TRIPNUM_COL = COLNAMES['TRIPNUM']
 JOINT_TRIP_ID_NAME = COLNAMES['JOINT_TRIP_ID']
 JOINT_TRIPNUM_COL = COLNAMES['JOINT_TRIPNUM']
 
+# Counter names and their (counter index, id column, number column, id digit length, number zero-padding)
+COUNTERS = {
+    'trip': (PER_ID_NAME, TRIP_ID_NAME, TRIPNUM_COL, 10, 3),
+    'joint_trip': (HH_ID_NAME, JOINT_TRIP_ID_NAME, JOINT_TRIPNUM_COL, 8, 2)
+    }
+
+# Marks a missing number or id, e.g., 995 or NaN in the trips table
+MISSING = -1
+
 
 class TripCounter:
     """
-    This trip counter class is intended to be a global helper class to keep track 
-    of the latest trip number and trip ID for each person.
+    This trip counter class is intended to be a global helper class to keep track
+    of the latest trip number and trip ID for each person, and joint trip number and joint trip ID for each household.
+
+    The counters are held in NumPy arrays, with a dict from person/household id to array position,
+    so blocks of trip numbers and ids can be allocated for many persons or households at once.
     """
-    
-    def __init__(self, trips_df: pd.DataFrame|None = None, person_df: pd.DataFrame|None = None) -> None:        
-        if trips_df:
+
+    def __init__(self, trips_df: pd.DataFrame|None = None, person_df: pd.DataFrame|None = None) -> None:
+        self.positions = {name: {} for name in COUNTERS}
+        self.nums = {name: np.empty(0, dtype=np.int64) for name in COUNTERS}
+        self.ids = {name: np.empty(0, dtype=np.int64) for name in COUNTERS}
+
+        if trips_df is not None:
             self.initialize(trips_df, person_df)
-    
+
     def initialize(self, trips_df: pd.DataFrame, person_df: pd.DataFrame|None = None) -> None:
         """
-        Initialize the trip counter and joint trip counter DataFrames.
+        Initialize the trip counter and joint trip counter arrays.
         Can be used to reset the trip counter if needed.
 
         Args:
             trips_df (pd.DataFrame): The trips table
-            
-        Rturns: None but sets the trip_counter and joint_trip_counter attributes to the class object.
+            person_df (pd.DataFrame|None, optional): Optionally pre-insert persons and households with 0 trips
+
+        Returns: None but sets the counter arrays to the class object.
+        """
+        assert isinstance(trips_df, pd.DataFrame), 'trips_df must be a DataFrame'
+
+        trips = trips_df.reset_index()
+
+        for name, (counter_index, id_col, num_col, _, width) in COUNTERS.items():
+            # Get the max trip number and trip ID for each person, or joint trip number and ID for each household
+            # Missing values are masked first, so e.g., the 995 of non-joint trips is never the max
+            counter_df = trips[[num_col, id_col]].apply(self.mask_missing).groupby(trips[counter_index]).max()
+
+            # Optionally pre-insert 0 trip number for persons with 0 trips and households with 0 joint trips
+            # If not, a person/household will be created when allocated.
+            if person_df is not None:
+                assert isinstance(person_df, pd.DataFrame), 'person_df must be a DataFrame'
+                keys = person_df.reset_index()[counter_index].unique()
+                counter_df = counter_df.reindex(counter_df.index.union(keys))
+
+                is_new = counter_df[num_col].isna() & counter_df[id_col].isna()
+                counter_df.loc[is_new, num_col] = 0
+                counter_df.loc[is_new, id_col] = cat_ids(counter_df.index[is_new], np.zeros(is_new.sum()), width)
+
+            self.positions[name] = dict(zip(counter_df.index, range(counter_df.shape[0])))
+            self.nums[name] = self.to_counter(counter_df[num_col])
+            self.ids[name] = self.to_counter(counter_df[id_col])
+
+        return
+
+    @staticmethod
+    def mask_missing(values: pd.Series) -> pd.Series:
+        """
+        Masks the missing trip numbers or ids, NaN, 995 and negative values, as NaN.
+
+        Args:
+            values (pd.Series): The trip numbers or ids
+
+        Returns:
+            pd.Series: The trip numbers or ids, NaN if missing
+        """
+
+        is_missing = values.isna() | (values == 995) | (values < 0)
+
+        return values.where(~is_missing)
+
+    @staticmethod
+    def to_counter(values: pd.Series) -> np.ndarray:
         """
-        assert isinstance(trips_df, pd.DataFrame), 'trips_df must be a DataFrame'        
-        
-        # Group by person id and household id
-        trip_grp = trips_df.reset_index().groupby([PER_ID_NAME])
-        joint_trip_grp = trips_df.reset_index().groupby([HH_ID_NAME])    
-        
-        # Get the max trip number and trip ID for each person
-        self.trip = trip_grp.aggregate({TRIPNUM_COL: 'max', TRIP_ID_NAME: 'max'})
-        self.joint_trip = joint_trip_grp.aggregate({JOINT_TRIPNUM_COL: 'max', JOINT_TRIP_ID_NAME: 'max'})
-        
-        # Optionally pre-insert 0 trip number for persons with 0 trips and households with 0 joint trips
-        # If not, a person/household will be created when iterated.
-        if person_df is not None:
-            assert isinstance(person_df, pd.DataFrame), 'person_df must be a DataFrame'
-            self.trip = self.trip.reindex(person_df.index, fill_value=0)
-            self.joint_trip = self.joint_trip.reindex(person_df.index, fill_value=0)        
-            
-            zero_trips = self.trip[self.trip.trip_id == 0].index.values
-            zero_jt = self.joint_trip[self.joint_trip.joint_trip_id == 0].index.values          
-            
-            self.trip.loc[zero_trips] = self.trip.loc[zero_trips].reset_index().apply(cat_trip_id, axis=1)
-            self.joint_trip.loc[zero_jt] = self.joint_trip.loc[zero_jt].reset_index().apply(cat_joint_trip_id, axis=1)
-        
-        return        
-    
-    def iterate_counter(self, counter_name: str, counter_id: int|str) -> int:        
+        Converts trip numbers or ids to a counter array, where NaN, 995 and negative values are missing.
+
+        Args:
+            values (pd.Series): The trip numbers or ids
+
+        Returns:
+            np.ndarray: The int64 counter array
+        """
+
+        return TripCounter.mask_missing(values).fillna(MISSING).astype(np.int64).to_numpy()
+
+    def lookup(self, counter_name: str, counter_ids: np.ndarray) -> np.ndarray:
+        """
+        Looks up the array position of each id, adding any new ids with missing numbers and ids.
+
+        Args:
+            counter_name (str): ['joint_trip', 'trip'] The name of the counter
+            counter_ids (np.ndarray): The household ids for the joint trip counter or the person ids for the trip counter
+
+        Returns:
+            np.ndarray: The array position of each id
+        """
+
+        positions = self.positions[counter_name]
+        n_before = len(positions)
+
+        # New ids are appended in order of first appearance
+        idx = np.fromiter((positions.setdefault(i, len(positions)) for i in counter_ids.tolist()), dtype=np.int64, count=counter_ids.size)
+
+        n_new = len(positions) - n_before
+        if n_new > 0:
+            self.nums[counter_name] = np.append(self.nums[counter_name], np.full(n_new, MISSING))
+            self.ids[counter_name] = np.append(self.ids[counter_name], np.full(n_new, MISSING))
+
+        return idx
+
+    def allocate(self, counter_name: str, counter_ids, counts=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Allocates a contiguous block of new numbers and ids for each entry, in entry order.
+        An id can appear more than once, each entry gets the next block for that id.
+
+        A person or household with no numbers starts at 1, and with no ids the first id is generated by
+        concatenating the person/household id and number (see cat_trip_id and cat_joint_trip_id).
+        Otherwise the numbers and ids continue from the current max.
+
+        Args:
+            counter_name (str): ['joint_trip', 'trip'] The name of the counter to allocate from
+            counter_ids (array-like): The household ids for the joint trip counter or the person ids for the trip counter
+            counts (array-like, optional): The block size for each entry. Defaults to None, which allocates 1 each.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The first new number and first new id of each block
+        """
+
+        assert counter_name in COUNTERS, f'counter_name must be one of {list(COUNTERS)}'
+        _, _, _, id_length, width = COUNTERS[counter_name]
+
+        counter_ids = np.asarray(counter_ids)
+        counts = np.ones(counter_ids.size, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        assert counts.shape == counter_ids.shape, 'counts must have one value per id'
+        assert (counts >= 0).all(), 'counts must not be negative'
+
+        id_lengths = {len(str(i)) for i in np.unique(counter_ids).tolist()}
+        assert id_lengths <= {id_length}, f'{counter_name} counter ids must be {id_length} digits, is this the wrong id?'
+
+        idx = self.lookup(counter_name, counter_ids)
+        nums, ids = self.nums[counter_name], self.ids[counter_name]
+
+        # The first new number and id of each id, before this allocation
+        base_nums = np.where(nums[idx] == MISSING, 1, nums[idx] + 1)
+        base_ids = np.where(ids[idx] == MISSING, cat_ids(counter_ids, base_nums, width), ids[idx] + 1)
+
+        # Offset of each block within the id, the counts of the earlier entries with the same id
+        order = np.argsort(idx, kind='stable')
+        ends = np.cumsum(counts[order])
+        is_first = np.r_[True, idx[order][1:] != idx[order][:-1]] if idx.size > 0 else np.zeros(0, dtype=bool)
+        group_starts = np.maximum.accumulate(np.where(is_first, ends - counts[order], 0)) if idx.size > 0 else ends
+
+        offsets = np.empty_like(counts)
+        offsets[order] = ends - counts[order] - group_starts
+
+        # Update the counters to the end of the last block of each id
+        totals = np.bincount(idx, weights=counts, minlength=nums.size).astype(np.int64)
+        is_allocated = totals > 0
+        last_nums, last_ids = np.zeros_like(nums), np.zeros_like(ids)
+        last_nums[idx] = base_nums + totals[idx] - 1
+        last_ids[idx] = base_ids + totals[idx] - 1
+
+        nums[is_allocated] = last_nums[is_allocated]
+        ids[is_allocated] = last_ids[is_allocated]
+
+        return base_nums + offsets, base_ids + offsets
+
+    def iterate_counter(self, counter_name: str, counter_id: int|str) -> int:
         """
         Find the current max trip number and iterate.
-        
+
         Args:
-            num_item (str): ['joint_trip', 'trip'] The name of the trip number column to iterate
-            item_id (int|str): The household id for the joint_trip_counter or the household member person id
+            counter_name (str): ['joint_trip', 'trip'] The name of the trip number column to iterate
+            counter_id (int|str): The household id for the joint_trip_counter or the household member person id
 
         Returns:
             int: The new trip number
         """
-        
-        assert counter_name in ['joint_trip', 'trip'], f'num_item must be one of {["joint_trip", "trip"]}'
-        
-        if counter_name == 'joint_trip':
-            assert len(str(counter_id)) == 8, 'joint trip household id must be 10 digits, is this the wrong id?'
-            id_method = cat_joint_trip_id
-        else:
-            assert len(str(counter_id)) == 10, 'trip person id must be 10 digits, is this the wrong id?'
-            id_method = cat_trip_id
-
-        # Dictionary of the column names
-        params = {
-            'trip': [TRIP_ID_NAME, TRIPNUM_COL],
-            'joint_trip': [JOINT_TRIP_ID_NAME, JOINT_TRIPNUM_COL]
-            }        
-        counter_index_name, counter_num_col = params[counter_name]
-                
-        # Retrieve the trip counter        
-        counter_df = getattr(self, counter_name)
-                
-        # Initialize the counter if it doesn't exist
-        if counter_id not in counter_df.index:
-            newindex = pd.Index([counter_id], name=counter_df.index.name)
-            newindex = counter_df.index.append(newindex)
-            counter_df = counter_df.reindex(newindex, fill_value=995)            
-            
-        # Iterate
-        counter_num_id, count = counter_df.loc[counter_id, [counter_index_name, counter_num_col]]
-        
-        # If count is NAN or 995, then it is a new trip and set to 1
-        count = 1 if (np.isnan(count) or count == 995 or count < 0) else count + 1
-        
-        # If counter_num_id is NAN or 995, then it is a new trip and needs to be generated
-        if (np.isnan(counter_num_id) or counter_num_id == 995 or counter_num_id < 0): 
-            row = pd.Series([counter_id, count], index=[counter_df.index.name, counter_num_col])
-            counter_num_id = id_method(row)
-        else:
-            counter_num_id += 1
-        
-        # Update the count
-        counter_df.loc[counter_id] = count, counter_num_id        
-                
-        # Return the new trip number
-        assert hasattr(self, counter_name), f'counter_name {counter_name} not an attribute of TripCounter'
-        setattr(self, counter_name, counter_df)
-                                  
-        return count
+
+        nums, _ = self.allocate(counter_name, [counter_id])
+
+        return int(nums[0])
+
+    def to_frame(self, counter_name: str) -> pd.DataFrame:
+        """
+        Exports a counter to a DataFrame, e.g., for caching. Missing numbers and ids are exported as 995.
+
+        Args:
+            counter_name (str): ['joint_trip', 'trip'] The name of the counter
+
+        Returns:
+            pd.DataFrame: The current max number and id, indexed by person or household id
+        """
+
+        assert counter_name in COUNTERS, f'counter_name must be one of {list(COUNTERS)}'
+        counter_index, id_col, num_col, _, _ = COUNTERS[counter_name]
+
+        index = pd.Index(list(self.positions[counter_name]), name=counter_index)
+        counter_df = pd.DataFrame({num_col: self.nums[counter_name], id_col: self.ids[counter_name]}, index=index)
+
+        return counter_df.replace(MISSING, 995)
+
+    @property
+    def trip(self) -> pd.DataFrame:
+        return self.to_frame('trip')
+
+    @property
+    def joint_trip(self) -> pd.DataFrame:
+        return self.to_frame('joint_trip')
 
 # Initialize the global trip counter object
-TRIP_COUNTER = TripCounter()
\ No newline at end of file
+TRIP_COUNTER = TripCounter()
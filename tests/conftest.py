@@ -0,0 +1,111 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules import each other from the package directory, and settings reads configs/ from the working directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'child_trip_imputation'))
+
+# Run from a scratch directory with the repository configs, so the cache and output folders stay out of the repository
+WORKDIR = tempfile.mkdtemp(prefix='child_trip_imputation_tests_')
+os.symlink(os.path.join(ROOT, 'configs'), os.path.join(WORKDIR, 'configs'))
+os.chdir(WORKDIR)
+atexit.register(shutil.rmtree, WORKDIR, ignore_errors=True)
+
+TZ = 'America/Los_Angeles'
+
+
+def make_trips(n_households: int = 40, n_members: int = 11, seed: int = 0) -> pd.DataFrame:
+    """
+    Builds a small synthetic trips table, where household members often share an outing a few minutes
+    and a few meters apart, so there are joint trips, unreported members and chains of joint trips.
+
+    Args:
+        n_households (int, optional): The number of households. Defaults to 40.
+        n_members (int, optional): The number of hh_member_# columns. Defaults to 11.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: The trips table, indexed by trip id
+    """
+
+    rng = np.random.default_rng(seed)
+    rows = []
+
+    for h in range(n_households):
+        hh_id = 23000000 + h
+        home_lat, home_lon = 32.7 + rng.random()*0.3, -117.2 + rng.random()*0.3
+        n_persons = int(rng.integers(1, 5))
+
+        for day_num in (1, 2):
+            date = pd.Timestamp('2022-05-01') + pd.Timedelta(days=day_num)
+            outings = [
+                (date + pd.Timedelta(seconds=int(rng.integers(6*3600, 20*3600))), int(rng.integers(300, 3000)),
+                 home_lat + rng.normal(0, 0.02), home_lon + rng.normal(0, 0.02),
+                 home_lat + rng.normal(0, 0.02), home_lon + rng.normal(0, 0.02), int(rng.integers(1, 3)))
+                for _ in range(3)
+                ]
+
+            for person_num in range(1, n_persons + 1):
+                person_id = hh_id*100 + person_num
+                for trip_num in range(1, int(rng.integers(1, 6)) + 1):
+                    depart, duration, olat, olon, dlat, dlon, mode = outings[int(rng.integers(0, 3))]
+                    depart = depart + pd.Timedelta(seconds=int(rng.integers(-420, 420)))
+                    olat, dlat = olat + rng.normal(0, 0.0005), dlat + rng.normal(0, 0.0005)
+
+                    row = {
+                        'trip_id': person_id*1000 + day_num*100 + trip_num,
+                        'person_id': person_id,
+                        'hh_id': hh_id,
+                        'day_num': day_num,
+                        'person_num': person_num,
+                        'trip_num': day_num*100 + trip_num,
+                        'depart_time': depart.tz_localize(TZ).tz_convert('UTC'),
+                        'arrive_time': (depart + pd.Timedelta(seconds=duration)).tz_localize(TZ).tz_convert('UTC'),
+                        'o_lat': olat, 'o_lon': olon, 'd_lat': dlat, 'd_lon': dlon,
+                        'mode_type': mode,
+                        'joint_trip_num': 995,
+                        'joint_trip_id': 995,
+                        }
+                    for m in range(1, n_members + 1):
+                        row[f'hh_member_{m}'] = (1 if m == person_num else int(rng.choice([0, 0, 1]))) if m <= n_persons else 995
+                    rows.append(row)
+
+    return pd.DataFrame(rows).set_index('trip_id')
+
+
+@pytest.fixture
+def trips_df() -> pd.DataFrame:
+    return make_trips()
+
+
+@pytest.fixture(scope='module')
+def joint_trip_tables() -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    The persons and flagged trips of the synthetic households, ready for impute_reported_joint_trips.
+    The trips get the day, travel date and driver columns of the survey data, drivers on the car trips (mode_type 2).
+    """
+
+    from nonproxy.impute import ImputeNonProxyTrips
+
+    trips_df = ImputeNonProxyTrips().flag_unreported_joint_trips(make_trips(), DISTANCE=250, TIME=15)
+    trips_df['day_id'] = trips_df['person_id'] * 100 + trips_df['day_num']
+    trips_df['travel_date'] = (pd.Timestamp('2022-05-01') + pd.to_timedelta(trips_df['day_num'], unit='D')).dt.date
+    trips_df['first_travel_date'] = trips_df.groupby('person_id')['travel_date'].transform('min')
+    trips_df['last_travel_date'] = trips_df.groupby('person_id')['travel_date'].transform('max')
+    trips_df['driver'] = np.where(trips_df['mode_type'] == 2, 1, 2)
+
+    # Every household member with a hh_member_# column, including those without trips of their own
+    n_persons = (trips_df.filter(like='hh_member_') != 995).sum(axis=1).groupby(trips_df['hh_id']).max()
+    persons_df = pd.DataFrame(
+        [(hh_id * 100 + person_num, hh_id, person_num) for hh_id, n in n_persons.items() for person_num in range(1, n + 1)],
+        columns=['person_id', 'hh_id', 'person_num'],
+        ).set_index('person_id')
+
+    return persons_df, trips_df
@@ -0,0 +1,54 @@
+import os
+import tempfile
+
+import pandas as pd
+import pytest
+
+import settings
+from utils.column_actions import compile_plan
+from school_trips.populator import SchoolTripPopulator
+
+
+@pytest.fixture
+def config(monkeypatch):
+    """
+    Writes a column actions table to the scratch directory and registers it in IMPUTATION_CONFIGS.
+    """
+
+    def write(methods: dict) -> str:
+        path = tempfile.mkstemp(prefix='column_actions_', suffix='.csv', dir=os.getcwd())[1]
+        pd.DataFrame({'colname': list(methods), 'method': list(methods.values())}).to_csv(path, index=False)
+
+        name = os.path.basename(path)
+        monkeypatch.setitem(settings.IMPUTATION_CONFIGS, name, path)
+
+        return name
+
+    return write
+
+
+def test_plan_compiles_actions(config):
+    name = config({'trip_num': 'update_trip_num', 'home_lat': 'copy_from_household:home_lat', 'home_lon': 'copy_from_household:home_lon', 'leg_num': 'np.nan'})
+
+    plan = compile_plan(name, 'method', SchoolTripPopulator)
+
+    assert [(action.method, action.from_field, action.fields) for action in plan if not action.is_constant] == [
+        ('update_trip_num', None, ['trip_num']),
+        ('copy_from_household', 'home_lat', ['home_lat']),
+        ('copy_from_household', 'home_lon', ['home_lon']),
+        ]
+    assert plan[-1].is_constant and plan[-1].fields == ['leg_num']
+
+
+@pytest.mark.parametrize('method', [
+    'update_trip_number',               # Unknown method
+    'copy_from_school:home_lat',        # Unknown copy_from_x table
+    'copy_from_household:',             # Missing from_field
+    'copy_from_household:home lat',     # Not a column name
+    'int(',                             # Invalid expression
+    ])
+def test_malformed_config_fails_to_compile(config, method):
+    name = config({'trip_num': 'update_trip_num', 'home_lat': method})
+
+    with pytest.raises((AssertionError, ValueError)):
+        compile_plan(name, 'method', SchoolTripPopulator)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import settings
+from utils.distance import MARGIN, equirectangular, haversine, within_distance
+
+# The documented range where the equirectangular prefilter is exact, see utils.distance
+MAX_LAT = 85
+MAX_DIST = 50000
+
+
+def random_pairs(rng: np.random.Generator, lat_range: tuple, lon_range: tuple, dist: np.ndarray) -> tuple:
+    """
+    Random lat/lon pairs in radians, the second point at a random bearing and the given distance in meters from the first.
+    """
+
+    n = dist.size
+    lat = np.radians(rng.uniform(*lat_range, n))
+    lon = np.radians(rng.uniform(*lon_range, n))
+    bearing = rng.uniform(0, 2 * np.pi, n)
+    dist = dist / settings.R
+
+    lat_b = np.arcsin(np.sin(lat) * np.cos(dist) + np.cos(lat) * np.sin(dist) * np.cos(bearing))
+    lon_b = lon + np.arctan2(np.sin(bearing) * np.sin(dist) * np.cos(lat), np.cos(dist) - np.sin(lat) * np.sin(lat_b))
+
+    # Wrap longitudes into [-pi, pi), so pairs across the antimeridian have opposite signs
+    lon_b = (lon_b + np.pi) % (2 * np.pi) - np.pi
+
+    return np.stack([lat, lon], axis=-1), np.stack([lat_b, lon_b], axis=-1)
+
+
+RANGES = [
+    ((-60, 60), (-180, 180)),                # Mid latitudes
+    ((60, MAX_LAT), (-180, 180)),            # High latitudes
+    ((-MAX_LAT, -60), (-180, 180)),
+    ((-MAX_LAT, MAX_LAT), (179.5, 180)),     # Across the antimeridian
+    ]
+
+
+@pytest.mark.parametrize('lat_range, lon_range', RANGES)
+def test_equirectangular_error_is_within_margin(lat_range, lon_range):
+    rng = np.random.default_rng(0)
+    latlons_a, latlons_b = random_pairs(rng, lat_range, lon_range, rng.uniform(1, MAX_DIST, 100000))
+    dist = haversine(latlons_a, latlons_b) * settings.R
+
+    assert np.abs(equirectangular(latlons_a, latlons_b) / dist - 1).max() < MARGIN
+
+
+@pytest.mark.parametrize('lat_range, lon_range', RANGES)
+@pytest.mark.parametrize('threshold', [250, 10000, MAX_DIST])
+def test_within_distance_matches_haversine_near_threshold(lat_range, lon_range, threshold):
+    rng = np.random.default_rng(1)
+
+    # Pairs on both sides of the margin, on the margin and a hair either side of the threshold
+    scales = np.concatenate([rng.uniform(1 - 2 * MARGIN, 1 + 2 * MARGIN, 100000), [1 - MARGIN, 1 + MARGIN, 1 - 1e-9, 1 + 1e-9]])
+    latlons_a, latlons_b = random_pairs(rng, lat_range, lon_range, threshold * scales)
+    dist = haversine(latlons_a, latlons_b) * settings.R
+
+    assert (within_distance(latlons_a, latlons_b, threshold) == (dist < threshold)).all()
+
+    # Broadcast pairwise, as the joint trip buffer uses it
+    is_within = within_distance(latlons_a[:200, np.newaxis], latlons_b[np.newaxis, :200], threshold)
+    dist = haversine(latlons_a[:200, np.newaxis], latlons_b[np.newaxis, :200]) * settings.R
+    assert (is_within == (dist < threshold)).all()
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from utils.io import DBIO
+from utils.group_index import GroupIndex
+
+
+def household_trips() -> pd.DataFrame:
+    # Not sorted by household and day, with a missing day number
+    return pd.DataFrame({
+        'hh_id': [2, 1, 2, 1, 2, 1, 3],
+        'day_num': [1, 2, 1, 1, 2, 2, np.nan],
+        }, index=pd.Index([21, 12, 22, 11, 23, 13, 31], name='trip_id'))
+
+
+def test_bounds_and_positions_match_a_scan():
+    trips_df = household_trips()
+    groups = GroupIndex(trips_df, ['hh_id', 'day_num'])
+
+    hh_ids, day_nums = np.array([1, 2, 2, 4, 1]), np.array([2, 1, 2, 1, 1])
+    lookups, rows = groups.positions(*groups.bounds(hh_ids, day_nums))
+
+    # Each key value's rows, in table order, same as a boolean scan of the table
+    for i, (hh_id, day_num) in enumerate(zip(hh_ids, day_nums)):
+        is_group = (trips_df['hh_id'] == hh_id) & (trips_df['day_num'] == day_num)
+        assert rows[lookups == i].tolist() == np.flatnonzero(is_group).tolist()
+        assert trips_df.index[groups.rows((hh_id, day_num))].tolist() == trips_df.index[is_group].tolist()
+
+    # Slices of a sorted column are the same rows
+    starts, stops = groups.bounds(hh_ids, day_nums)
+    sorted_ids = groups.sorted(trips_df.index.to_numpy())
+    assert sorted_ids[starts[1]:stops[1]].tolist() == [21, 22]
+
+
+def test_group_index_is_rebuilt_for_a_new_table():
+    trips_df = household_trips()
+
+    groups = DBIO.get_group_index('trip', ['hh_id'], trips_df)
+    assert DBIO.get_group_index('trip', ['hh_id'], trips_df) is groups
+
+    # A replaced table, e.g., after update_table, is indexed again
+    new_trips_df = trips_df.iloc[::-1]
+    new_groups = DBIO.get_group_index('trip', ['hh_id'], new_trips_df)
+    assert new_groups is not groups
+    assert new_trips_df.index[new_groups.rows(1)].tolist() == [13, 11, 12]
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.id_registry import IdRegistry
+
+
+def registry() -> IdRegistry:
+    trips_df = pd.DataFrame(
+        {'joint_trip_id': [2300000801, 995, np.nan]},
+        index=pd.Index([2300000801001, 2300000801002, 2300000802001], name='trip_id')
+        )
+
+    return IdRegistry(trips_df)
+
+
+def test_register_keeps_ids_sorted():
+    ids = registry()
+
+    ids.register('trip', [2300000802002, 2300000801003, 2300000700001])
+    ids.register('joint_trip', [2300000802])
+
+    assert ids.ids['trip'].tolist() == [2300000700001, 2300000801001, 2300000801002, 2300000801003, 2300000802001, 2300000802002]
+    assert ids.ids['joint_trip'].tolist() == [2300000801, 2300000802]
+
+
+def test_register_reports_all_collisions():
+    ids = registry()
+
+    with pytest.raises(AssertionError, match=r'2 new trip id collisions.*\[2300000801002\].*\[2300000801003\]'):
+        ids.register('trip', [2300000801003, 2300000801002, 2300000801003])
+
+    # A failed batch is not registered
+    assert ids.ids['trip'].size == 3
@@ -0,0 +1,78 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import gaussian_kde
+
+from utils.misc import binned_kde, connected_components, compact_labels
+from nonproxy.timespace_buffer import fix_existing_joint_trips
+
+
+def test_chain_is_one_component():
+    # A-B and B-C are edges, A-C is not
+    labels = connected_components(np.array([0, 1]), np.array([1, 2]), 4)
+
+    assert labels[0] == labels[1] == labels[2]
+    assert labels[3] == -1
+
+
+def test_compact_labels_restart_per_group():
+    labels = np.array([7, 7, -1, 3, 3, 9, 11, 5, 5])
+    group_ids = np.array([0, 0, 0, 0, 0, 0, 1, 1, 1])
+
+    assert compact_labels(labels, group_ids).tolist() == [1, 1, -1, 2, 2, 3, 1, 2, 2]
+
+
+def chained_trips() -> pd.DataFrame:
+    """
+    Two households of three persons. In each household-day person 1 departs 10 minutes before person 2,
+    who departs 10 minutes before person 3, so with a 15 minute buffer only the neighbors pair directly.
+    """
+
+    rows = []
+    for hh_id, days in ((23000001, (1, 2)), (23000002, (1,))):
+        for day_num in days:
+            t0 = pd.Timestamp('2022-05-01 15:00', tz='UTC') + pd.Timedelta(days=day_num)
+            for person_num in (1, 2, 3):
+                depart = t0 + timedelta(minutes=10*(person_num - 1))
+                row = {
+                    'trip_id': (hh_id*100 + person_num)*1000 + day_num,
+                    'person_id': hh_id*100 + person_num,
+                    'hh_id': hh_id,
+                    'day_num': day_num,
+                    'person_num': person_num,
+                    'depart_time': depart,
+                    'arrive_time': depart + timedelta(minutes=30),
+                    'o_lat': 32.8, 'o_lon': -117.1, 'd_lat': 32.81, 'd_lon': -117.1,
+                    'mode_type': 1,
+                    'joint_trip_num': 995,
+                    }
+                row.update({f'hh_member_{m}': int(m == person_num) for m in (1, 2, 3)})
+                rows.append(row)
+
+    return pd.DataFrame(rows).set_index('trip_id')
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_joint_trip_chain_numbering(batched):
+    fixed = fix_existing_joint_trips(chained_trips(), 250, timedelta(minutes=15), batched=batched)
+
+    # Each chain is one joint trip, numbered per household across its days
+    nums = fixed.groupby(['hh_id', 'day_num'])['joint_trip_num'].agg(lambda x: sorted(set(x)))
+    assert nums.to_dict() == {(23000001, 1): [1], (23000001, 2): [2], (23000002, 1): [1]}
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_binned_kde_matches_gaussian_kde(seed):
+    rng = np.random.default_rng(seed)
+
+    # Integer seconds, a morning and an afternoon peak of depart times, and a few uniform durations
+    departs = np.r_[rng.normal(8*3600, 1800, 300), rng.normal(15*3600, 900, 200)].round().astype(np.int64)
+    durations = rng.integers(300, 3600, 40)
+
+    for samples in (departs, durations):
+        span = np.arange(samples.min() - 3600, samples.max() + 3600, 7)
+        expected = gaussian_kde(samples)(span)
+
+        np.testing.assert_allclose(binned_kde(samples, span), expected, rtol=0, atol=1e-12 * expected.max())
@@ -0,0 +1,186 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import settings
+import nonproxy.impute
+from utils.io import IO
+from utils.trip_counter import TRIP_COUNTER
+from utils.travel_dates import TRAVEL_DATES
+from utils.id_registry import ID_REGISTRY
+from nonproxy.impute import ImputeNonProxyTrips, FINGERPRINT_FILE
+from nonproxy.populator import NonProxyTripPopulator
+
+BUFFER = {'DISTANCE': 250, 'TIME': 15}
+STEP = 'flag_unreported_joint_trips'
+
+
+@pytest.fixture
+def imputer(monkeypatch):
+    # A fresh cache in the scratch working directory, with its own log
+    monkeypatch.setattr(settings, 'CACHE_DIR', tempfile.mkdtemp(prefix='cache_', dir=os.getcwd()))
+    monkeypatch.setattr(nonproxy.impute, 'DBIO', IO())
+
+    imputer = ImputeNonProxyTrips()
+
+    # Record the households that are flagged, rather than spliced in from the cache
+    imputer.flagged_hh_ids = []
+    flag = imputer.flag_unreported_joint_trips
+
+    def spy(trips_df, **kwargs):
+        imputer.flagged_hh_ids.append(set(trips_df['hh_id']))
+        return flag(trips_df, **kwargs)
+
+    monkeypatch.setattr(imputer, 'flag_unreported_joint_trips', spy)
+
+    return imputer
+
+
+def run_incremental(imputer: ImputeNonProxyTrips, trips_df: pd.DataFrame, **kwargs) -> tuple[pd.DataFrame, bool]:
+    """
+    Same as the INCREMENTAL branch of impute_proxy_trips, the fingerprints are only stored after the flagged trips.
+    """
+
+    imputer.flagged_hh_ids.clear()
+    flagged_trips_df, fingerprints, refreshed = imputer.flag_unreported_joint_trips_incremental(trips_df.copy(), **kwargs)
+
+    nonproxy.impute.DBIO.update_table('trip', flagged_trips_df, step_name=STEP)
+    imputer.save_fingerprints(fingerprints)
+
+    return flagged_trips_df, refreshed
+
+
+def expected(trips_df: pd.DataFrame, **kwargs) -> pd.DataFrame:
+    return ImputeNonProxyTrips().flag_unreported_joint_trips(trips_df.copy(), **kwargs)
+
+
+def test_incremental_matches_full_flagging(imputer, trips_df):
+    hh_ids = set(trips_df['hh_id'])
+
+    # Without a cache every household is flagged
+    flagged, refreshed = run_incremental(imputer, trips_df, **BUFFER)
+    assert refreshed and imputer.flagged_hh_ids == [hh_ids]
+    pd.testing.assert_frame_equal(flagged, expected(trips_df, **BUFFER))
+
+    # Nothing changed, everything is spliced in from the cache
+    flagged, refreshed = run_incremental(imputer, trips_df, **BUFFER)
+    assert not refreshed and imputer.flagged_hh_ids == []
+    pd.testing.assert_frame_equal(flagged, expected(trips_df, **BUFFER))
+
+    # A moved trip only re-flags its own household
+    changed_df = trips_df.copy()
+    trip_id = changed_df.index[changed_df['hh_id'] == 23000005][0]
+    changed_df.loc[trip_id, 'd_lat'] += 0.1
+
+    flagged, refreshed = run_incremental(imputer, changed_df, **BUFFER)
+    assert refreshed and imputer.flagged_hh_ids == [{23000005}]
+    pd.testing.assert_frame_equal(flagged, expected(changed_df, **BUFFER))
+
+    # A different threshold changes every fingerprint
+    wider = {**BUFFER, 'DISTANCE': 500}
+    flagged, refreshed = run_incremental(imputer, changed_df, **wider)
+    assert refreshed and imputer.flagged_hh_ids == [hh_ids]
+    pd.testing.assert_frame_equal(flagged, expected(changed_df, **wider))
+
+    # A missing cached table cannot be spliced from, so every household is flagged again
+    os.remove(nonproxy.impute.DBIO.cache_log.loc[STEP, 'cached_table'])
+    flagged, refreshed = run_incremental(imputer, changed_df, **wider)
+    assert refreshed and imputer.flagged_hh_ids == [hh_ids]
+    pd.testing.assert_frame_equal(flagged, expected(changed_df, **wider))
+
+
+def test_fingerprints_are_stored_after_the_flagged_trips(imputer, trips_df):
+    # A run that stops before update_table leaves no fingerprints, so the next run flags every household
+    imputer.flag_unreported_joint_trips_incremental(trips_df.copy(), **BUFFER)
+    assert not os.path.isfile(os.path.join(settings.CACHE_DIR, FINGERPRINT_FILE))
+
+    _, refreshed = run_incremental(imputer, trips_df, **BUFFER)
+    assert refreshed and imputer.flagged_hh_ids == [set(trips_df['hh_id'])]
+
+
+
+def baseline_numbering(trips_df: pd.DataFrame, members: pd.DataFrame) -> pd.DataFrame:
+    """
+    The numbering of the original per-trip loop. Each host trip, in trip id order, takes the next joint trip number
+    of its household, and each of its members in turn the next trip number and trip id of that member.
+    """
+
+    is_flagged = trips_df['joint_trip_num'] != 995
+    joint_trip_nums = trips_df.loc[is_flagged].groupby('hh_id')['joint_trip_num'].max().to_dict()
+    trip_nums = trips_df.groupby('person_id')['trip_num'].max().to_dict()
+    trip_ids = trips_df.reset_index().groupby('person_id')['trip_id'].max().to_dict()
+
+    rows = []
+    for host_trip_id, host_members in members.groupby('trip_id', sort=True):
+        hh_id = trips_df.loc[host_trip_id, 'hh_id']
+        joint_trip_nums[hh_id] = joint_trip_nums.get(hh_id, 0) + 1
+
+        for member_id in host_members['hh_member_id']:
+            trip_nums[member_id] = trip_nums.get(member_id, 0) + 1
+            trip_ids[member_id] = trip_ids[member_id] + 1 if member_id in trip_ids else int(f'{member_id}{trip_nums[member_id]:03d}')
+            joint_trip_id = int(f'{hh_id}{joint_trip_nums[hh_id]:02d}')
+            rows.append((trip_ids[member_id], member_id, trip_nums[member_id], joint_trip_nums[hh_id], joint_trip_id))
+
+    columns = ['trip_id', 'person_id', 'trip_num', 'joint_trip_num', 'joint_trip_id']
+
+    return pd.DataFrame(rows, columns=columns).set_index('trip_id')
+
+
+def test_imputed_joint_trips_keep_the_baseline_numbering(joint_trip_tables):
+    persons_df, trips_df = joint_trip_tables
+    imputer = ImputeNonProxyTrips()
+
+    # The reported members without a trip of their own, same as impute_reported_joint_trips
+    joint_trips, _ = imputer.joint_trip_member_table(persons_df, trips_df)
+    members = joint_trips[joint_trips['joint_trip_num'] == 995]
+
+    combined_trips_df = imputer.impute_reported_joint_trips(persons_df, trips_df.copy())
+    new_trips_df = combined_trips_df[combined_trips_df['imputed_joint_trip'] == 1]
+
+    expected_df = baseline_numbering(trips_df, members)
+    # Members with several new trips, and households continuing after their flagged joint trips
+    assert expected_df['person_id'].nunique() < expected_df.shape[0]
+    assert (expected_df['joint_trip_num'] > 1).any()
+
+    # Same trips, numbers and ids, in the same order
+    pd.testing.assert_frame_equal(new_trips_df[expected_df.columns], expected_df, check_dtype=False)
+    assert combined_trips_df.index.is_unique
+
+
+def test_populate_copies_host_and_member_columns(joint_trip_tables):
+    persons_df, trips_df = joint_trip_tables
+
+    TRIP_COUNTER.initialize(trips_df)
+    TRAVEL_DATES.initialize(trips_df)
+    ID_REGISTRY.initialize(trips_df)
+
+    # A driving host trip and one that switched drivers, of two person households, each with the other member
+    two_person_hh_ids = persons_df.groupby('hh_id').size().loc[lambda n: n == 2].index
+    hh_trips_df = trips_df[trips_df['hh_id'].isin(two_person_hh_ids)]
+    host_trips = pd.concat([hh_trips_df[hh_trips_df['driver'] == driver].iloc[:1] for driver in [1, 2]])
+    host_trips.loc[host_trips.index[1], 'driver'] = 3
+    host_trips[['joint_trip_num', 'joint_trip_id']] = np.stack(TRIP_COUNTER.allocate('joint_trip', host_trips['hh_id'].to_numpy()), axis=1)
+
+    members = pd.DataFrame({
+        'trip_id': host_trips.index,
+        'hh_member_num': 3 - host_trips['person_num'].to_numpy(),
+        })
+    members['hh_member_id'] = host_trips['hh_id'].to_numpy() * 100 + members['hh_member_num']
+
+    new_trips_df = NonProxyTripPopulator(persons_df, trips_df).populate(host_trips, members)
+
+    # Host columns, member columns, and the member is a passenger of a driving host
+    host_cols = ['hh_id', 'day_id', 'day_num', 'travel_date', 'depart_time', 'arrive_time', 'd_lat', 'd_lon', 'mode_type', 'joint_trip_num', 'joint_trip_id', 'hh_member_1']
+    pd.testing.assert_frame_equal(new_trips_df[host_cols].reset_index(drop=True), host_trips[host_cols].reset_index(drop=True))
+    assert new_trips_df['person_id'].tolist() == members['hh_member_id'].tolist()
+    assert new_trips_df['person_num'].tolist() == members['hh_member_num'].tolist()
+    assert new_trips_df['driver'].tolist() == [2, 3]
+    assert (new_trips_df['corrected_hh_members'] == 0).all()
+
+    # Same dtypes as the trips table, and new trip numbers after the member's last trip
+    assert (new_trips_df.dtypes == trips_df[new_trips_df.columns].dtypes).all()
+    last_trip_nums = trips_df.groupby('person_id')['trip_num'].max().reindex(members['hh_member_id'], fill_value=0)
+    assert (new_trips_df['trip_num'].to_numpy() == last_trip_nums.to_numpy() + 1).all()
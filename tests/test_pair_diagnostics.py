@@ -0,0 +1,64 @@
+import os
+import tempfile
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from nonproxy.pair_diagnostics import PairDiagnostics
+from nonproxy.timespace_buffer import fix_existing_joint_trips
+
+DISTANCE = 250
+TIME = timedelta(minutes=15)
+
+
+def read_pairs(path: str) -> pd.DataFrame:
+    pairs = pd.read_parquet(path)
+    pairs['day_num'] = pairs['day_num'].astype(int)
+
+    return pairs.sort_values(['trip_id_a', 'trip_id_b']).reset_index(drop=True)
+
+
+def test_shards_write_one_dataset():
+    path = tempfile.mkdtemp(prefix='pairs_', dir=os.getcwd())
+    hh_trips = pd.DataFrame(
+        {'trip_id': np.arange(101, 109)},
+        index=pd.MultiIndex.from_arrays([[1, 1, 1, 1, 2, 2, 2, 2], [1, 1, 2, 2, 1, 1, 3, 3]], names=['hh_id', 'day_num'])
+        )
+    a_rows, b_rows = np.array([0, 2, 4, 6]), np.array([1, 3, 5, 7])
+    deltas = {
+        'odist': np.arange(4.0), 'ddist': np.arange(4.0),
+        'otimedelta': np.arange(4) * np.timedelta64(60, 's'), 'dtimedelta': np.arange(4) * np.timedelta64(60, 's'),
+        }
+    is_within = np.array([True, False, True, False])
+
+    # Two shards of the same dataset, with a batch size that flushes in the middle of a write
+    sinks = [PairDiagnostics(path, batch_size=3, prefix=f'shard{i}') for i in range(2)]
+    sinks[0].clear()
+    for sink in sinks:
+        sink.write(hh_trips, a_rows, b_rows, deltas, is_within)
+        assert sink.n_written == 3 and sink.n_buffered == 1
+        sink.close()
+        assert sink.n_written == 4 and sink.n_buffered == 0
+
+    # Partitioned by day number, each shard with its own part files
+    assert sorted(os.listdir(path)) == ['day_num=1', 'day_num=2', 'day_num=3']
+    part_files = [name for day_dir in os.listdir(path) for name in os.listdir(os.path.join(path, day_dir))]
+    assert {name.split('-')[0] for name in part_files} == {'shard0', 'shard1'}
+
+    pairs = read_pairs(path)
+    assert pairs.shape[0] == 8
+    assert pairs[['trip_id_a', 'trip_id_b', 'day_num']].drop_duplicates().values.tolist() == [[101, 102, 1], [103, 104, 2], [105, 106, 1], [107, 108, 3]]
+    assert pairs.groupby('trip_id_a')['otimedelta'].first().tolist() == [0, 60, 120, 180]
+    assert pairs['is_within'].sum() == 4
+
+
+def test_parallel_diagnostics_match_serial(trips_df):
+    paths = [tempfile.mkdtemp(prefix='pairs_', dir=os.getcwd()) for _ in range(2)]
+
+    fix_existing_joint_trips(trips_df.copy(), DISTANCE, TIME, batched=True, workers=1, diagnostics=paths[0])
+    fix_existing_joint_trips(trips_df.copy(), DISTANCE, TIME, batched=True, workers=2, diagnostics=paths[1])
+
+    serial, parallel = read_pairs(paths[0]), read_pairs(paths[1])
+    assert serial['is_within'].any() and not serial['is_within'].all()
+    pd.testing.assert_frame_equal(parallel[serial.columns], serial)
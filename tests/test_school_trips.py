@@ -0,0 +1,163 @@
+from datetime import time
+
+import pandas as pd
+import pytest
+
+from school_trips.impute import ImputeSchoolTrips
+from school_trips.escort import match_escort_trips
+from school_trips.populator import SchoolTripPopulator
+from school_trips.reference_trips import REFERENCE_SCHOOL_TRIPS
+from school_trips.school_locations import SCHOOL_LOCATIONS
+from school_trips.time_sampler import TIME_SAMPLERS, TimeSampler
+from school_trips.time_distributions import ALL_LEVELS
+from utils.trip_counter import TRIP_COUNTER
+from utils.travel_dates import TRAVEL_DATES
+from utils.id_registry import ID_REGISTRY
+
+
+def test_missing_school_days_are_per_person():
+    # Two school age siblings and a parent, only the first sibling has a school trip on day 1
+    persons_df = pd.DataFrame(
+        {'hh_id': 23000001, 'age': [2, 2, 5], 'school_type': 1},
+        index=pd.Index([2300000101, 2300000102, 2300000103], name='person_id')
+        )
+    days_df = pd.DataFrame({
+        'hh_id': 23000001,
+        'person_id': [2300000101, 2300000101, 2300000102, 2300000102, 2300000103],
+        'day_num': [1, 2, 1, 2, 1],
+        }, index=pd.Index([230000010101, 230000010102, 230000010201, 230000010202, 230000010301], name='day_id'))
+    trips_df = pd.DataFrame({
+        'hh_id': 23000001,
+        'person_id': [2300000101, 2300000101, 2300000102, 2300000103],
+        'day_num': [1, 1, 1, 1],
+        'd_purpose_category': [4, 1, 1, 4],
+        }, index=pd.Index([2300000101001, 2300000101002, 2300000102001, 2300000103001], name='trip_id'))
+
+    missing_days_df = ImputeSchoolTrips().find_missing_school_days(persons_df, days_df, trips_df)
+
+    assert missing_days_df.index.tolist() == [230000010102, 230000010201, 230000010202]
+
+
+def escort_tables(escort_arrival: str) -> tuple:
+    """
+    A child with a school trip arriving at 08:00 local on day 2, missing it on day 1, and a parent
+    with an escort trip to the school on day 1 arriving at the given local time.
+    """
+
+    persons_df = pd.DataFrame(
+        {'hh_id': 23000001, 'age': [2, 5], 'school_type': 1},
+        index=pd.Index([2300000101, 2300000102], name='person_id')
+        )
+    households_df = pd.DataFrame({'home_lat': [32.80], 'home_lon': [-117.10]}, index=pd.Index([23000001], name='hh_id'))
+    missing_days_df = pd.DataFrame(
+        {'hh_id': [23000001], 'person_id': [2300000101], 'day_num': [1]},
+        index=pd.Index([230000010101], name='day_id')
+        )
+    arrivals = pd.to_datetime(['2022-05-03 08:00', f'2022-05-02 {escort_arrival}']).tz_localize('America/Los_Angeles')
+    trips_df = pd.DataFrame({
+        'hh_id': 23000001,
+        'person_id': [2300000101, 2300000102],
+        'day_num': [2, 1],
+        'arrive_time': arrivals.tz_convert('UTC'),
+        'd_lat': 32.82, 'd_lon': -117.10,
+        'd_purpose': [21, 6],
+        }, index=pd.Index([2300000101001, 2300000102001], name='trip_id'))
+
+    return missing_days_df, trips_df, persons_df, households_df
+
+
+@pytest.mark.parametrize('escort_arrival, is_matched', [('08:10', True), ('08:25', False)])
+def test_escort_pick_up_is_not_matched(escort_arrival, is_matched):
+    missing_days_df, trips_df, persons_df, households_df = escort_tables(escort_arrival)
+    REFERENCE_SCHOOL_TRIPS.initialize(trips_df)
+    SCHOOL_LOCATIONS.initialize(trips_df, persons_df)
+
+    # A 40 minute school day, so the 08:25 escort trip is within ESCORT_MATCH TIME of the arrival but is a pick-up
+    TIME_SAMPLERS.reset()
+    TIME_SAMPLERS.distributions, TIME_SAMPLERS.dwells = {}, {ALL_LEVELS: 40*60}
+
+    try:
+        matches = match_escort_trips(missing_days_df, trips_df, persons_df, households_df)
+    finally:
+        TIME_SAMPLERS.reset()
+
+    assert matches.to_dict() == ({230000010101: 2300000102001} if is_matched else {})
+
+
+def test_altday_imputes_self_reporting_children():
+    # A 16-17 year old (age 3) and a 5-15 year old (age 2), each with a school trip on day 2 and missing it on day 1
+    persons_df = pd.DataFrame(
+        {'hh_id': 23000001, 'person_num': [1, 2], 'age': [3, 2], 'school_type': 1},
+        index=pd.Index([2300000101, 2300000102], name='person_id')
+        )
+    households_df = pd.DataFrame({'home_lat': [32.80], 'home_lon': [-117.10]}, index=pd.Index([23000001], name='hh_id'))
+    missing_days_df = pd.DataFrame({
+        'hh_id': 23000001,
+        'person_id': [2300000101, 2300000102],
+        'day_num': 1,
+        'travel_date': pd.to_datetime(['2022-05-02', '2022-05-02']).date,
+        }, index=pd.Index([230000010101, 230000010201], name='day_id'))
+    departs = pd.to_datetime(['2022-05-03 07:40', '2022-05-03 07:50']).tz_localize('America/Los_Angeles').tz_convert('UTC')
+    trips_df = pd.DataFrame({
+        'hh_id': 23000001,
+        'person_id': [2300000101, 2300000102],
+        'day_id': [230000010102, 230000010202],
+        'day_num': 2,
+        'trip_num': 1,
+        'travel_date': pd.to_datetime(['2022-05-03', '2022-05-03']).date,
+        'depart_time': departs,
+        'arrive_time': departs + pd.Timedelta(minutes=20),
+        'd_lat': 32.82, 'd_lon': -117.10,
+        'd_purpose': 21,
+        'd_purpose_category': 4,
+        'joint_trip_num': 995,
+        'joint_trip_id': 995,
+        }, index=pd.Index([2300000101001, 2300000102001], name='trip_id'))
+
+    TRIP_COUNTER.initialize(trips_df)
+    TRAVEL_DATES.initialize(trips_df)
+    ID_REGISTRY.initialize(trips_df)
+    REFERENCE_SCHOOL_TRIPS.initialize(trips_df)
+
+    altday_trips_df = ImputeSchoolTrips().impute_from_altday(missing_days_df, persons_df, households_df)
+
+    assert altday_trips_df.index.tolist() == [2300000101002]
+    new_trip = altday_trips_df.iloc[0]
+    assert (new_trip['day_id'], new_trip['trip_num'], new_trip['d_purpose']) == (230000010101, 2, 21)
+    assert new_trip['depart_time'] == pd.Timestamp('2022-05-02 07:40', tz='America/Los_Angeles')
+
+
+@pytest.mark.parametrize('travel_date, depart_local, depart_utc', [
+    ('2022-11-06', time(1, 30), '2022-11-06 08:30'),    # Fall-back, 01:30 happens twice, the first is daylight saving time
+    ('2022-03-13', time(2, 30), '2022-03-13 10:00'),    # Spring-forward, 02:30 does not exist and shifts forward to 03:00 PDT
+    ('2022-05-03', time(1, 30), '2022-05-03 08:30'),
+    ])
+def test_sampled_times_cross_daylight_saving(travel_date, depart_local, depart_utc):
+    dep_freq = pd.Series([1.0], index=[depart_local])
+    dur_freq = pd.Series([1.0], index=pd.to_timedelta([20], unit='m'))
+
+    times = TimeSampler(dep_freq, dur_freq, seed=0).sample([travel_date] * 3, 'America/Los_Angeles', 'UTC')
+
+    assert times['depart_time'].notna().all() and times['arrive_time'].notna().all()
+    assert (times['depart_time'] == pd.Timestamp(depart_utc, tz='UTC')).all()
+    assert (times['arrive_time'] - times['depart_time'] == pd.Timedelta(minutes=20)).all()
+
+
+def test_shifted_times_cross_daylight_saving():
+    # Host trips at 01:30 local, shifted onto the fall-back day where 01:30 happens twice
+    host_departs = pd.to_datetime(['2022-11-05 08:30', '2022-11-07 09:30', '2022-11-06 09:30', '2022-11-06 08:30'], utc=True)
+    host_trips = pd.DataFrame({
+        'travel_date': host_departs.tz_convert('America/Los_Angeles').date,
+        'depart_time': host_departs,
+        }, index=pd.Index([1, 2, 3, 4], name='trip_id'))
+    days = pd.DataFrame({'travel_date': pd.to_datetime(['2022-11-06'] * 3 + ['2022-11-07']).date}, index=pd.Index([1, 2, 3, 4], name='day_id'))
+
+    populator = SchoolTripPopulator(pd.DataFrame(), pd.DataFrame())
+    shifted = pd.Series(populator.shift_times(colname='depart_time', host_trips=host_trips, days=days))
+
+    # Same as the host trip UTC offset, PDT from the day before, PST from the day after and the repeated hour itself
+    assert shifted.notna().all()
+    assert shifted.tolist() == pd.to_datetime(['2022-11-06 08:30', '2022-11-06 09:30', '2022-11-06 09:30', '2022-11-07 09:30'], utc=True).tolist()
+
+    depart_dates = populator.shift_times(colname='depart_date', host_trips=host_trips, days=days)
+    assert depart_dates.tolist() == days['travel_date'].tolist()
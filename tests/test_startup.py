@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter, counting every table fetch and parquet or SQL read during `import run`
+IMPORT_RUN = """
+import sys
+sys.path.insert(0, {package!r})
+
+import pandas as pd
+from utils.io import IO
+
+reads = []
+
+def counted(name, func):
+    def wrapper(*args, **kwargs):
+        values = list(args) + list(kwargs.values())
+        source = values[1] if name == 'DBIO.get_table' else values[0]
+        reads.append(f'{{name}}({{source!r}})')
+        return func(*args, **kwargs)
+    return wrapper
+
+IO.get_table = counted('DBIO.get_table', IO.get_table)
+pd.read_parquet = counted('pd.read_parquet', pd.read_parquet)
+pd.read_sql = counted('pd.read_sql', pd.read_sql)
+
+import run
+
+print(reads)
+"""
+
+
+def test_import_run_reads_no_data(tmp_path):
+    # Run from a scratch directory with the repository configs, so the cache and output folders are created there
+    os.symlink(os.path.join(ROOT, 'configs'), tmp_path / 'configs')
+    code = IMPORT_RUN.format(package=os.path.join(ROOT, 'child_trip_imputation'))
+
+    result = subprocess.run([sys.executable, '-c', code], cwd=tmp_path, capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == '[]', f'Importing run read data: {result.stdout}'
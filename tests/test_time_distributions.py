@@ -0,0 +1,130 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import settings
+import school_trips.time_distributions as time_distributions
+from school_trips.time_distributions import ALL_LEVELS, MIN_LEVEL_TRIPS, build_time_distributions, load_time_distributions, school_dwells
+from school_trips.time_sampler import TIME_SAMPLERS
+
+K12, PRESCHOOL = 21, 26
+TZ = 'America/Los_Angeles'
+
+
+def school_tables(n_k12: int = MIN_LEVEL_TRIPS + 10, n_preschool: int = 5, seed: int = 0) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    The persons and trips of K-12 students (age 2) and a few preschoolers (age 1), each with a school trip
+    and a trip home from school on one day.
+    """
+
+    rng = np.random.default_rng(seed)
+    ages = [2] * n_k12 + [1] * n_preschool
+    persons_df = pd.DataFrame({'age': ages}, index=pd.Index(2300000001 + np.arange(len(ages)), name='person_id'))
+
+    # Preschool starts later and lasts longer than K-12
+    is_preschool = persons_df['age'].to_numpy() == 1
+    school_depart = pd.Timestamp('2022-05-03 07:00', tz=TZ) + pd.to_timedelta(rng.integers(0, 3600, len(ages)) + 7200 * is_preschool, unit='s')
+    school_arrive = school_depart + pd.to_timedelta(rng.integers(600, 1800, len(ages)), unit='s')
+    home_depart = school_arrive + pd.to_timedelta(np.where(is_preschool, 4, 6) * 3600, unit='s')
+    home_arrive = home_depart + pd.Timedelta(minutes=20)
+
+    trips_df = pd.DataFrame({
+        'person_id': np.tile(persons_df.index, 2),
+        'day_num': 1,
+        'trip_num': np.repeat([1, 2], len(ages)),
+        'depart_time': np.concatenate([school_depart, home_depart]),
+        'arrive_time': np.concatenate([school_arrive, home_arrive]),
+        'd_purpose': np.concatenate([np.where(is_preschool, PRESCHOOL, K12), np.ones(len(ages), dtype=int)]),
+        })
+    trips_df['depart_hour'] = trips_df['depart_time'].dt.hour
+    trips_df['arrive_hour'] = trips_df['arrive_time'].dt.hour
+    trips_df[['depart_time', 'arrive_time']] = trips_df[['depart_time', 'arrive_time']].apply(lambda t: t.dt.tz_convert('UTC'))
+    trips_df.index = pd.Index(trips_df['person_id'] * 1000 + 100 + trips_df['trip_num'], name='trip_id')
+
+    return persons_df, trips_df
+
+
+def test_sparse_levels_fall_back_to_all_school_trips():
+    persons_df, trips_df = school_tables()
+
+    distributions = build_time_distributions(trips_df, persons_df, 'KDE')
+    dwells = school_dwells(trips_df, persons_df)
+
+    # Preschool has fewer than MIN_LEVEL_TRIPS school trips, so it has no distributions of its own
+    assert set(distributions) == {ALL_LEVELS, K12}
+    assert set(dwells) == {ALL_LEVELS, K12}
+
+    TIME_SAMPLERS.reset()
+    TIME_SAMPLERS.distributions, TIME_SAMPLERS.dwells = distributions, dwells
+    TIME_SAMPLERS.rng = np.random.default_rng(0)
+
+    assert TIME_SAMPLERS.get(PRESCHOOL) is TIME_SAMPLERS.get(ALL_LEVELS)
+    assert TIME_SAMPLERS.get(K12) is not TIME_SAMPLERS.get(ALL_LEVELS)
+    assert TIME_SAMPLERS.dwell([K12, PRESCHOOL]).tolist() == [dwells[K12], dwells[ALL_LEVELS]]
+    TIME_SAMPLERS.reset()
+
+    # The unstratified distributions include the preschool trips, which depart later
+    all_dep, k12_dep = distributions[ALL_LEVELS][0], distributions[K12][0]
+    late = [t.hour >= 9 for t in all_dep.index]
+    assert all_dep[late].sum() / all_dep.sum() > k12_dep[late].sum() / k12_dep.sum()
+
+    # With enough preschool trips, preschool gets its own distributions
+    persons_df, trips_df = school_tables(n_preschool=MIN_LEVEL_TRIPS)
+    assert set(build_time_distributions(trips_df, persons_df, 'KDE')) == {ALL_LEVELS, K12, PRESCHOOL}
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    # A fresh cache directory in the scratch working directory, counting the distribution builds
+    monkeypatch.setattr(settings, 'CACHE_DIR', tempfile.mkdtemp(prefix='cache_', dir=os.getcwd()))
+
+    calls = []
+    build = time_distributions.build_time_distributions
+
+    def spy(*args, **kwargs):
+        calls.append(args)
+        return build(*args, **kwargs)
+
+    monkeypatch.setattr(time_distributions, 'build_time_distributions', spy)
+
+    return calls
+
+
+def test_distributions_cache_is_keyed_by_the_inputs(builds, monkeypatch):
+    persons_df, trips_df = school_tables()
+
+    # Miss, then a hit with the same distributions
+    built = load_time_distributions(trips_df, persons_df)
+    cached = load_time_distributions(trips_df.copy(), persons_df.copy())
+    assert len(builds) == 1 and len(os.listdir(settings.CACHE_DIR)) == 1
+
+    assert set(cached) == set(built)
+    for level in built:
+        for cached_freq, built_freq in zip(cached[level], built[level]):
+            assert cached_freq.index.tolist() == built_freq.index.tolist()
+            np.testing.assert_allclose(cached_freq.to_numpy(), built_freq.to_numpy())
+
+    # A changed school trip time, a changed age or a changed setting is a miss
+    changed_trips_df = trips_df.copy()
+    changed_trips_df.iloc[0, changed_trips_df.columns.get_loc('arrive_time')] += pd.Timedelta(minutes=5)
+    load_time_distributions(changed_trips_df, persons_df)
+    assert len(builds) == 2
+
+    changed_persons_df = persons_df.copy()
+    changed_persons_df.iloc[0, 0] = 3
+    load_time_distributions(trips_df, changed_persons_df)
+    assert len(builds) == 3
+
+    monkeypatch.setattr(settings, 'TIME_INCREMENT', '15Min')
+    load_time_distributions(trips_df, persons_df)
+    assert len(builds) == 4 and len(os.listdir(settings.CACHE_DIR)) == 4
+
+    # Changes to trips that are not school trips are still a hit
+    monkeypatch.setattr(settings, 'TIME_INCREMENT', '30Min')
+    other_trips_df = trips_df.copy()
+    other_trips_df.loc[other_trips_df['d_purpose'] == 1, 'arrive_time'] += pd.Timedelta(minutes=5)
+    load_time_distributions(other_trips_df, persons_df)
+    assert len(builds) == 4
@@ -0,0 +1,109 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import settings
+from utils.distance import MARGIN, haversine
+from utils.misc import group_offsets
+from nonproxy.timespace_buffer import fix_existing_joint_trips, find_threshold_pairs
+
+DISTANCE = 250
+TIME = timedelta(minutes=15)
+
+
+def test_batched_matches_per_group(trips_df):
+    per_group = fix_existing_joint_trips(trips_df.copy(), DISTANCE, TIME, batched=False)
+    batched = fix_existing_joint_trips(trips_df.copy(), DISTANCE, TIME, batched=True)
+
+    # The synthetic households do have joint trips and unreported members to fix
+    assert (per_group['joint_trip_num'] != 995).any()
+    assert per_group['corrected_hh_members'].sum() > 0
+
+    pd.testing.assert_frame_equal(batched, per_group)
+
+
+def test_batched_matches_per_group_sweep(trips_df):
+    per_group = fix_existing_joint_trips(trips_df.copy(), DISTANCE, TIME, batched=False, index='sweep')
+    batched = fix_existing_joint_trips(trips_df.copy(), DISTANCE, TIME, batched=True, index='sweep')
+
+    pd.testing.assert_frame_equal(batched, per_group)
+
+
+def boundary_trips(trips_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The trimmed trips of a household-day with trips exactly at the TIME boundary and within MARGIN of the
+    DISTANCE threshold, followed by the synthetic trips, sorted by household and day.
+    """
+
+    t0 = pd.Timestamp('2022-05-02 15:00', tz='UTC')
+    lat, lon = 32.8, -117.1
+    # Latitude offsets in degrees that are exactly the given distance in meters
+    north = lambda meters: lat + np.degrees(meters / settings.R)
+
+    cases = [
+        # depart offset, arrive offset, destination latitude
+        (timedelta(0), timedelta(0), lat),
+        (TIME, TIME, lat),                                                  # exactly at the time boundary
+        (TIME - timedelta(seconds=1), TIME, lat),                           # arrival exactly at the boundary
+        (TIME - timedelta(seconds=1), TIME - timedelta(seconds=1), lat),    # just inside the time window
+        (timedelta(minutes=1), timedelta(minutes=1), north(DISTANCE * (1 - MARGIN / 2))),
+        (timedelta(minutes=1), timedelta(minutes=1), north(DISTANCE * (1 + MARGIN / 2))),
+        (timedelta(minutes=2), timedelta(minutes=2), north(DISTANCE * (1 - MARGIN / 10))),
+        ]
+
+    boundary = pd.DataFrame({
+        'hh_id': 22999999,
+        'day_num': 1,
+        'trip_id': np.arange(len(cases)),
+        'depart_time': [t0 + depart for depart, _, _ in cases],
+        'arrive_time': [t0 + timedelta(minutes=20) + arrive for _, arrive, _ in cases],
+        'o_lat': lat, 'o_lon': lon,
+        'd_lat': [d_lat for _, _, d_lat in cases], 'd_lon': lon + 0.01,
+        })
+
+    synthetic = trips_df.reset_index()[boundary.columns]
+
+    return pd.concat([boundary, synthetic]).set_index(['hh_id', 'day_num']).sort_index(kind='stable')
+
+
+def test_sweep_matches_dense_at_boundaries(trips_df):
+    hh_trips = boundary_trips(trips_df)
+    starts, sizes = group_offsets(
+        hh_trips.index.get_level_values('hh_id').to_numpy(),
+        hh_trips.index.get_level_values('day_num').to_numpy()
+        )
+
+    dense = find_threshold_pairs(hh_trips, starts, sizes, DISTANCE, TIME, 'dense')
+    sweep = find_threshold_pairs(hh_trips, starts, sizes, DISTANCE, TIME, 'sweep')
+
+    np.testing.assert_array_equal(sweep[0], dense[0])
+    np.testing.assert_array_equal(sweep[1], dense[1])
+
+    # Both match the exact thresholds on the boundary household-day, the time and distance buffers are exclusive
+    otimes, dtimes = hh_trips['depart_time'].values, hh_trips['arrive_time'].values
+    olatlons = np.radians(hh_trips[['o_lat', 'o_lon']].to_numpy(dtype=float))
+    dlatlons = np.radians(hh_trips[['d_lat', 'd_lon']].to_numpy(dtype=float))
+    a, b = np.nonzero(~np.eye(7, dtype=bool))
+    is_pair = (np.abs(otimes[a] - otimes[b]) < np.timedelta64(TIME)) & (np.abs(dtimes[a] - dtimes[b]) < np.timedelta64(TIME))
+    is_pair &= haversine(olatlons[a], olatlons[b])*settings.R < DISTANCE
+    is_pair &= haversine(dlatlons[a], dlatlons[b])*settings.R < DISTANCE
+
+    in_boundary = dense[0] < 7
+    expected = set(zip(a[is_pair].tolist(), b[is_pair].tolist()))
+    assert set(zip(dense[0][in_boundary].tolist(), dense[1][in_boundary].tolist())) == expected
+    assert (0, 1) not in expected and (0, 3) in expected and (0, 4) in expected and (0, 5) not in expected
+
+
+def test_parallel_matches_serial(trips_df):
+    serial = fix_existing_joint_trips(trips_df.copy(), DISTANCE, TIME, batched=True, index='sweep', workers=1)
+    parallel = fix_existing_joint_trips(trips_df.copy(), DISTANCE, TIME, batched=True, index='sweep', workers=2)
+
+    pd.testing.assert_frame_equal(parallel, serial)
+
+
+def test_parallel_matches_serial_per_group(trips_df):
+    serial = fix_existing_joint_trips(trips_df.copy(), DISTANCE, TIME, batched=False, workers=1)
+    parallel = fix_existing_joint_trips(trips_df.copy(), DISTANCE, TIME, batched=False, workers=2)
+
+    pd.testing.assert_frame_equal(parallel, serial)
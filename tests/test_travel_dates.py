@@ -0,0 +1,69 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.travel_dates import TravelDateIndex, TRAVEL_DATES
+from nonproxy.populator import NonProxyTripPopulator
+from school_trips.populator import SchoolTripPopulator
+
+MAY_2, MAY_3, MAY_4 = datetime.date(2022, 5, 2), datetime.date(2022, 5, 3), datetime.date(2022, 5, 4)
+
+
+def dated_trips() -> pd.DataFrame:
+    # Person 101 travels on May 3 and 4, person 102 on May 3 with a trip missing its date, person 103 has no trips
+    return pd.DataFrame({
+        'person_id': [101, 101, 102, 102],
+        'travel_date': [MAY_4, MAY_3, MAY_3, None],
+        'first_travel_date': MAY_3,
+        'last_travel_date': MAY_4,
+        }, index=pd.Index([101001, 101002, 102001, 102002], name='trip_id'))
+
+
+def test_index_extends_first_and_last_dates():
+    index = TravelDateIndex(dated_trips())
+
+    assert index.lookup('min', [101, 102, 103]) == [MAY_3, MAY_3, None]
+    assert index.lookup('max', [101, 102, 103]) == [MAY_4, MAY_3, None]
+
+    # The extra dates extend the lookups, but not the index
+    assert index.lookup('min', [101, 102, 103], [MAY_2, MAY_4, MAY_4]) == [MAY_2, MAY_3, MAY_4]
+    assert index.lookup('max', [101, 102, 103], [MAY_2, MAY_4, None]) == [MAY_4, MAY_4, None]
+    assert index.lookup('min', [101]) == [MAY_3]
+
+    # Imputed trips extend the index
+    index.update([102, 103, 101], [MAY_2, MAY_4, MAY_3])
+    assert index.lookup('min', [101, 102, 103]) == [MAY_3, MAY_2, MAY_4]
+    assert index.lookup('max', [101, 102, 103]) == [MAY_4, MAY_3, MAY_4]
+
+
+def test_joint_trip_dates_include_the_host_trip():
+    TRAVEL_DATES.initialize(dated_trips())
+
+    # Host trips of the joint trips imputed for persons 101, 102 and 103
+    host_trips = pd.DataFrame({'travel_date': [MAY_2, MAY_4, MAY_4]}, index=pd.Index([201001, 202001, 203001], name='trip_id'))
+    kwargs = {'host_trips': host_trips, 'member_ids': np.array([101, 102, 103])}
+
+    populator = NonProxyTripPopulator(pd.DataFrame(), pd.DataFrame())
+
+    assert list(populator.update_first_date(**kwargs)) == [MAY_2, MAY_3, MAY_4]
+    assert list(populator.update_last_date(**kwargs)) == [MAY_4, MAY_4, MAY_4]
+
+
+def test_school_trip_dates_include_the_new_day():
+    TRAVEL_DATES.initialize(dated_trips())
+
+    # New school trips for persons 101, 102 and 103, from host trips on other days
+    days = pd.DataFrame({'person_id': [101, 102, 103], 'travel_date': [MAY_2, MAY_4, MAY_3]}, index=pd.Index([10102, 10202, 10302], name='day_id'))
+    host_trips = dated_trips().iloc[[1, 2, 2]]
+    kwargs = {'host_trips': host_trips, 'days': days}
+
+    populator = SchoolTripPopulator(pd.DataFrame(), pd.DataFrame())
+
+    assert list(populator.update_first_date(colname='first_travel_date', **kwargs)) == [MAY_2, MAY_3, MAY_3]
+    assert list(populator.update_last_date(colname='last_travel_date', **kwargs)) == [MAY_4, MAY_4, MAY_3]
+
+    # After imputing, the next lookups see the new days
+    TRAVEL_DATES.update(days['person_id'], days['travel_date'])
+    assert TRAVEL_DATES.lookup('min', [101, 102, 103]) == [MAY_2, MAY_3, MAY_3]
+    assert TRAVEL_DATES.lookup('max', [101, 102, 103]) == [MAY_4, MAY_4, MAY_3]
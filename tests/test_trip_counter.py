@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from utils.trip_counter import TripCounter
+
+
+def flagged_trips() -> pd.DataFrame:
+    # Household 23000008 has joint trip 1 flagged, its other trips carry 995
+    return pd.DataFrame({
+        'trip_id': [2300000801001, 2300000801002, 2300000802001, 2300000901001],
+        'person_id': [2300000801, 2300000801, 2300000802, 2300000901],
+        'hh_id': [23000008, 23000008, 23000008, 23000009],
+        'trip_num': [1, 2, 1, 1],
+        'joint_trip_num': [1, 995, 995, np.nan],
+        'joint_trip_id': [2300000801, 995, 995, np.nan],
+        }).set_index('trip_id')
+
+
+def test_allocate_continues_flagged_joint_trips():
+    counter = TripCounter(flagged_trips())
+
+    nums, ids = counter.allocate('joint_trip', [23000008, 23000008])
+
+    assert nums.tolist() == [2, 3]
+    assert ids.tolist() == [2300000802, 2300000803]
+
+
+def test_allocate_starts_households_without_joint_trips():
+    counter = TripCounter(flagged_trips())
+
+    nums, ids = counter.allocate('joint_trip', [23000009, 23000010])
+
+    assert nums.tolist() == [1, 1]
+    assert ids.tolist() == [2300000901, 2300001001]
+
+
+def test_allocate_trip_blocks():
+    counter = TripCounter(flagged_trips())
+
+    nums, ids = counter.allocate('trip', [2300000801, 2300000802, 2300000801], [2, 1, 1])
+
+    assert nums.tolist() == [3, 2, 5]
+    assert ids.tolist() == [2300000801003, 2300000802002, 2300000801005]
+    assert counter.trip.loc[2300000801].tolist() == [5, 2300000801005]